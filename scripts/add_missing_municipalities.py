@@ -2,19 +2,9 @@
 """
 欠けている2自治体（狛江市13219、羽村市13227）をデータベースに追加
 """
-import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
+from db import get_client
 
-# 環境変数読み込み
-load_dotenv()
-supabase_url = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
-supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-
-if not supabase_url or not supabase_key:
-    raise Exception('.env.localにSupabaseの環境変数が設定されていません')
-
-supabase: Client = create_client(supabase_url, supabase_key)
+supabase = get_client()
 
 # 追加する自治体
 municipalities = [
@@ -58,3 +48,4 @@ print("1. scripts/parse_excels.py を実行してExcelデータを解析")
 print("2. scripts/seed_supabase.py を実行してKPIとemissionsデータを投入")
 print("3. scripts/import_tokyo_population_area.py を実行して人口・面積を更新")
 print("4. scripts/recalc_emission_per_capita.py を実行して一人当たりCO2を計算")
+print("（scripts/run_pipeline.py で変更のあったステップだけをまとめて実行できます）")
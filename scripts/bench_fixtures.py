@@ -0,0 +1,91 @@
+"""
+ベンチマーク用の合成データ生成
+
+排出量カルテ形式のExcel（1自治体1ファイル、または複数自治体を含む1ファイル）と、
+parse_excel() の出力と同じ形式のパース結果を、ネットワークなしで生成する。
+"""
+import random
+from pathlib import Path
+from typing import Dict, List, Sequence
+import openpyxl
+from parse_excels import SHEET_NAME, HEADER_ROW, COL_YEAR, COL_CITY_CODE, COL_CITY_NAME, COL_DATA_START
+
+SECTOR_HEADERS = [
+    'aa_製造業', 'aa_建設業・鉱業', 'aa_農林水産業', 'aa_業務その他部門', 'aa_家庭部門',
+    'aa_旅客自動車', 'aa_貨物自動車', 'aa_鉄道', 'aa_船舶', 'aa_一般廃棄物'
+]
+SECTORS = ['製造業', '建設業', '農林水産業', '業務その他', '家庭',
+           '旅客', '貨物', '鉄道', '船舶', '廃棄物']
+YEARS = list(range(2005, 2023))
+
+
+def synthetic_city_codes(count: int) -> List[str]:
+    """47都道府県に均等に割り振った団体コード（5桁、昇順）を count 件生成"""
+    return sorted(f"{1 + i % 47:02d}{100 + i // 47:03d}" for i in range(count))
+
+
+def generate_records(city_codes: Sequence[str], seed: int = 0,
+                     missing_rate: float = 0.02) -> List[Dict]:
+    """
+    parse_excel() の出力と同じ形式の排出量データを生成
+
+    Args:
+        city_codes: 団体コードのリスト
+        seed: 乱数シード
+        missing_rate: 一部の年度・部門が欠けた自治体の割合（KPI対象外の自治体を混ぜる）
+
+    Returns:
+        パース結果の辞書のリスト
+    """
+    rng = random.Random(seed)
+    records = []
+    for city_code in city_codes:
+        years = YEARS
+        sectors = SECTORS
+        if rng.random() < missing_rate:
+            years = [year for year in YEARS if year != rng.choice([2013, 2022])]
+            sectors = SECTORS[:-1]
+        emissions = {
+            sector: {year: round(rng.uniform(0, 500), 3) for year in years}
+            for sector in sectors
+        }
+        records.append({
+            'city_code': city_code,
+            'city_name': f"自治体{city_code}",
+            'years': list(years),
+            'emissions': emissions
+        })
+    return records
+
+
+def write_karte_workbook(file_path: Path, records: List[Dict]):
+    """
+    パース結果の形式のデータをカルテ形式のExcelに書き出す（書き込み専用モード）
+
+    1自治体なら自治体ごとのファイル、複数なら都道府県・全国版のような共有ファイルになる。
+
+    Args:
+        file_path: 出力先
+        records: generate_records() と同じ形式のデータ
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(SHEET_NAME)
+    width = COL_DATA_START + len(SECTORS) - 1
+
+    for _ in range(HEADER_ROW - 1):
+        ws.append([])
+    header = [None] * width
+    header[COL_DATA_START - 1:] = SECTOR_HEADERS
+    ws.append(header)
+
+    for record in records:
+        for year in record['years']:
+            row = [None] * width
+            row[COL_YEAR - 1] = year
+            row[COL_CITY_CODE - 1] = int(record['city_code'])
+            row[COL_CITY_NAME - 1] = record['city_name']
+            for offset, sector in enumerate(SECTORS):
+                row[COL_DATA_START - 1 + offset] = record['emissions'].get(sector, {}).get(year)
+            ws.append(row)
+
+    wb.save(file_path)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+kpi_calculator のバッチ版とスカラー版のベンチマーク
+
+（値の一致は tests/test_kpi_calculator.py で確認する）
+
+実行: python bench_kpi_calculator.py --sizes 1900 100000
+"""
+import argparse
+import time
+from typing import Dict, List
+import numpy as np
+from kpi_calculator import (
+    calc_actual_pace,
+    calc_required_pace,
+    calc_pace_achievement_rate,
+    calc_shortfall_2030,
+    calc_reduction_rate,
+    calc_emission_per_capita,
+    determine_status,
+    calc_kpis_batch
+)
+
+BASE_YEAR = 2013
+LATEST_YEAR = 2022
+TARGET_REDUCTION_RATE = 0.46
+
+
+def generate_inputs(size: int, seed: int = 0) -> Dict[str, np.ndarray]:
+    """ゼロ・負値・人口0を含むランダムな入力を生成"""
+    rng = np.random.default_rng(seed)
+    base = np.round(rng.uniform(1, 20000, size), 2)
+    latest = np.round(base * rng.uniform(0.4, 1.3, size), 2)
+    population = rng.integers(500, 1_000_000, size).astype(float)
+
+    # ガード分岐を通るケースを混ぜる
+    edge = rng.choice(size, size=max(1, size // 50), replace=False)
+    base[edge[0::3]] = 0.0
+    latest[edge[1::3]] = -1.0
+    population[edge[2::3]] = 0.0
+    return {'base': base, 'latest': latest, 'population': population}
+
+
+def calc_kpis_scalar(inputs: Dict[str, np.ndarray]) -> Dict[str, List]:
+    """スカラー版をPythonループで呼び出す（seed_municipality_kpis の旧実装と同じ）"""
+    kpis = {key: [] for key in ['reduction_rate', 'actual_pace', 'required_pace',
+                                'pace_achievement_rate', 'shortfall_2030', 'status',
+                                'emission_per_capita']}
+    for base, latest, population in zip(inputs['base'].tolist(), inputs['latest'].tolist(),
+                                        inputs['population'].tolist()):
+        actual_pace = calc_actual_pace(base, latest, BASE_YEAR, LATEST_YEAR)
+        required_pace = calc_required_pace(base, TARGET_REDUCTION_RATE, BASE_YEAR)
+        pace_achievement_rate = calc_pace_achievement_rate(actual_pace, required_pace)
+        kpis['reduction_rate'].append(calc_reduction_rate(base, latest))
+        kpis['actual_pace'].append(actual_pace)
+        kpis['required_pace'].append(required_pace)
+        kpis['pace_achievement_rate'].append(pace_achievement_rate)
+        kpis['shortfall_2030'].append(calc_shortfall_2030(base, actual_pace, BASE_YEAR))
+        kpis['status'].append(determine_status(pace_achievement_rate))
+        kpis['emission_per_capita'].append(calc_emission_per_capita(latest, population))
+    return kpis
+
+
+def calc_kpis_vectorized(inputs: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """バッチ版で一括計算"""
+    return calc_kpis_batch(inputs['base'], inputs['latest'], BASE_YEAR, LATEST_YEAR,
+                           TARGET_REDUCTION_RATE, population=inputs['population'])
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="KPIバッチ計算のベンチマーク")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1900, 100000],
+                        help="自治体数（複数指定可）")
+    args = parser.parse_args()
+
+    print(f"{'件数':>8}{'スカラー':>12}{'バッチ':>12}{'倍率':>8}")
+    print("-" * 50)
+    for size in args.sizes:
+        inputs = generate_inputs(size)
+
+        started = time.perf_counter()
+        calc_kpis_scalar(inputs)
+        scalar_sec = time.perf_counter() - started
+
+        started = time.perf_counter()
+        calc_kpis_vectorized(inputs)
+        batch_sec = time.perf_counter() - started
+
+        print(f"{size:>8,}{scalar_sec * 1000:>10.1f}ms{batch_sec * 1000:>10.1f}ms"
+              f"{scalar_sec / batch_sec:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+parse_excel() のベンチマーク
+読み取り専用ストリーミング版と旧ランダムアクセス版を生成したフィクスチャで比較
+
+時間は tracemalloc なしで計測し、ピークメモリは別に1回だけ tracemalloc で計測する
+（tracemalloc を有効にしたままでは両方とも数倍遅くなり、時間の比較にならない）。
+
+実行: python bench_parse_excel.py --rows 2000 --repeat 5
+"""
+import argparse
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+import openpyxl
+from openpyxl.worksheet.worksheet import Worksheet
+from parse_excels import (
+    COL_CITY_CODE,
+    COL_DATA_START,
+    COL_YEAR,
+    DATA_START_ROW,
+    HEADER_ROW,
+    SHEET_NAME,
+    _build_result,
+    normalize_sector_name,
+    parse_excel
+)
+from bench_fixtures import YEARS, generate_records, write_karte_workbook
+
+TARGET_CITY_CODE = '13101'
+
+
+def parse_excel_random_access(file_path: Path, city_code: str, city_name: str) -> Optional[Dict]:
+    """
+    旧実装（比較用）: ワークシート全体を読み込み ws.cell() でセル単位に参照する
+
+    Args:
+        file_path: Excelファイルパス
+        city_code: 団体コード
+        city_name: 自治体名
+
+    Returns:
+        パース結果の辞書、エラー時はNone
+    """
+    try:
+        wb = openpyxl.load_workbook(file_path, data_only=True)
+
+        if SHEET_NAME not in wb.sheetnames:
+            print(f"[ERROR] {city_code} - シート '{SHEET_NAME}' が見つかりません")
+            return None
+
+        ws: Worksheet = wb[SHEET_NAME]
+
+        # ヘッダー行から部門名を取得
+        sectors = {}
+        for col in range(COL_DATA_START, COL_DATA_START + 10):  # 10-19列目のみ
+            header = ws.cell(HEADER_ROW, col).value
+            if header:
+                sectors[col] = normalize_sector_name(header)
+
+        # データ行を走査
+        emissions_by_sector = {}
+        years_set = set()
+
+        for row in range(DATA_START_ROW, ws.max_row + 1):
+            # 団体コードが一致する行のみ処理
+            row_city_code = ws.cell(row, COL_CITY_CODE).value
+            if row_city_code and str(row_city_code) == str(city_code):
+                year_val = ws.cell(row, COL_YEAR).value
+                if year_val:
+                    try:
+                        year = int(year_val)
+                        years_set.add(year)
+
+                        # 各部門のデータを取得
+                        for col, sector_name in sectors.items():
+                            value = ws.cell(row, col).value
+                            if value is not None:
+                                try:
+                                    emission_value = float(value)
+                                    if sector_name not in emissions_by_sector:
+                                        emissions_by_sector[sector_name] = {}
+                                    emissions_by_sector[sector_name][year] = emission_value
+                                except (ValueError, TypeError):
+                                    pass
+                    except (ValueError, TypeError):
+                        pass
+
+        return _build_result(city_code, city_name, years_set, emissions_by_sector)
+
+    except Exception as e:
+        print(f"[ERROR] {city_code} - パース失敗: {e}")
+        return None
+
+
+def generate_fixture(file_path: Path, rows: int, seed: int = 0):
+    """
+    カルテ形式のフィクスチャExcelを生成
+
+    書き込み専用モードの出力には <dimension>（シートの範囲）がなく、読み取り専用モードで
+    開くと範囲を求めるためにシート全体を余分に1回走査する。Excelで保存した実際のカルテと
+    同じになるよう、通常モードで保存し直して <dimension> を付ける。
+
+    Args:
+        file_path: 出力先
+        rows: データ行数（対象自治体以外の行も含む）
+        seed: 乱数シード
+    """
+    city_count = max(1, -(-rows // len(YEARS)))
+    city_codes = [str(int(TARGET_CITY_CODE) + i) for i in range(city_count)]
+    write_karte_workbook(file_path, generate_records(city_codes, seed, missing_rate=0))
+    openpyxl.load_workbook(file_path).save(file_path)
+
+
+def measure(func: Callable, file_path: Path, repeat: int) -> Tuple[Dict, float, int]:
+    """関数を repeat 回実行し (結果, 平均秒数, ピークメモリbytes) を返す"""
+    result = None
+    total = 0.0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(file_path, TARGET_CITY_CODE, '千代田区')
+        total += time.perf_counter() - started
+
+    tracemalloc.start()
+    func(file_path, TARGET_CITY_CODE, '千代田区')
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, total / repeat, peak
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="parse_excel() ベンチマーク")
+    parser.add_argument('--rows', type=int, default=2000, help="フィクスチャのデータ行数")
+    parser.add_argument('--repeat', type=int, default=5, help="計測回数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = Path(tmp) / f"{TARGET_CITY_CODE}.xlsx"
+        generate_fixture(file_path, args.rows)
+        print(f"フィクスチャ: {args.rows} 行 ({file_path.stat().st_size:,} bytes)")
+        print("-" * 60)
+
+        legacy, legacy_sec, legacy_peak = measure(parse_excel_random_access, file_path, args.repeat)
+        stream, stream_sec, stream_peak = measure(parse_excel, file_path, args.repeat)
+
+    print(f"{'実装':<16}{'平均時間':>12}{'ピークメモリ':>16}")
+    print(f"{'random access':<16}{legacy_sec * 1000:>10.1f}ms{legacy_peak / 1024:>14.0f}KB")
+    print(f"{'read-only':<16}{stream_sec * 1000:>10.1f}ms{stream_peak / 1024:>14.0f}KB")
+    print("-" * 60)
+    print(f"速度: {legacy_sec / stream_sec:.1f}倍 / メモリ: {stream_peak / legacy_peak:.0%}")
+    print(f"結果一致: {'OK' if legacy == stream else 'NG'}")
+
+
+if __name__ == "__main__":
+    main()
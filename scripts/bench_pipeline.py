@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Pythonパイプライン全体のベンチマーク
+
+合成データ（既定は 62 / 1,900 / 10,000 自治体）で、Excelパース・KPI計算・
+投入用の行の構築・JSONシリアライズを計測する。ネットワーク・DBは使わない。
+規模ごとに別プロセスで実行し、時間・スループット・ピークRSSをJSONに保存する。
+出力先に前回の結果があれば、上書きする前に段階ごとの時間を比較して表示する。
+
+実行: python bench_pipeline.py
+      python bench_pipeline.py --scales 62 1900 --parse-files 20
+      python bench_pipeline.py --compare data/processed/bench_results_before.json
+"""
+import argparse
+import json
+import platform
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Optional
+import numpy as np
+from bench_fixtures import generate_records, synthetic_city_codes, write_karte_workbook
+from emissions_cube import EmissionsCube
+from kpi_calculator import calc_kpis_batch
+from local_mirror import open_mirror, recompute, write_rows
+from metrics import peak_rss_mb
+from parse_excels import parse_excel, parse_workbook
+from seed_supabase import (
+    BASE_YEAR,
+    LATEST_YEAR,
+    TARGET_REDUCTION_RATE,
+    build_emission_rows,
+    build_municipality_kpi_rows,
+    build_seed_prefecture_kpi_rows
+)
+
+# 設定
+DATA_DIR = Path(__file__).parent.parent / "data"
+PROCESSED_DIR = DATA_DIR / "processed"
+BENCH_RESULTS_JSON = PROCESSED_DIR / "bench_results.json"
+
+DEFAULT_SCALES = [62, 1900, 10000]
+# 前回より この倍率以上遅くなった段階を表示で強調する
+REGRESSION_THRESHOLD = 1.2
+
+
+def run_stage(stages: Dict[str, Dict], name: str, func: Callable, items: int,
+              repeat: int = 1, **extra):
+    """
+    関数を repeat 回実行して計測結果を stages[name] に記録し、最後の戻り値を返す
+
+    Args:
+        stages: 計測結果の格納先
+        name: 段階名
+        func: 計測する関数（引数なし）
+        items: 処理件数（スループットの計算用）
+        repeat: 計測回数（最速値を採用）
+        **extra: 結果に追加する値
+    """
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    seconds = min(timings)
+    stages[name] = {
+        'seconds': seconds,
+        'mean_seconds': sum(timings) / len(timings),
+        'items': items,
+        'throughput_per_sec': items / seconds if seconds > 0 else None,
+        'peak_rss_mb': peak_rss_mb(),
+        **extra
+    }
+    return result
+
+
+def run_scale(scale: int, parse_files: int, shared_workbook: bool,
+              repeat: int, seed: int) -> Dict:
+    """
+    1つの規模の全段階を計測（ワーカープロセスで実行）
+
+    Returns:
+        {'cities', 'rss_baseline_mb', 'stages': 段階名 -> 計測結果}
+    """
+    stages = {}
+    result = {'cities': scale, 'rss_baseline_mb': peak_rss_mb(), 'stages': stages}
+    records = run_stage(stages, 'generate', lambda: generate_records(synthetic_city_codes(scale), seed),
+                        scale)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 1自治体1ファイルのパース（先頭 parse_files 件で計測し、全件の時間を推定）
+        sample = records[:parse_files]
+        paths = []
+        for record in sample:
+            path = Path(tmp) / f"{record['city_code']}.xlsx"
+            write_karte_workbook(path, [record])
+            paths.append(path)
+        parsed = run_stage(
+            stages, 'parse_excel',
+            lambda: [parse_excel(path, record['city_code'], record['city_name'])
+                     for path, record in zip(paths, sample)],
+            len(sample)
+        )
+        stages['parse_excel']['estimated_seconds_all'] = stages['parse_excel']['seconds'] / len(sample) * scale
+        stages['parse_excel']['parity'] = parsed == sample
+
+        # 全自治体を含む1ファイルを1回の走査でパース
+        if shared_workbook:
+            path = Path(tmp) / 'shared.xlsx'
+            write_karte_workbook(path, records)
+            shared = run_stage(stages, 'parse_workbook', lambda: parse_workbook(path), scale,
+                               file_bytes=path.stat().st_size)
+            stages['parse_workbook']['parity'] = list(shared.values()) == records
+
+    cube = run_stage(stages, 'cube', lambda: EmissionsCube.from_records(records), scale, repeat)
+    run_stage(stages, 'kpi_batch',
+              lambda: calc_kpis_batch(cube.totals(BASE_YEAR), cube.totals(LATEST_YEAR),
+                                      BASE_YEAR, LATEST_YEAR, TARGET_REDUCTION_RATE),
+              scale, repeat)
+    municipality_kpis = run_stage(stages, 'municipality_kpi_rows',
+                                  lambda: build_municipality_kpi_rows(cube), scale, repeat)
+    run_stage(stages, 'prefecture_kpi_rows',
+              lambda: build_seed_prefecture_kpi_rows(cube, municipality_kpis), scale, repeat)
+
+    # ローカルミラー（SQLite、メモリ上）での偏差値・一人当たり・順位・都道府県KPIの再計算
+    mirror = open_mirror(':memory:')
+    write_rows(mirror, 'municipality_kpis', municipality_kpis)
+    write_rows(mirror, 'municipalities', [
+        {'city_code': kpi['city_code'], 'population': 10000 + i * 37 % 500000}
+        for i, kpi in enumerate(municipality_kpis)
+    ])
+    run_stage(stages, 'mirror_recompute', lambda: recompute(mirror), len(municipality_kpis), repeat)
+    mirror.close()
+    emission_rows = run_stage(stages, 'emission_rows', lambda: build_emission_rows(cube), scale, repeat)
+    # 件数は展開後の行数（欠損値の行は出力されない）
+    stages['emission_rows']['items'] = len(emission_rows)
+    stages['emission_rows']['throughput_per_sec'] = len(emission_rows) / stages['emission_rows']['seconds']
+
+    # parse_excels.py の出力（indent付きJSON）と投入リクエストのボディ
+    encoded = run_stage(stages, 'json_emissions',
+                        lambda: json.dumps(records, ensure_ascii=False, indent=2), scale, repeat)
+    stages['json_emissions']['bytes'] = len(encoded.encode('utf-8'))
+    encoded = run_stage(stages, 'json_payload',
+                        lambda: json.dumps(emission_rows) + json.dumps(municipality_kpis),
+                        len(emission_rows) + len(municipality_kpis), repeat)
+    stages['json_payload']['bytes'] = len(encoded)
+    return result
+
+
+def load_results(path: Path) -> Optional[Dict]:
+    """前回の計測結果を読み込み（なければNone）"""
+    if not path.exists():
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def print_scale(scale: int, result: Dict, previous: Optional[Dict]):
+    """1つの規模の計測結果を表示（前回の結果があれば倍率も）"""
+    prev_stages = {}
+    if previous:
+        prev_stages = previous.get('scales', {}).get(str(scale), {}).get('stages', {})
+
+    print(f"\n=== {scale:,} 自治体 ===")
+    print(f"{'段階':<22}{'時間':>11}{'件数':>10}{'件/秒':>12}{'RSS':>9}  前回比")
+    for name, stage in result['stages'].items():
+        throughput = stage['throughput_per_sec']
+        rss = stage['peak_rss_mb']
+        line = (f"{name:<22}{stage['seconds'] * 1000:>9.1f}ms{stage['items']:>10,}"
+                f"{throughput or 0:>12,.0f}{rss or 0:>7.0f}MB")
+        prev = prev_stages.get(name)
+        if prev and prev['seconds'] > 0 and prev['items']:
+            # 件数が違っても比べられるよう1件あたりの時間で比較する
+            ratio = (stage['seconds'] / stage['items']) / (prev['seconds'] / prev['items'])
+            line += f"  {ratio:.2f}x{' ⚠️' if ratio >= REGRESSION_THRESHOLD else ''}"
+        if stage.get('parity') is False:
+            line += '  [NG] 結果不一致'
+        print(line)
+    if 'parse_excel' in result['stages']:
+        print(f"parse_excel 全件の推定時間: {result['stages']['parse_excel']['estimated_seconds_all']:.1f}s")
+
+
+def parse_args() -> argparse.Namespace:
+    """コマンドライン引数を解析"""
+    parser = argparse.ArgumentParser(description="Pythonパイプライン全体のベンチマーク")
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                        help="自治体数（複数指定可）")
+    parser.add_argument('--parse-files', type=int, default=50,
+                        help="parse_excel を計測する1自治体1ファイルの件数")
+    parser.add_argument('--no-shared-workbook', action='store_true',
+                        help="全自治体を含む1ファイルのパース（parse_workbook）を計測しない")
+    parser.add_argument('--repeat', type=int, default=3, help="パース以外の段階の計測回数")
+    parser.add_argument('--seed', type=int, default=0, help="乱数シード")
+    parser.add_argument('--output', type=Path, default=BENCH_RESULTS_JSON, help="結果の保存先")
+    parser.add_argument('--compare', type=Path,
+                        help="比較する前回の結果（省略時は --output の既存ファイル）")
+    return parser.parse_args()
+
+
+def main():
+    """メイン処理"""
+    args = parse_args()
+    previous = load_results(args.compare or args.output)
+
+    results = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'settings': {'parse_files': args.parse_files, 'repeat': args.repeat, 'seed': args.seed},
+        'scales': {}
+    }
+    print(f"ベンチマーク: {', '.join(f'{scale:,}' for scale in args.scales)} 自治体")
+    if previous:
+        print(f"比較対象: {previous.get('created_at')}")
+
+    for scale in args.scales:
+        # 規模ごとに新しいプロセスで実行し、ピークRSSが前の規模の影響を受けないようにする
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            result = executor.submit(run_scale, scale, max(1, min(args.parse_files, scale)),
+                                     not args.no_shared_workbook, args.repeat, args.seed).result()
+        results['scales'][str(scale)] = result
+        print_scale(scale, result, previous)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n結果: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+PostgreSQLの COPY による排出量の一括投入（任意、psycopg2 が必要）
+
+縦持ちの排出量の行をCSVとして一時テーブルへ COPY で流し込み、
+1回の INSERT ... ON CONFLICT で emissions にマージする。
+投入した自治体のうち今回のデータにない行の削除も同じトランザクションで行うため、
+途中で失敗しても emissions は投入前の状態のまま残る。
+
+接続先は .env の SUPABASE_DB_URL（Supabaseの Project Settings > Database >
+Connection string）。ローカルのPostgreSQLでも create_schema.sql を実行すれば使える。
+"""
+import csv
+import io
+import os
+import time
+from typing import Dict, Iterable, Optional, Sequence
+
+DATABASE_URL_ENV = 'SUPABASE_DB_URL'
+EMISSIONS_COLUMNS = ('city_code', 'fiscal_year', 'sector', 'value_kt_co2')
+
+# 一時テーブル（トランザクション終了時に削除）
+CREATE_STAGING_SQL = """
+CREATE TEMP TABLE emissions_staging (
+  city_code     VARCHAR(5)  NOT NULL,
+  fiscal_year   SMALLINT    NOT NULL,
+  sector        VARCHAR(20) NOT NULL,
+  value_kt_co2  NUMERIC(10,2)
+) ON COMMIT DROP
+"""
+COPY_SQL = "COPY emissions_staging (city_code, fiscal_year, sector, value_kt_co2) FROM STDIN WITH (FORMAT csv)"
+# 値が変わらない行は書き換えない（不要な行の更新・WALを出さない）
+MERGE_SQL = """
+INSERT INTO emissions (city_code, fiscal_year, sector, value_kt_co2)
+SELECT city_code, fiscal_year, sector, value_kt_co2 FROM emissions_staging
+ON CONFLICT (city_code, fiscal_year, sector) DO UPDATE
+  SET value_kt_co2 = EXCLUDED.value_kt_co2
+  WHERE emissions.value_kt_co2 IS DISTINCT FROM EXCLUDED.value_kt_co2
+"""
+# 投入した自治体のうち、今回のデータにない年度・部門の行を削除
+DELETE_MISSING_SQL = """
+DELETE FROM emissions e
+WHERE e.city_code IN (SELECT DISTINCT city_code FROM emissions_staging)
+  AND NOT EXISTS (
+    SELECT 1 FROM emissions_staging s
+    WHERE s.city_code = e.city_code AND s.fiscal_year = e.fiscal_year AND s.sector = e.sector
+  )
+"""
+# 投入方法の比較で、各方法の前に対象自治体の排出量を空にする
+CLEAR_SQL = "DELETE FROM emissions WHERE city_code = ANY(%s)"
+
+
+def _import_psycopg2():
+    """psycopg2 を読み込み（未インストールならエラー）"""
+    try:
+        import psycopg2
+    except ImportError:
+        raise ImportError("COPYでの投入には psycopg2 が必要です: pip install psycopg2-binary")
+    return psycopg2
+
+
+def connect(dsn: Optional[str] = None):
+    """
+    PostgreSQLに接続
+
+    Args:
+        dsn: 接続文字列（省略時は環境変数 SUPABASE_DB_URL）
+
+    Returns:
+        psycopg2 の接続
+    """
+    psycopg2 = _import_psycopg2()
+    if dsn is None:
+        from dotenv import load_dotenv
+        load_dotenv()
+        dsn = os.getenv(DATABASE_URL_ENV)
+    if not dsn:
+        raise ValueError(f"環境変数 {DATABASE_URL_ENV} が必要です（SupabaseのDatabase接続文字列）")
+    return psycopg2.connect(dsn)
+
+
+class CsvStream(io.RawIOBase):
+    """
+    行の辞書をCSVとして少しずつ読み出すファイル風オブジェクト
+
+    copy_expert() が read() で要求した分だけ行をCSVに変換するため、
+    全行のCSVをメモリ上に作らない。読み出したバイト数は bytes_read に記録する。
+    """
+
+    def __init__(self, rows: Iterable[Dict], columns=EMISSIONS_COLUMNS):
+        self.rows = iter(rows)
+        self.columns = columns
+        self.buffer = b''
+        self.line = io.StringIO()
+        self.writer = csv.writer(self.line, lineterminator='\n')
+        self.row_count = 0
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def _next_chunk(self, size: int) -> bytes:
+        """size バイト程度になるまで行をCSVに変換"""
+        self.line.seek(0)
+        self.line.truncate()
+        written = 0
+        for row in self.rows:
+            self.writer.writerow([row[column] for column in self.columns])
+            self.row_count += 1
+            written += 1
+            if self.line.tell() >= size:
+                break
+        return self.line.getvalue().encode('utf-8') if written else b''
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = 1 << 20
+        while len(self.buffer) < size:
+            chunk = self._next_chunk(size)
+            if not chunk:
+                break
+            self.buffer += chunk
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        self.bytes_read += len(data)
+        return data
+
+
+def copy_emissions(conn, rows: Iterable[Dict], delete_missing: bool = True) -> Dict[str, float]:
+    """
+    排出量の行を COPY で一時テーブルに流し込み、1トランザクションで emissions にマージ
+
+    Args:
+        conn: psycopg2 の接続
+        rows: build_emission_rows() と同じ形式の行
+        delete_missing: 投入した自治体のうち今回のデータにない行を削除するか
+
+    Returns:
+        {'rows', 'bytes', 'upserted', 'deleted', 'copy_seconds', 'merge_seconds', 'seconds'}
+    """
+    stream = CsvStream(rows)
+    started = time.perf_counter()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(CREATE_STAGING_SQL)
+            cursor.copy_expert(COPY_SQL, stream)
+            copied = time.perf_counter()
+            cursor.execute(MERGE_SQL)
+            upserted = cursor.rowcount
+            deleted = 0
+            if delete_missing:
+                cursor.execute(DELETE_MISSING_SQL)
+                deleted = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finished = time.perf_counter()
+    return {
+        'rows': stream.row_count,
+        'bytes': stream.bytes_read,
+        'upserted': upserted,
+        'deleted': deleted,
+        'copy_seconds': copied - started,
+        'merge_seconds': finished - copied,
+        'seconds': finished - started
+    }
+
+
+def clear_emissions(conn, city_codes: Sequence[str]) -> int:
+    """
+    指定した自治体の排出量をすべて削除（投入方法を同じ開始状態から比較するため）
+
+    Args:
+        conn: psycopg2 の接続
+        city_codes: 削除する自治体の団体コード
+
+    Returns:
+        削除した行数
+    """
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(CLEAR_SQL, (list(city_codes),))
+            deleted = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return deleted
+
+
+def print_load_comparison(results: Dict[str, Dict[str, float]]):
+    """
+    投入方法ごとの所要時間を比較表示
+
+    Args:
+        results: 投入方法 -> {'rows', 'seconds'}
+    """
+    print("\n投入方法の比較:")
+    print(f"  {'方法':<12}{'行数':>10}{'時間':>10}{'行/秒':>12}")
+    baseline = None
+    for method, result in results.items():
+        seconds = result['seconds']
+        throughput = result['rows'] / seconds if seconds > 0 else 0
+        line = f"  {method:<12}{result['rows']:>10,}{seconds:>9.2f}s{throughput:>12,.0f}"
+        if baseline is None:
+            baseline = seconds
+        elif seconds > 0:
+            line += f"  ({baseline / seconds:.1f}倍速)"
+        print(line)
@@ -3,9 +3,10 @@
 自然環境ファイルから面積データを確認
 """
 import pandas as pd
+from stat_cache import AREA_XLS, read_excel_cached
 
-excel_file = 'data/natural_environment_2022.xls'
-df = pd.read_excel(excel_file, sheet_name='B', header=None)
+# 2回目以降はParquetキャッシュから読み込む
+df = read_excel_cached(AREA_XLS, 'B')
 
 print(f"データ形状: {df.shape}")
 
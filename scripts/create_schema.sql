@@ -13,7 +13,8 @@ CREATE TABLE IF NOT EXISTS municipalities (
   area_km2         NUMERIC(8,2),
   zero_carbon_declared BOOLEAN DEFAULT FALSE,
   zero_carbon_year INTEGER,
-  created_at       TIMESTAMPTZ DEFAULT NOW()
+  created_at       TIMESTAMPTZ DEFAULT NOW(),
+  updated_at       TIMESTAMPTZ DEFAULT NOW()
 );
 
 CREATE INDEX IF NOT EXISTS idx_municipalities_prefecture ON municipalities(prefecture_code);
@@ -26,6 +27,7 @@ CREATE TABLE IF NOT EXISTS emissions (
   sector           VARCHAR(20)  NOT NULL,
   value_kt_co2     NUMERIC(10,2),
   created_at       TIMESTAMPTZ  DEFAULT NOW(),
+  updated_at       TIMESTAMPTZ  DEFAULT NOW(),
   UNIQUE(city_code, fiscal_year, sector)
 );
 
@@ -105,3 +107,82 @@ CREATE POLICY IF NOT EXISTS "Service role write access" ON municipalities FOR AL
 CREATE POLICY IF NOT EXISTS "Service role write access" ON emissions FOR ALL USING (auth.role() = 'service_role');
 CREATE POLICY IF NOT EXISTS "Service role write access" ON municipality_kpis FOR ALL USING (auth.role() = 'service_role');
 CREATE POLICY IF NOT EXISTS "Service role write access" ON prefecture_kpis FOR ALL USING (auth.role() = 'service_role');
+
+-- 5. 都道府県ごとの集計ビュー（seed / recalc スクリプトがテーブル全体を取得せずに集計するため）
+-- ビューを prefecture_code で絞り込むと LEFT(city_code, 2) の条件になるため式インデックスを使う
+CREATE INDEX IF NOT EXISTS idx_municipality_kpis_prefecture ON municipality_kpis(LEFT(city_code, 2));
+-- 団体コードの前方一致（city_code LIKE '13%'）は主キーのインデックスでは照合順序のため使えない
+CREATE INDEX IF NOT EXISTS idx_municipality_kpis_city_code_pattern
+  ON municipality_kpis(city_code varchar_pattern_ops);
+
+CREATE OR REPLACE VIEW prefecture_kpi_aggregates AS
+SELECT
+  LEFT(city_code, 2)                                  AS prefecture_code,
+  COUNT(*)                                            AS municipality_count,
+  SUM(base_emission_kt)                               AS base_emission_kt,
+  SUM(latest_emission_kt)                             AS latest_emission_kt,
+  COUNT(*) FILTER (WHERE status = 'on-track')         AS on_track_count,
+  COUNT(*) FILTER (WHERE status = 'at-risk')          AS at_risk_count,
+  COUNT(*) FILTER (WHERE status = 'off-track')        AS off_track_count
+FROM municipality_kpis
+GROUP BY LEFT(city_code, 2);
+
+-- 6. 更新日時（local_mirror.py が前回の同期以降に変わった行だけを取得するため）
+-- 以前のスキーマで作成したDB向けに、ない列だけを追加する
+ALTER TABLE municipalities ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW();
+ALTER TABLE emissions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW();
+
+CREATE INDEX IF NOT EXISTS idx_municipalities_updated_at ON municipalities(updated_at);
+CREATE INDEX IF NOT EXISTS idx_emissions_updated_at ON emissions(updated_at);
+CREATE INDEX IF NOT EXISTS idx_municipality_kpis_updated_at ON municipality_kpis(updated_at);
+CREATE INDEX IF NOT EXISTS idx_prefecture_kpis_updated_at ON prefecture_kpis(updated_at);
+
+-- 値が変わった行だけ updated_at を更新する（同じ値のupsertでは変えない）
+CREATE OR REPLACE FUNCTION set_updated_at() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF NEW IS DISTINCT FROM OLD THEN
+    NEW.updated_at := NOW();
+  END IF;
+  RETURN NEW;
+END $$;
+
+DROP TRIGGER IF EXISTS set_updated_at ON municipalities;
+CREATE TRIGGER set_updated_at BEFORE UPDATE ON municipalities
+  FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+DROP TRIGGER IF EXISTS set_updated_at ON emissions;
+CREATE TRIGGER set_updated_at BEFORE UPDATE ON emissions
+  FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+DROP TRIGGER IF EXISTS set_updated_at ON municipality_kpis;
+CREATE TRIGGER set_updated_at BEFORE UPDATE ON municipality_kpis
+  FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+DROP TRIGGER IF EXISTS set_updated_at ON prefecture_kpis;
+CREATE TRIGGER set_updated_at BEFORE UPDATE ON prefecture_kpis
+  FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+-- 7. 複数行の一部カラムをまとめて更新（db.update_batches() がRPCで呼ぶ）
+-- rows は [{key_column: キー, カラム: 新しい値, ...}, ...]。行ごとに値もカラムも違ってよく、
+-- 指定したカラムだけを更新する（upsert と違って完全な行を送らなくてよい）。
+-- 呼び出し元の権限で実行するため、RLSにより service_role 以外は1行も更新できない
+CREATE OR REPLACE FUNCTION update_rows(target_table text, key_column text, rows jsonb)
+RETURNS TABLE (updated integer)
+LANGUAGE plpgsql AS $$
+DECLARE
+  item jsonb;
+  assignments text;
+  affected integer;
+BEGIN
+  updated := 0;
+  FOR item IN SELECT value FROM jsonb_array_elements(rows) LOOP
+    SELECT string_agg(format('%I = r.%I', name, name), ', ') INTO assignments
+      FROM jsonb_object_keys(item) AS name
+      WHERE name <> key_column;
+    CONTINUE WHEN assignments IS NULL;
+    EXECUTE format('UPDATE %I t SET %s FROM jsonb_populate_record(NULL::%I, $1) r WHERE t.%I = r.%I',
+                   target_table, assignments, target_table, key_column, key_column)
+      USING item;
+    GET DIAGNOSTICS affected = ROW_COUNT;
+    updated := updated + affected;
+  END LOOP;
+  RETURN NEXT;
+END $$;
@@ -0,0 +1,592 @@
+"""
+Supabase読み書きの共通処理
+共有クライアント・ページング取得・差分検出・バッチupsert/update・再送付きアップロード
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import metrics
+from metrics import percentile
+
+# 1リクエストあたりの行数
+DEFAULT_BATCH_SIZE = 500
+# 同時に送るリクエスト数
+DEFAULT_WORKERS = 4
+# PostgRESTの1レスポンスあたりの最大行数（Supabaseの既定値）
+PAGE_SIZE = 1000
+# アップロード失敗時のリトライ回数と初回待機秒数（指数バックオフ）
+MAX_RETRIES = 3
+RETRY_BACKOFF = 1.0
+# 複数行の一部カラムを更新するRPC（create_schema.sql）
+UPDATE_ROWS_FUNCTION = 'update_rows'
+# テーブル・カラム・関数がないときのエラーコード（PostgreSQL / PostgREST）
+MISSING_OBJECT_CODES = {'42P01', '42703', '42883', 'PGRST200', 'PGRST202', 'PGRST204', 'PGRST205'}
+
+# 接続先（.env から読み込む）
+SUPABASE_URL_ENV = 'NEXT_PUBLIC_SUPABASE_URL'
+SUPABASE_KEY_ENV = 'SUPABASE_SERVICE_ROLE_KEY'  # 書き込み用
+# 設定するとこのURL（ローカルのPostgREST互換サーバーなど）に接続する（テスト用、キーは省略可）
+SUPABASE_ENDPOINT_ENV = 'SUPABASE_ENDPOINT'
+# HTTP接続の設定（秒）。環境変数 SUPABASE_TIMEOUT / SUPABASE_CONNECT_TIMEOUT で上書きできる
+REQUEST_TIMEOUT = float(os.getenv('SUPABASE_TIMEOUT', '30'))
+CONNECT_TIMEOUT = float(os.getenv('SUPABASE_CONNECT_TIMEOUT', '10'))
+# コネクションプールの大きさと、使っていない接続を保持する秒数（Keep-Alive）
+POOL_SIZE = 16
+KEEPALIVE_EXPIRY = 60.0
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def create_pooled_client(url: str, key: str,
+                         timeout: float = REQUEST_TIMEOUT,
+                         connect_timeout: float = CONNECT_TIMEOUT,
+                         pool_size: int = POOL_SIZE,
+                         retries: int = MAX_RETRIES):
+    """
+    コネクションプール・Keep-Alive・接続リトライ付きのSupabaseクライアントを作成
+
+    PostgRESTクライアントのHTTPセッションを、プールの大きさ・タイムアウトを
+    指定したものに差し替える（接続の確立に失敗した場合はバックオフ付きで再接続）。
+
+    Args:
+        url: SupabaseのURL
+        key: APIキー
+        timeout: 読み書きのタイムアウト
+        connect_timeout: 接続確立のタイムアウト
+        pool_size: 最大同時接続数（Keep-Aliveで保持する接続数も同じ）
+        retries: 接続確立の再試行回数
+
+    Returns:
+        Supabaseクライアント
+    """
+    import httpx
+    from postgrest.utils import SyncClient
+    from supabase import create_client
+
+    client = create_client(url, key)
+    session = client.postgrest.session
+    limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size,
+                          keepalive_expiry=KEEPALIVE_EXPIRY)
+    client.postgrest.session = SyncClient(
+        base_url=session.base_url,
+        headers=session.headers,
+        timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        transport=httpx.HTTPTransport(limits=limits, retries=retries)
+    )
+    session.close()
+    return client
+
+
+def get_client():
+    """
+    スクリプト間で共有するSupabaseクライアント（初回呼び出し時に作成）
+
+    接続先は .env の NEXT_PUBLIC_SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY。
+    SUPABASE_ENDPOINT が設定されていればそのURLに接続する。
+
+    Returns:
+        Supabaseクライアント
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            from dotenv import load_dotenv
+            load_dotenv()
+            endpoint = os.getenv(SUPABASE_ENDPOINT_ENV)
+            url = endpoint or os.getenv(SUPABASE_URL_ENV)
+            key = os.getenv(SUPABASE_KEY_ENV) or ('local' if endpoint else None)
+            if not url or not key:
+                raise ValueError(f"環境変数 {SUPABASE_URL_ENV} と {SUPABASE_KEY_ENV} が必要です"
+                                 "（.env を確認してください）")
+            _client = create_pooled_client(url, key)
+        return _client
+
+
+def use_endpoint(url: str, key: str = 'local'):
+    """
+    共有クライアントの接続先を差し替える（ローカルの代替サーバーでのテスト用）
+
+    Returns:
+        新しい接続先のSupabaseクライアント
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.postgrest.session.close()
+        _client = create_pooled_client(url, key)
+        return _client
+
+
+def execute(query, retries: int = MAX_RETRIES):
+    """
+    クエリを実行（タイムアウト・接続断は指数バックオフで再試行）
+
+    upsert・update・select はどれも同じリクエストを再送しても結果が変わらない。
+
+    Args:
+        query: postgrest のクエリ（execute() 前のもの）
+        retries: 最大リトライ回数
+
+    Returns:
+        execute() の結果
+    """
+    import httpx
+
+    for attempt in range(retries + 1):
+        try:
+            return query.execute()
+        except httpx.TransportError:
+            if attempt == retries:
+                raise
+            time.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+
+def chunked(rows: List[Dict], size: int) -> Iterator[List[Dict]]:
+    """行リストを size 件ずつに分割"""
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def select_all(supabase, table: str, columns: str = '*', order: str = '',
+               page_size: int = PAGE_SIZE,
+               filters: Sequence[Tuple[str, str, Any]] = ()) -> List[Dict]:
+    """
+    テーブルの全行をページングして取得
+
+    Args:
+        supabase: Supabaseクライアント
+        table: テーブル名
+        columns: 取得するカラム（PostgRESTのselect構文）
+        order: ページ間で順序を固定するための並び替えカラム（主キー推奨）
+        page_size: 1リクエストあたりの行数
+        filters: DB側で絞り込む条件 (カラム, 演算子, 値) のリスト
+                 （例: [('city_code', 'like', '13%')]）
+
+    Returns:
+        行のリスト
+    """
+    rows = []
+    while True:
+        query = supabase.table(table).select(columns)
+        for column, operator, value in filters:
+            query = query.filter(column, operator, value)
+        if order:
+            query = query.order(order)
+        # range() の終端の扱いがクライアントのバージョンで異なるため、
+        # 返ってきた件数だけ進めて空ページで終了する
+        with metrics.span(f"select:{table}", kind='batch') as page:
+            result = execute(query.range(len(rows), len(rows) + page_size))
+            page['rows'] = len(result.data or [])
+        if not result.data:
+            return rows
+        rows.extend(result.data)
+
+
+def count_rows(supabase, table: str, column: str, filters: Sequence[Tuple[str, str, Any]] = ()) -> int:
+    """
+    テーブルの行数を取得（行は1行だけ受け取り、件数はレスポンスヘッダーから読む）
+
+    Args:
+        supabase: Supabaseクライアント
+        table: テーブル名
+        column: 取得するカラム（主キーなど小さいもの）
+        filters: DB側で絞り込む条件 (カラム, 演算子, 値) のリスト
+
+    Returns:
+        条件に一致する行数
+    """
+    query = supabase.table(table).select(column, count='exact')
+    for name, operator, value in filters:
+        query = query.filter(name, operator, value)
+    return execute(query.limit(1)).count or 0
+
+
+def is_missing_object_error(error: Exception) -> bool:
+    """
+    参照したテーブル・ビュー・カラム・関数がDBにないエラーか
+
+    create_schema.sql の新しい定義をまだ実行していないDBで、
+    以前の方法に切り替えるかどうかの判定に使う。
+    """
+    from postgrest.exceptions import APIError
+
+    return isinstance(error, APIError) and error.code in MISSING_OBJECT_CODES
+
+
+def same_value(old: Any, new: Any) -> bool:
+    """DBの値と計算値が同じか（数値は float で比較）"""
+    if old is None or new is None:
+        return old is None and new is None
+    if isinstance(new, (int, float)) and not isinstance(new, bool):
+        try:
+            return float(old) == float(new)
+        except (TypeError, ValueError):
+            return False
+    return old == new
+
+
+def diff_rows(current_rows: List[Dict], new_values: Dict[str, Dict],
+              key: str = 'city_code') -> List[Tuple[Dict, Dict]]:
+    """
+    値が変わる行だけを抽出
+
+    Args:
+        current_rows: DBから取得した現在の行（全カラム）
+        new_values: キー -> {カラム: 新しい値} の辞書
+        key: 主キーのカラム名
+
+    Returns:
+        (新しい値を反映した行, {カラム: (旧値, 新値)}) のリスト
+    """
+    changed = []
+    for row in current_rows:
+        values = new_values.get(row[key])
+        if not values:
+            continue
+        changes = {
+            column: (row.get(column), value)
+            for column, value in values.items()
+            if not same_value(row.get(column), value)
+        }
+        if changes:
+            # JOINで取得したネストしたカラムはupsert対象から外す
+            merged = {k: v for k, v in row.items() if not isinstance(v, (dict, list))}
+            merged.update(values)
+            changed.append((merged, changes))
+    return changed
+
+
+def print_diff(changed: List[Tuple[Dict, Dict]], key: str = 'city_code'):
+    """差分を表示"""
+    for row, changes in changed:
+        for column, (old, new) in changes.items():
+            print(f"{row[key]}: {column} {old} → {new}")
+
+
+def upsert_batches(supabase, table: str, rows: List[Dict],
+                   batch_size: int = DEFAULT_BATCH_SIZE,
+                   workers: int = DEFAULT_WORKERS,
+                   on_conflict: str = '') -> int:
+    """
+    行をバッチに分けてupsert（バッチ単位で並列送信）
+
+    NOT NULL制約を満たすため、rows は全カラムを含む完全な行であること。
+
+    Args:
+        supabase: Supabaseクライアント
+        table: テーブル名
+        rows: upsertする行
+        batch_size: 1リクエストあたりの行数
+        workers: 同時リクエスト数
+        on_conflict: 主キー以外のユニーク制約で突き合わせる場合のカラム（カンマ区切り）
+
+    Returns:
+        upsertした行数
+    """
+    if not rows:
+        return 0
+
+    def send(batch: List[Dict]) -> int:
+        with metrics.span(f"upsert:{table}", kind='batch', rows=len(batch)):
+            execute(supabase.table(table).upsert(batch, on_conflict=on_conflict))
+        return len(batch)
+
+    batches = list(chunked(rows, batch_size))
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batches)))) as executor:
+        return sum(executor.map(send, batches))
+
+
+def update_batches(supabase, table: str, new_values: Dict[str, Dict],
+                   key: str = 'city_code',
+                   batch_size: int = DEFAULT_BATCH_SIZE,
+                   workers: int = DEFAULT_WORKERS) -> int:
+    """
+    一部のカラムだけを複数行まとめて更新
+
+    create_schema.sql の update_rows() をRPCで呼び、batch_size 行ずつ1リクエストで送る。
+    行ごとに値や更新するカラムが違ってもよく、upsert と違って完全な行を送らなくてよい。
+    update_rows() を作成していないDBでは、同じ値に更新する行を key=in.(...) の
+    1回のPATCHにまとめて送る（値が行ごとに違うと1行1リクエストになる）。
+
+    Args:
+        supabase: Supabaseクライアント
+        table: テーブル名
+        new_values: キーの値 -> 更新するカラムと値
+        key: 行を特定するカラム
+        batch_size: 1リクエストあたりの最大行数
+        workers: 同時リクエスト数
+
+    Returns:
+        更新を送った行数
+    """
+    rows = [dict(values, **{key: key_value}) for key_value, values in new_values.items()]
+    if not rows:
+        return 0
+
+    def send(batch: List[Dict]) -> int:
+        with metrics.span(f"update:{table}", kind='batch', rows=len(batch)):
+            execute(supabase.rpc(UPDATE_ROWS_FUNCTION,
+                                 {'target_table': table, 'key_column': key, 'rows': batch}))
+        return len(batch)
+
+    batches = list(chunked(rows, batch_size))
+    # 最初のバッチで関数があるかを確かめてから残りを並列に送る
+    try:
+        sent = send(batches[0])
+    except Exception as error:
+        if not is_missing_object_error(error):
+            raise
+        print(f"  [INFO] {UPDATE_ROWS_FUNCTION}() がないため、同じ値の行ごとのPATCHで更新します"
+              f"（create_schema.sql を実行すると複数行を1リクエストで更新します）")
+        return patch_batches(supabase, table, new_values, key, batch_size, workers)
+    if len(batches) > 1:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batches) - 1))) as executor:
+            sent += sum(executor.map(send, batches[1:]))
+    return sent
+
+
+def patch_batches(supabase, table: str, new_values: Dict[str, Dict],
+                  key: str = 'city_code',
+                  batch_size: int = DEFAULT_BATCH_SIZE,
+                  workers: int = DEFAULT_WORKERS) -> int:
+    """
+    一部のカラムだけを更新（同じ値に更新する行は1回のPATCHにまとめる）
+
+    update_rows() のないDB向けの update_batches() の代替。
+
+    Returns:
+        更新を送った行数
+    """
+    groups: Dict[str, Tuple[Dict, List[str]]] = {}
+    for key_value, values in new_values.items():
+        signature = json.dumps(values, sort_keys=True, default=str)
+        groups.setdefault(signature, (values, []))[1].append(key_value)
+    requests = [
+        (values, keys[i:i + batch_size])
+        for values, keys in groups.values()
+        for i in range(0, len(keys), batch_size)
+    ]
+    if not requests:
+        return 0
+
+    def send(item: Tuple[Dict, List[str]]) -> int:
+        values, keys = item
+        with metrics.span(f"update:{table}", kind='batch', rows=len(keys)):
+            execute(supabase.table(table).update(values).in_(key, keys))
+        return len(keys)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(requests)))) as executor:
+        return sum(executor.map(send, requests))
+
+
+def serialize_batches(rows: List[Dict], batch_size: int,
+                      sort_keys: Sequence[str] = ()) -> List[Tuple[List[Dict], bytes]]:
+    """
+    行を主キー順に並べてバッチに分け、送信前にJSONへシリアライズ
+
+    主キー順に送るとバッチ間で同じ行を取り合わず、競合が起きにくい。
+
+    Returns:
+        (バッチの行, JSONペイロード) のリスト
+    """
+    if sort_keys:
+        rows = sorted(rows, key=lambda row: tuple(row[k] for k in sort_keys))
+    return [
+        (batch, json.dumps(batch, ensure_ascii=False).encode('utf-8'))
+        for batch in chunked(rows, batch_size)
+    ]
+
+
+def post_batch(supabase, table: str, payload: bytes, on_conflict: str = ''):
+    """
+    シリアライズ済みのバッチをPostgRESTにupsert
+
+    クライアントのHTTPセッション（Keep-Alive）をそのまま使い、
+    レスポンス本文は返さない（return=minimal）。
+    """
+    params = {'on_conflict': on_conflict} if on_conflict else None
+    response = supabase.postgrest.session.post(
+        table,
+        content=payload,
+        params=params,
+        headers={
+            'Content-Type': 'application/json',
+            'Prefer': 'resolution=merge-duplicates,return=minimal'
+        }
+    )
+    response.raise_for_status()
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    再送すれば成功する可能性のあるエラーか
+
+    接続断・タイムアウト・5xx・429 は再送し、制約違反などの 4xx は再送しない
+    （同じリクエストを何度送っても失敗するため）。
+    """
+    import httpx
+
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return False
+
+
+def _empty_stats() -> Dict[str, Any]:
+    """アップロード統計の初期値"""
+    return {
+        'rows': 0,
+        'bytes': 0,
+        'batches': 0,
+        'retries': 0,
+        'failed_batches': 0,
+        'failed_rows': [],
+        'latencies': [],
+        'elapsed': 0.0
+    }
+
+
+def upload_batches(supabase, table: str, rows: List[Dict],
+                   batch_size: int = 1000,
+                   workers: int = DEFAULT_WORKERS,
+                   on_conflict: str = '',
+                   sort_keys: Sequence[str] = (),
+                   max_retries: int = MAX_RETRIES,
+                   dead_letter_path: Optional[Path] = None) -> Dict[str, Any]:
+    """
+    行をバッチに分けて並列にupsert（バッチ単位で再送、失敗はデッドレターへ）
+
+    再送するのは一時的なエラー（is_transient_error()）だけで、
+    4xx のバッチは再送せずにすぐデッドレターへ書き出す。
+
+    Args:
+        supabase: Supabaseクライアント
+        table: テーブル名
+        rows: upsertする行
+        batch_size: 1リクエストあたりの行数
+        workers: 同時リクエスト数
+        on_conflict: 突き合わせに使うユニーク制約のカラム（カンマ区切り）
+        sort_keys: バッチを並べる主キーのカラム
+        max_retries: バッチごとの最大リトライ回数
+        dead_letter_path: 失敗したバッチの書き出し先（NDJSON、replay_dead_letters() で再送可能）
+
+    Returns:
+        統計の辞書（rows / bytes / batches / retries / failed_batches /
+        failed_rows / latencies / elapsed）
+    """
+    batches = serialize_batches(rows, batch_size, sort_keys)
+    lock = threading.Lock()
+    stats = _empty_stats()
+    stats['batches'] = len(batches)
+
+    def send(item: Tuple[List[Dict], bytes]):
+        batch, payload = item
+        error = None
+        for attempt in range(max_retries + 1):
+            if attempt > 0:
+                time.sleep(RETRY_BACKOFF * (2 ** (attempt - 1)))
+                with lock:
+                    stats['retries'] += 1
+            started = time.perf_counter()
+            try:
+                post_batch(supabase, table, payload, on_conflict)
+            except Exception as e:
+                error = e
+                if is_transient_error(e):
+                    continue
+                break
+            latency = time.perf_counter() - started
+            metrics.record(f"upsert:{table}", latency, kind='batch', rows=len(batch),
+                           bytes=len(payload), retries=attempt)
+            with lock:
+                stats['rows'] += len(batch)
+                stats['bytes'] += len(payload)
+                stats['latencies'].append(latency)
+            return
+
+        print(f"  [ERROR] {table} バッチ（{len(batch)}件）の投入に失敗: {error}")
+        metrics.record(f"upsert:{table}", time.perf_counter() - started, kind='batch',
+                       rows=len(batch), bytes=len(payload), retries=attempt,
+                       status='error', error=str(error))
+        with lock:
+            stats['failed_batches'] += 1
+            stats['failed_rows'].extend(batch)
+            if dead_letter_path:
+                with open(dead_letter_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({
+                        'table': table,
+                        'on_conflict': on_conflict,
+                        'rows': batch
+                    }, ensure_ascii=False) + '\n')
+
+    started = time.perf_counter()
+    if batches:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batches)))) as executor:
+            list(executor.map(send, batches))
+    stats['elapsed'] = time.perf_counter() - started
+    return stats
+
+
+def print_upload_stats(stats: Dict[str, Any]):
+    """アップロード統計を表示"""
+    elapsed = stats['elapsed'] or 1e-9
+    latencies = stats['latencies']
+    print(f"  {stats['rows']:,} 行 / {stats['bytes'] / 1024:,.0f} KB / {stats['batches']} バッチ"
+          f" / {elapsed:.2f}s ({stats['rows'] / elapsed:,.0f} 行/秒)")
+    if latencies:
+        print(f"  レイテンシ p50 {percentile(latencies, 50) * 1000:.0f}ms"
+              f" / p95 {percentile(latencies, 95) * 1000:.0f}ms"
+              f" / p99 {percentile(latencies, 99) * 1000:.0f}ms"
+              f" / 最大 {max(latencies) * 1000:.0f}ms")
+    if stats['retries'] or stats['failed_batches']:
+        print(f"  リトライ {stats['retries']} 回 / 失敗 {stats['failed_batches']} バッチ")
+
+
+def replay_dead_letters(supabase, dead_letter_path: Path,
+                        workers: int = DEFAULT_WORKERS) -> Dict[str, Any]:
+    """
+    デッドレターファイルのバッチを再送
+
+    再送にも失敗したバッチは一時ファイルに書き出し、全バッチを送り終えてから
+    元のファイルと置き換える（途中で中断・異常終了しても元のファイルは失われない。
+    送信済みのバッチは次回もう一度送られるが、upsert なので結果は変わらない）。
+
+    Returns:
+        統計の辞書（upload_batches() と同じ形式を合算したもの）
+    """
+    with open(dead_letter_path, 'r', encoding='utf-8') as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+
+    # 失敗分は upload_batches() に一時ファイルへ書き出させる（前回中断時の残りは消す）
+    failed_path = dead_letter_path.with_name(dead_letter_path.name + '.tmp')
+    if failed_path.exists():
+        failed_path.unlink()
+
+    # テーブル・競合キーごとにまとめて再送
+    grouped = {}
+    for entry in entries:
+        group = grouped.setdefault((entry['table'], entry['on_conflict']), [])
+        group.append(entry['rows'])
+
+    total = _empty_stats()
+    for (table, on_conflict), batches in grouped.items():
+        rows = [row for batch in batches for row in batch]
+        batch_size = max(1, max(len(batch) for batch in batches))
+        stats = upload_batches(supabase, table, rows, batch_size=batch_size,
+                               workers=workers, on_conflict=on_conflict,
+                               dead_letter_path=failed_path)
+        for key, value in stats.items():
+            total[key] += value
+
+    if total['failed_batches']:
+        os.replace(failed_path, dead_letter_path)
+    else:
+        dead_letter_path.unlink()
+    return total
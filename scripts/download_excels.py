@@ -1,11 +1,19 @@
 """
 環境省「自治体排出量カルテ」Excelファイル一括ダウンロード
 """
-import os
+import argparse
 import csv
+import email.utils
+import json
+import os
+import threading
 import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, Optional, Tuple
+from requests.adapters import HTTPAdapter
+import metrics
 
 
 # 設定
@@ -13,48 +21,289 @@ BASE_URL = "https://policies.env.go.jp/policy/roadmap/local_keikaku/kuiki/files/
 DATA_DIR = Path(__file__).parent.parent / "data"
 RAW_DIR = DATA_DIR / "raw"
 MUNICIPALITIES_CSV = DATA_DIR / "tokyo_municipalities.csv"
+# ETag / Last-Modified の保存先（条件付きGET用）
+DOWNLOAD_META_JSON = RAW_DIR / "download_meta.json"
 
-# ダウンロード間隔（秒）- サーバー負荷軽減のため
-DOWNLOAD_INTERVAL = 0.5
+# リクエストレート（件/秒）- サーバー負荷軽減のため
+DOWNLOAD_RATE = 2.0
+# 同時接続数
+DOWNLOAD_WORKERS = 4
+# リトライ回数と初回待機秒数（指数バックオフ）
+MAX_RETRIES = 3
+RETRY_BACKOFF = 1.0
+REQUEST_TIMEOUT = 30
+CHUNK_SIZE = 64 * 1024
 
+# リトライ対象のHTTPステータス
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Retry-After で待機する最大秒数（サーバーが極端に長い値を返した場合の上限）
+MAX_RETRY_AFTER = 300.0
 
-def download_excel(city_code: str, output_dir: Path) -> bool:
+
+class TokenBucket:
     """
-    指定した自治体のExcelファイルをダウンロード
+    トークンバケット方式のレート制限（スレッドセーフ）
+
+    rate 件/秒でトークンを補充し、最大 capacity 件までのバーストを許可する。
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def pause(self, seconds: float):
+        """seconds 秒間、すべてのワーカーのトークン取得を止める（429の Retry-After 用）"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def acquire(self):
+        """トークンを1つ取得（なければ補充されるまで待機）"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.rate <= 0:
+                    return
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def create_session(pool_size: int = DOWNLOAD_WORKERS) -> requests.Session:
+    """
+    コネクションプール付きのセッションを作成
 
     Args:
-        city_code: 5桁の団体コード
-        output_dir: 保存先ディレクトリ
+        pool_size: プール内の最大コネクション数
 
     Returns:
-        成功した場合True、失敗した場合False
+        Keep-Aliveで接続を使い回すセッション
     """
-    url = BASE_URL.format(city_code=city_code)
-    output_path = output_dir / f"{city_code}.xlsx"
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
-    # 既にファイルが存在する場合はスキップ
-    if output_path.exists():
-        print(f"[SKIP] {city_code} - Already exists")
-        return True
 
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Retry-After ヘッダーを待機秒数に変換
+
+    Args:
+        value: 秒数またはHTTP日付（例: '120' / 'Wed, 21 Oct 2026 07:28:00 GMT'）
+
+    Returns:
+        待機秒数（0 〜 MAX_RETRY_AFTER、解釈できなければ None）
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        seconds = float(value)
+    else:
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at is None:
+            return None
+        seconds = retry_at.timestamp() - time.time()
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+def load_download_meta(meta_path: Path = DOWNLOAD_META_JSON) -> Dict[str, Dict]:
+    """ETag / Last-Modified のメタデータを読み込み"""
+    if not meta_path.exists():
+        return {}
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_download_meta(meta: Dict[str, Dict], meta_path: Path = DOWNLOAD_META_JSON):
+    """メタデータを一時ファイル経由で書き出し"""
+    tmp_path = meta_path.with_suffix('.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, meta_path)
+
+
+def _conditional_headers(output_path: Path, entry: Optional[Dict]) -> Dict[str, str]:
+    """既存ファイルに対する条件付きGETヘッダーを作成"""
+    if not output_path.exists():
+        return {}
+    headers = {}
+    if entry and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry and entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    if not headers:
+        # メタデータがない既存ファイルはファイル更新時刻で判定
+        headers['If-Modified-Since'] = time.strftime(
+            '%a, %d %b %Y %H:%M:%S GMT', time.gmtime(output_path.stat().st_mtime))
+    return headers
+
+
+def _download_excel(city_code: str, output_dir: Path,
+                    session: Optional[requests.Session],
+                    bucket: Optional[TokenBucket],
+                    meta: Optional[Dict[str, Dict]],
+                    meta_lock: Optional[threading.Lock],
+                    base_url: str,
+                    max_retries: int) -> Tuple[str, int, int]:
+    """download_excel() の本体（結果, リトライ回数, 取得バイト数）を返す"""
+    url = base_url.format(city_code=city_code)
+    output_path = output_dir / f"{city_code}.xlsx"
+    part_path = output_dir / f"{city_code}.xlsx.part"
+    session = session or create_session(1)
+    meta = meta if meta is not None else {}
+    meta_lock = meta_lock or threading.Lock()
+
+    with meta_lock:
+        entry = dict(meta.get(city_code) or {})
 
-        # ファイルを保存
-        with open(output_path, 'wb') as f:
-            f.write(response.content)
+    validator = None  # 再開時の If-Range 用
+    retry_after = None  # 直前の429/503で指定された待機秒数
 
-        print(f"[OK] {city_code} - Downloaded ({len(response.content)} bytes)")
-        return True
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            backoff = RETRY_BACKOFF * (2 ** (attempt - 1))
+            time.sleep(max(backoff, retry_after or 0))
+            retry_after = None
 
-    except requests.exceptions.RequestException as e:
-        print(f"[ERROR] {city_code} - {e}")
-        return False
+        headers = _conditional_headers(output_path, entry)
+        resume_from = part_path.stat().st_size if part_path.exists() else 0
+        if resume_from and validator:
+            headers['Range'] = f"bytes={resume_from}-"
+            headers['If-Range'] = validator
+
+        if bucket:
+            bucket.acquire()
+
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                if response.status_code == 304:
+                    print(f"[SKIP] {city_code} - Not modified")
+                    return 'SKIP', attempt, 0
+
+                if response.status_code in RETRY_STATUS:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    if retry_after and bucket:
+                        # 他のワーカーも含めて Retry-After の間はリクエストを送らない
+                        bucket.pause(retry_after)
+                    wait = f", {retry_after:.0f}s待機" if retry_after else ""
+                    print(f"[RETRY] {city_code} - HTTP {response.status_code} "
+                          f"({attempt + 1}/{max_retries + 1}{wait})")
+                    continue
+
+                response.raise_for_status()
+
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+                validator = etag or last_modified
+
+                # 206なら追記、200なら最初から書き直す
+                mode = 'ab' if response.status_code == 206 else 'wb'
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+
+                expected = response.headers.get('Content-Range', '').rpartition('/')[2]
+                size = part_path.stat().st_size
+                if expected.isdigit() and int(expected) != size:
+                    part_path.unlink()
+                    raise requests.exceptions.ContentDecodingError(
+                        f"size mismatch ({size} / {expected} bytes)")
+
+        except requests.exceptions.HTTPError as e:
+            if part_path.exists():
+                part_path.unlink()
+            print(f"[ERROR] {city_code} - {e}")
+            return 'ERROR', attempt, 0
+
+        except requests.exceptions.RequestException as e:
+            print(f"[RETRY] {city_code} - {e} ({attempt + 1}/{max_retries + 1})")
+            continue
+
+        os.replace(part_path, output_path)
+        with meta_lock:
+            meta[city_code] = {'etag': etag, 'last_modified': last_modified}
+
+        print(f"[OK] {city_code} - Downloaded ({size} bytes)")
+        return 'OK', attempt, size
+
+    print(f"[ERROR] {city_code} - リトライ上限に達しました")
+    return 'ERROR', max_retries, 0
+
+
+def download_excel(city_code: str, output_dir: Path,
+                   session: Optional[requests.Session] = None,
+                   bucket: Optional[TokenBucket] = None,
+                   meta: Optional[Dict[str, Dict]] = None,
+                   meta_lock: Optional[threading.Lock] = None,
+                   base_url: str = BASE_URL,
+                   max_retries: int = MAX_RETRIES) -> str:
+    """
+    指定した自治体のExcelファイルをダウンロード
+
+    一時ファイル（.part）にストリーム書き込みしてからリネームする。
+    途中で切断された場合は Range ヘッダーで続きから再開する。
+
+    Args:
+        city_code: 5桁の団体コード
+        output_dir: 保存先ディレクトリ
+        session: 共有セッション（省略時は新規作成）
+        bucket: レート制限（省略時は制限なし）
+        meta: 団体コード -> {'etag', 'last_modified'} の辞書（条件付きGET用、更新される）
+        meta_lock: meta 更新用のロック
+        base_url: ダウンロードURLのテンプレート
+        max_retries: 最大リトライ回数
+
+    Returns:
+        'OK'（取得）/ 'SKIP'（未変更）/ 'ERROR'（失敗）
+    """
+    started = time.perf_counter()
+    status, retries, size = _download_excel(city_code, output_dir, session, bucket, meta,
+                                            meta_lock, base_url, max_retries)
+    metrics.record('download', time.perf_counter() - started, kind='file', city_code=city_code,
+                   bytes=size, retries=retries, result=status,
+                   status='error' if status == 'ERROR' else 'ok')
+    return status
+
+
+def parse_args() -> argparse.Namespace:
+    """コマンドライン引数を解析"""
+    parser = argparse.ArgumentParser(description="排出量カルテExcelを一括ダウンロード")
+    parser.add_argument('--workers', type=int, default=DOWNLOAD_WORKERS,
+                        help=f"同時接続数（デフォルト{DOWNLOAD_WORKERS}）")
+    parser.add_argument('--rate', type=float, default=DOWNLOAD_RATE,
+                        help=f"最大リクエスト数/秒（デフォルト{DOWNLOAD_RATE}、0で無制限）")
+    parser.add_argument('--retries', type=int, default=MAX_RETRIES,
+                        help=f"失敗時の最大リトライ回数（デフォルト{MAX_RETRIES}）")
+    parser.add_argument('--base-url', default=BASE_URL,
+                        help="ダウンロードURLのテンプレート（{city_code} を含む）")
+    metrics.add_metrics_args(parser)
+    return parser.parse_args()
 
 
 def main():
     """メイン処理"""
+    args = parse_args()
+    metrics.start_run('download_excels', args)
+
     # 出力ディレクトリを作成
     RAW_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -67,26 +316,40 @@ def main():
 
     print(f"東京都 {len(city_codes)} 自治体のExcelファイルをダウンロード開始")
     print(f"保存先: {RAW_DIR}")
+    print(f"同時接続数: {args.workers} / レート: {args.rate}件/秒")
     print("-" * 60)
 
-    success_count = 0
-    fail_count = 0
+    meta = load_download_meta()
+    meta_lock = threading.Lock()
+    bucket = TokenBucket(args.rate)
+    session = create_session(args.workers)
 
-    for i, city_code in enumerate(city_codes, 1):
-        print(f"[{i}/{len(city_codes)}] ", end="")
+    def task(city_code: str) -> str:
+        return download_excel(city_code, RAW_DIR, session, bucket, meta, meta_lock,
+                              base_url=args.base_url, max_retries=args.retries)
 
-        if download_excel(city_code, RAW_DIR):
-            success_count += 1
-        else:
-            fail_count += 1
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+            statuses = list(executor.map(task, city_codes))
+    finally:
+        session.close()
+        save_download_meta(meta)
+
+    success_count = statuses.count('OK')
+    skip_count = statuses.count('SKIP')
+    fail_count = statuses.count('ERROR')
 
-        # サーバー負荷軽減のため待機
-        if i < len(city_codes):
-            time.sleep(DOWNLOAD_INTERVAL)
+    elapsed = time.perf_counter() - started
+    metrics.record('download_all', elapsed, rows=success_count, workers=args.workers)
 
     print("-" * 60)
-    print(f"完了: 成功 {success_count} / 失敗 {fail_count} / 合計 {len(city_codes)}")
+    print(f"完了: 取得 {success_count} / 未変更 {skip_count} / 失敗 {fail_count} / 合計 {len(city_codes)}")
+    print(f"所要時間: {elapsed:.1f}s")
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        metrics.finish()
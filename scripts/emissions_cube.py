@@ -0,0 +1,183 @@
+"""
+排出量キューブ（自治体 × 年度 × 部門 の密な配列）
+
+パース済みデータから一度だけ構築し、年度合計・投入用の行を
+配列のスライスで取り出す。KPI計算・DB投入の各ステップで共有する。
+"""
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+from kpi_calculator import round_like_python
+from emissions_store import (
+    EMISSIONS_JSON,
+    EMISSIONS_NDJSON,
+    EMISSIONS_PARQUET,
+    load_emissions_columns,
+    load_emissions_data,
+    latest_source
+)
+
+
+def _sector_order(first_seen: np.ndarray) -> np.ndarray:
+    """自治体ごとに部門を最初に現れた順に並べたインデックス（現れない部門は後ろ）"""
+    return np.argsort(first_seen, axis=1, kind='stable')
+
+
+class EmissionsCube:
+    """
+    自治体 × 年度 × 部門 の排出量配列（千t-CO₂、欠損はNaN）
+
+    Attributes:
+        city_codes: 団体コード（データ出現順）
+        city_names: 自治体名
+        years: 年度（昇順）
+        sectors: 部門名（データ出現順）
+        values: shape (自治体数, 年度数, 部門数) の配列
+        sector_order: shape (自治体数, 部門数) の部門インデックス
+                      （自治体ごとのデータ上の部門の順、その自治体にない部門は後ろ）
+    """
+
+    def __init__(self, city_codes: List[str], city_names: List[str],
+                 years: List[int], sectors: List[str], values: np.ndarray,
+                 sector_order: Optional[np.ndarray] = None):
+        self.city_codes = list(city_codes)
+        self.city_names = list(city_names)
+        self.years = list(years)
+        self.sectors = list(sectors)
+        self.values = values
+        if sector_order is None:
+            sector_order = np.tile(np.arange(len(self.sectors)), (len(self.city_codes), 1))
+        self.sector_order = sector_order
+
+        self.city_index = {code: i for i, code in enumerate(self.city_codes)}
+        self.year_index = {year: i for i, year in enumerate(self.years)}
+        self.sector_index = {sector: i for i, sector in enumerate(self.sectors)}
+
+        # 年度ごとの合計を先に計算しておく。
+        # 部門は自治体ごとにデータ上の順で1つずつ足す（以前の自治体ごとの合計と同じ加算順。
+        # 部門の順は自治体によって違うことがあり、順が違うと浮動小数点の誤差が変わる）
+        self._raw_totals = np.zeros(values.shape[:2])
+        rows = np.arange(values.shape[0])
+        for k in range(values.shape[2]):
+            self._raw_totals += np.nan_to_num(values[rows, :, sector_order[:, k]])
+        self._totals = round_like_python(self._raw_totals, 2)
+
+    @classmethod
+    def from_records(cls, emissions_data: List[Dict]) -> 'EmissionsCube':
+        """
+        パース結果（emissions[sector][year] = value）から構築
+
+        年度キーは int / str のどちらでもよい。
+        """
+        years = set()
+        sectors = {}
+        for muni_data in emissions_data:
+            for sector, yearly_data in muni_data['emissions'].items():
+                sectors.setdefault(sector, len(sectors))
+                years.update(int(year) for year in yearly_data)
+        years = sorted(years)
+        year_index = {year: i for i, year in enumerate(years)}
+
+        values = np.full((len(emissions_data), len(years), len(sectors)), np.nan)
+        first_seen = np.full((len(emissions_data), len(sectors)), np.inf)
+        for c, muni_data in enumerate(emissions_data):
+            for position, (sector, yearly_data) in enumerate(muni_data['emissions'].items()):
+                s = sectors[sector]
+                first_seen[c, s] = position
+                for year, value in yearly_data.items():
+                    if value is not None:
+                        values[c, year_index[int(year)], s] = value
+
+        return cls(
+            [muni_data['city_code'] for muni_data in emissions_data],
+            [muni_data.get('city_name') for muni_data in emissions_data],
+            years, list(sectors), values, _sector_order(first_seen)
+        )
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, np.ndarray]) -> 'EmissionsCube':
+        """縦持ちの列配列（emissions_store.load_emissions_columns()）から構築"""
+
+        def factorize(array: np.ndarray):
+            # 出現順を保ったまま一意な値とインデックスに分解
+            uniques, first, inverse = np.unique(array, return_index=True, return_inverse=True)
+            order = np.argsort(first)
+            rank = np.empty_like(order)
+            rank[order] = np.arange(len(order))
+            return uniques[order], first[order], rank[inverse.reshape(-1)]
+
+        city_codes, city_first, city_idx = factorize(columns['city_code'])
+        sectors, _, sector_idx = factorize(columns['sector'])
+        years, year_idx = np.unique(columns['fiscal_year'], return_inverse=True)
+
+        values = np.full((len(city_codes), len(years), len(sectors)), np.nan)
+        values[city_idx, year_idx.reshape(-1), sector_idx] = columns['value_kt_co2']
+        first_seen = np.full((len(city_codes), len(sectors)), np.inf)
+        np.minimum.at(first_seen, (city_idx, sector_idx), np.arange(len(city_idx)))
+
+        return cls(city_codes.tolist(), columns['city_name'][city_first].tolist(),
+                   [int(year) for year in years], sectors.tolist(), values, _sector_order(first_seen))
+
+    @property
+    def n_cities(self) -> int:
+        """自治体数"""
+        return len(self.city_codes)
+
+    def raw_totals(self, year: int) -> np.ndarray:
+        """指定年度の自治体ごとの全部門合計（丸めなし、データなしは0）"""
+        if year not in self.year_index:
+            return np.zeros(self.n_cities)
+        return self._raw_totals[:, self.year_index[year]]
+
+    def totals(self, year: int) -> np.ndarray:
+        """指定年度の自治体ごとの全部門合計（小数2桁）"""
+        if year not in self.year_index:
+            return np.zeros(self.n_cities)
+        return self._totals[:, self.year_index[year]]
+
+    def city_total(self, city_code: str, year: int, rounded: bool = True) -> float:
+        """1自治体の指定年度の全部門合計"""
+        totals = self.totals(year) if rounded else self.raw_totals(year)
+        return float(totals[self.city_index[city_code]])
+
+    def iter_rows(self, city_codes: Optional[List[str]] = None) -> Iterator[Dict]:
+        """
+        emissions テーブルの行（値のあるセルのみ）を順に返す
+
+        Args:
+            city_codes: 対象の団体コード（省略時は全自治体）
+        """
+        if city_codes is None:
+            city_indices = np.arange(self.n_cities)
+        else:
+            city_indices = np.array([self.city_index[code] for code in city_codes
+                                     if code in self.city_index], dtype=int)
+        cities, years, sectors = np.nonzero(~np.isnan(self.values[city_indices]))
+        cities = city_indices[cities]
+        for c, y, s in zip(cities.tolist(), years.tolist(), sectors.tolist()):
+            yield {
+                'city_code': self.city_codes[c],
+                'fiscal_year': self.years[y],
+                'sector': self.sectors[s],
+                'value_kt_co2': float(self.values[c, y, s])
+            }
+
+
+def load_emissions_cube(json_path: Path = EMISSIONS_JSON,
+                        parquet_path: Path = EMISSIONS_PARQUET,
+                        ndjson_path: Optional[Path] = EMISSIONS_NDJSON) -> Optional[EmissionsCube]:
+    """
+    パース済みデータから排出量キューブを構築
+
+    JSON・Parquet・NDJSONのうち最も新しいファイルを使う。
+    Parquetなら列データから直接構築する。
+
+    Returns:
+        EmissionsCube、ファイルがなければNone
+    """
+    source = latest_source(json_path, parquet_path, ndjson_path)
+    if source is None:
+        return None
+    if source == parquet_path:
+        return EmissionsCube.from_columns(load_emissions_columns(parquet_path))
+    return EmissionsCube.from_records(load_emissions_data(json_path, parquet_path, ndjson_path))
@@ -0,0 +1,230 @@
+"""
+排出量データの中間ファイル（列指向・縦持ち形式）の読み書き
+
+Parquetの列: city_code / city_name / fiscal_year / sector / value_kt_co2
+city_code・city_name・sector は辞書エンコードで保存する。
+NDJSONは1自治体1行（parse_excel() の結果）で、1行ずつ書き込み・読み込みできる。
+"""
+import json
+import os
+from itertools import groupby
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+import numpy as np
+
+# 設定
+DATA_DIR = Path(__file__).parent.parent / "data"
+PROCESSED_DIR = DATA_DIR / "processed"
+EMISSIONS_JSON = PROCESSED_DIR / "tokyo_emissions.json"
+EMISSIONS_PARQUET = PROCESSED_DIR / "tokyo_emissions.parquet"
+EMISSIONS_NDJSON = PROCESSED_DIR / "tokyo_emissions.ndjson"
+
+COLUMNS = ['city_code', 'city_name', 'fiscal_year', 'sector', 'value_kt_co2']
+
+
+def _import_pyarrow():
+    """pyarrow を読み込み（未インストールならエラー）"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet出力には pyarrow が必要です: pip install pyarrow")
+    return pyarrow
+
+
+def to_long_columns(all_data: List[Dict]) -> Dict[str, np.ndarray]:
+    """
+    parse_excel() の結果リストを縦持ちの列配列に変換
+
+    Args:
+        all_data: パース結果（emissions[sector][year] = value）のリスト
+
+    Returns:
+        列名 -> 配列 の辞書
+    """
+    columns = {name: [] for name in COLUMNS}
+    for muni_data in all_data:
+        for sector, yearly_data in muni_data['emissions'].items():
+            for year, value in yearly_data.items():
+                if value is None:
+                    continue
+                columns['city_code'].append(muni_data['city_code'])
+                columns['city_name'].append(muni_data['city_name'])
+                columns['fiscal_year'].append(int(year))
+                columns['sector'].append(sector)
+                columns['value_kt_co2'].append(value)
+
+    return {
+        'city_code': np.array(columns['city_code'], dtype=object),
+        'city_name': np.array(columns['city_name'], dtype=object),
+        'fiscal_year': np.array(columns['fiscal_year'], dtype=np.int16),
+        'sector': np.array(columns['sector'], dtype=object),
+        'value_kt_co2': np.array(columns['value_kt_co2'], dtype=np.float64)
+    }
+
+
+def write_emissions_parquet(all_data: List[Dict], output_path: Path = EMISSIONS_PARQUET):
+    """
+    パース結果を縦持ちParquetとして保存
+
+    Args:
+        all_data: パース結果のリスト
+        output_path: 出力先
+    """
+    pa = _import_pyarrow()
+    columns = to_long_columns(all_data)
+
+    table = pa.table({
+        'city_code': pa.array(columns['city_code'], type=pa.string()).dictionary_encode(),
+        'city_name': pa.array(columns['city_name'], type=pa.string()).dictionary_encode(),
+        'fiscal_year': pa.array(columns['fiscal_year'], type=pa.int16()),
+        'sector': pa.array(columns['sector'], type=pa.string()).dictionary_encode(),
+        'value_kt_co2': pa.array(columns['value_kt_co2'], type=pa.float64())
+    })
+    pa.parquet.write_table(table, str(output_path), compression='zstd')
+
+
+def load_emissions_columns(path: Path = EMISSIONS_PARQUET) -> Dict[str, np.ndarray]:
+    """
+    縦持ちParquetを列配列として読み込み
+
+    文字列列は辞書（重複なし）とインデックスのまま取り出してから展開するので、
+    自治体・部門名の文字列は種類数ぶんしか生成されない。
+
+    Args:
+        path: Parquetファイル
+
+    Returns:
+        列名 -> 配列 の辞書
+    """
+    pa = _import_pyarrow()
+    table = pa.parquet.read_table(str(path), columns=COLUMNS)
+
+    columns = {}
+    for name in COLUMNS:
+        column = table.column(name).combine_chunks()
+        if pa.types.is_dictionary(column.type):
+            dictionary = np.array(column.dictionary.to_pylist(), dtype=object)
+            columns[name] = dictionary[column.indices.to_numpy(zero_copy_only=False)]
+        else:
+            columns[name] = column.to_numpy(zero_copy_only=False)
+    return columns
+
+
+def columns_to_records(columns: Dict[str, np.ndarray]) -> List[Dict]:
+    """
+    縦持ちの列配列を tokyo_emissions.json と同じ構造に戻す
+
+    年度キーは json.load した場合と同じく文字列になる。
+    """
+    records = {}
+    for city_code, city_name, year, sector, value in zip(
+            columns['city_code'].tolist(), columns['city_name'].tolist(),
+            columns['fiscal_year'].tolist(), columns['sector'].tolist(),
+            columns['value_kt_co2'].tolist()):
+        record = records.get(city_code)
+        if record is None:
+            record = records[city_code] = {
+                'city_code': city_code,
+                'city_name': city_name,
+                'years': set(),
+                'emissions': {}
+            }
+        record['years'].add(year)
+        record['emissions'].setdefault(sector, {})[str(year)] = value
+
+    for record in records.values():
+        record['years'] = sorted(record['years'])
+    return list(records.values())
+
+
+def latest_source(json_path: Path, parquet_path: Path,
+                  ndjson_path: Optional[Path] = None) -> Optional[Path]:
+    """
+    JSON・Parquet・NDJSONのうち最も新しいファイルを返す
+
+    更新日時が同じならParquet、JSON、NDJSONの順に優先する。
+
+    Returns:
+        最も新しいファイル、どれもなければNone
+    """
+    candidates = [p for p in (parquet_path, json_path, ndjson_path) if p is not None and p.exists()]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda p: p.stat().st_mtime)
+
+
+def load_emissions_data(json_path: Path = EMISSIONS_JSON,
+                        parquet_path: Path = EMISSIONS_PARQUET,
+                        ndjson_path: Optional[Path] = EMISSIONS_NDJSON) -> Optional[List[Dict]]:
+    """
+    パース済み排出量データを読み込み（json.load した場合と同じ構造）
+
+    JSON・Parquet・NDJSONのうち最も新しいファイルから読み込む
+    （parse_excels.py --format ndjson の後でも古いJSONを読まない）。
+
+    Returns:
+        パース結果のリスト、ファイルがなければNone
+    """
+    source = latest_source(json_path, parquet_path, ndjson_path)
+    if source is None:
+        return None
+    if source == parquet_path:
+        return columns_to_records(load_emissions_columns(parquet_path))
+    if source == ndjson_path:
+        return list(iter_emissions_ndjson(ndjson_path))
+    with open(json_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class NdjsonWriter:
+    """
+    パース結果を1自治体1行で書き出す（全件をメモリに持たない）
+
+    一時ファイルに追記し、close() で出力先に置き換える。
+    途中で例外が起きた場合は一時ファイルを削除し、出力先は前回のまま残す。
+    """
+
+    def __init__(self, output_path: Path = EMISSIONS_NDJSON):
+        self.output_path = output_path
+        self.tmp_path = output_path.with_suffix('.ndjson.tmp')
+        self.file = open(self.tmp_path, 'w', encoding='utf-8')
+        self.count = 0
+
+    def write(self, record: Dict):
+        """1自治体分を書き込み"""
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.count += 1
+
+    def close(self):
+        """書き込みを終えて出力先に置き換え"""
+        self.file.close()
+        os.replace(self.tmp_path, self.output_path)
+
+    def __enter__(self) -> 'NdjsonWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            self.tmp_path.unlink()
+
+
+def iter_emissions_ndjson(path: Path = EMISSIONS_NDJSON) -> Iterator[Dict]:
+    """NDJSONのパース結果を1自治体ずつ読み込み（年度キーは json.load と同じく文字列）"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_prefecture_chunks(records: Iterable[Dict]) -> Iterator[List[Dict]]:
+    """
+    団体コード順に並んだパース結果を都道府県ごとのリストにまとめて返す
+
+    並びが都道府県ごとに連続していない場合は、連続する範囲ごとに分かれる。
+    """
+    for _, chunk in groupby(records, key=lambda record: record['city_code'][:2]):
+        yield list(chunk)
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Next.jsのページ向けAPIレスポンスを静的JSONとして書き出し
+
+投入後のローカルミラー（local_mirror.py）から、/api/prefectures・
+/api/prefectures/[code]・/api/municipalities/[cityCode]・.../trajectory と
+同じ形のレスポンスを都道府県・自治体ごとに組み立て、
+minifyしたJSON（--gzip で .json.gz も）として public/data/api/ に書き出す。
+
+各ファイルのSHA-256は manifest.json に記録し、2回目以降は内容が変わった
+ファイルだけを書き換える。出力されなくなったファイルは削除する。
+
+ミラーの同期は local_mirror.py と同じく前回の同期以降に更新された行だけを取得するため、
+排出量が変わっていなければ emissions は行数の確認だけで済む（全件の取得はしない）。
+
+実行: python export_static_api.py              # ミラーを同期してから書き出し
+      python export_static_api.py --offline    # ミラーの現在値から書き出し（ネットワークなし）
+      python export_static_api.py --full-sync  # ミラーを全件取得し直してから書き出し
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+from itertools import groupby
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+from db import get_client
+from local_mirror import MIRROR_DB, MIRROR_TABLES, open_mirror, read_rows, sync
+import metrics
+
+# 設定
+ROOT_DIR = Path(__file__).parent.parent
+OUTPUT_DIR = ROOT_DIR / "public" / "data" / "api"
+MANIFEST_NAME = "manifest.json"
+
+BASE_YEAR = 2013
+TARGET_YEAR_2030 = 2030
+TARGET_YEAR_2050 = 2050
+TARGET_REDUCTION_RATE_2030 = 0.46  # 46%削減
+TARGET_REDUCTION_RATE_2050 = 0.80  # 80%削減
+
+# 都道府県ページの自治体一覧に含める自治体マスターのカラム（queries.ts と同じ）
+PREFECTURE_MUNICIPALITY_COLUMNS = ('name', 'population', 'zero_carbon_declared')
+# SQLiteでは 0/1 で保存されるBOOLEANのカラム
+BOOLEAN_COLUMNS = ('zero_carbon_declared',)
+
+
+def sort_by_pace(rows: List[Dict], key: str) -> List[Dict]:
+    """
+    ペース達成率の降順に並べ替え（queries.ts の order('pace_achievement_rate', desc)）
+
+    PostgreSQLの降順と同じく値のない行を先頭にし、同率は主キー順にする。
+    """
+    rows = sorted(rows, key=lambda row: row[key])
+    return sorted(rows, key=lambda row: (row['pace_achievement_rate'] is None,
+                                         row['pace_achievement_rate'] or 0), reverse=True)
+
+
+def build_trajectory(kpi: Dict, totals_by_year: Dict[int, float]) -> List[Dict]:
+    """
+    削減軌道（src/app/tokyo/[cityCode]/page.tsx と同じ計算）
+
+    Args:
+        kpi: 自治体KPIの行
+        totals_by_year: 年度 -> 全部門の排出量合計(kt)
+
+    Returns:
+        TrajectoryDataPoint のリスト
+    """
+    base_year = kpi['base_year'] or BASE_YEAR
+    base_emission = float(kpi['base_emission_kt'])
+    target_2030 = base_emission * (1 - TARGET_REDUCTION_RATE_2030)
+    target_2050 = base_emission * (1 - TARGET_REDUCTION_RATE_2050)
+
+    points = [{'year': base_year, 'actual': base_emission, 'required': base_emission,
+               'target2030': None, 'target2050': None}]
+    points += [{'year': year, 'actual': total, 'required': None, 'target2030': None, 'target2050': None}
+               for year, total in sorted(totals_by_year.items()) if year > base_year]
+    points.append({'year': TARGET_YEAR_2030, 'actual': None, 'required': target_2030,
+                   'target2030': target_2030, 'target2050': None})
+    points.append({'year': TARGET_YEAR_2050, 'actual': None, 'required': target_2050,
+                   'target2030': None, 'target2050': target_2050})
+
+    # 必要軌道（基準年から2050年まで、必要ペースで毎年削減した場合）
+    required_pace = float(kpi['required_pace'])
+    for point in points:
+        if base_year < point['year'] <= TARGET_YEAR_2050:
+            point['required'] = base_emission * (1 - required_pace / 100) ** (point['year'] - base_year)
+    return points
+
+
+def iter_city_emissions(conn: sqlite3.Connection) -> Iterator[Tuple[str, List[sqlite3.Row]]]:
+    """ミラーの排出量を自治体ごとに取得（団体コード・年度順）"""
+    cursor = conn.execute("SELECT city_code, fiscal_year, sector, value_kt_co2 FROM emissions "
+                          "ORDER BY city_code, fiscal_year, sector")
+    for city_code, rows in groupby(cursor, key=lambda row: row['city_code']):
+        yield city_code, list(rows)
+
+
+def build_payloads(conn: sqlite3.Connection) -> Dict[str, object]:
+    """
+    ミラーの値から全レスポンスを組み立て
+
+    Args:
+        conn: ミラーの接続
+
+    Returns:
+        出力先の相対パス -> レスポンスの内容
+    """
+    municipalities = {}
+    for row in read_rows(conn, 'municipalities'):
+        for column in BOOLEAN_COLUMNS:
+            if row[column] is not None:
+                row[column] = bool(row[column])
+        municipalities[row['city_code']] = row
+    kpis = read_rows(conn, 'municipality_kpis')
+    prefectures = read_rows(conn, 'prefecture_kpis')
+
+    payloads = {'prefectures.json': {'data': sort_by_pace(prefectures, 'prefecture_code')}}
+
+    # 都道府県ごとの自治体一覧
+    by_prefecture: Dict[str, List[Dict]] = {}
+    for kpi in kpis:
+        master = municipalities.get(kpi['city_code']) or {}
+        row = dict(kpi)
+        row['municipalities'] = {column: master.get(column) for column in PREFECTURE_MUNICIPALITY_COLUMNS}
+        by_prefecture.setdefault(kpi['city_code'][:2], []).append(row)
+    for prefecture in prefectures:
+        code = prefecture['prefecture_code']
+        payloads[f"prefectures/{code}.json"] = {
+            'prefecture': prefecture,
+            'municipalities': sort_by_pace(by_prefecture.get(code, []), 'city_code')
+        }
+
+    # 自治体ごとの詳細・削減軌道
+    emissions = dict(iter_city_emissions(conn))
+    for kpi in kpis:
+        city_code = kpi['city_code']
+        rows = emissions.get(city_code, [])
+        yearly_by_sector: Dict[str, Dict[str, float]] = {}
+        totals_by_year: Dict[int, float] = {}
+        for row in rows:
+            value = float(row['value_kt_co2'] or 0)
+            yearly_by_sector.setdefault(row['sector'], {})[str(row['fiscal_year'])] = value
+            totals_by_year[row['fiscal_year']] = totals_by_year.get(row['fiscal_year'], 0) + value
+
+        municipality = dict(kpi)
+        municipality['municipalities'] = municipalities.get(city_code)
+        payloads[f"municipalities/{city_code}.json"] = {
+            'municipality': municipality,
+            'sectorData': [{'cityCode': city_code, 'sector': sector, 'yearlyData': yearly}
+                           for sector, yearly in yearly_by_sector.items()]
+        }
+        payloads[f"municipalities/{city_code}/trajectory.json"] = {
+            'trajectory': build_trajectory(kpi, totals_by_year)
+        }
+    return payloads
+
+
+def encode_payload(payload) -> bytes:
+    """minifyしたJSON（キー順を固定し、同じ内容なら同じバイト列にする）"""
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), sort_keys=True,
+                      allow_nan=False).encode('utf-8')
+
+
+def write_atomic(path: Path, data: bytes):
+    """一時ファイル経由で書き出し（配信中のファイルが途中までの内容にならない）"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(output_dir: Path) -> Dict[str, Dict]:
+    """前回のマニフェスト（相対パス -> {'sha256', 'bytes', 'gzip_bytes'}）を読み込み"""
+    path = output_dir / MANIFEST_NAME
+    if path.exists():
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if isinstance(manifest.get('files'), dict):
+                return manifest['files']
+        except (OSError, ValueError, AttributeError):
+            pass
+    return {}
+
+
+def export_payloads(payloads: Dict[str, object], output_dir: Path = OUTPUT_DIR,
+                    compress: bool = False, dry_run: bool = False) -> Dict[str, int]:
+    """
+    内容が変わったレスポンスだけを書き出し、マニフェストを更新
+
+    Args:
+        payloads: 相対パス -> レスポンスの内容
+        output_dir: 出力先ディレクトリ
+        compress: .json.gz も書き出すか
+        dry_run: 書き込まずに件数だけ数えるか
+
+    Returns:
+        {'written', 'unchanged', 'removed', 'bytes', 'gzip_bytes'}
+    """
+    previous = load_manifest(output_dir)
+    files: Dict[str, Dict] = {}
+    counts = {'written': 0, 'unchanged': 0, 'removed': 0, 'bytes': 0, 'gzip_bytes': 0}
+
+    for rel_path in sorted(payloads):
+        data = encode_payload(payloads[rel_path])
+        entry = {'sha256': hashlib.sha256(data).hexdigest(), 'bytes': len(data)}
+        path = output_dir / rel_path
+        gz_path = path.with_name(path.name + '.gz')
+        old = previous.get(rel_path) or {}
+
+        same = old.get('sha256') == entry['sha256'] and path.exists()
+        if compress:
+            same = same and 'gzip_bytes' in old and gz_path.exists()
+        if same:
+            files[rel_path] = dict(old)
+            if not compress:
+                files[rel_path].pop('gzip_bytes', None)
+            counts['unchanged'] += 1
+        else:
+            # mtime=0 で同じ内容なら同じ .gz にする
+            gz_data = gzip.compress(data, compresslevel=9, mtime=0) if compress else None
+            if gz_data is not None:
+                entry['gzip_bytes'] = len(gz_data)
+            if not dry_run:
+                write_atomic(path, data)
+                if gz_data is not None:
+                    write_atomic(gz_path, gz_data)
+            files[rel_path] = entry
+            counts['written'] += 1
+            counts['bytes'] += len(data)
+            counts['gzip_bytes'] += entry.get('gzip_bytes', 0)
+
+        # 圧縮しない場合、内容と合わなくなった .gz は残さない
+        if not compress and not dry_run and gz_path.exists():
+            gz_path.unlink()
+
+    # 出力されなくなったファイルを削除
+    for rel_path in sorted(set(previous) - set(files)):
+        counts['removed'] += 1
+        if not dry_run:
+            path = output_dir / rel_path
+            for stale in (path, path.with_name(path.name + '.gz')):
+                if stale.exists():
+                    stale.unlink()
+            if path.parent != output_dir and path.parent.exists() and not any(path.parent.iterdir()):
+                path.parent.rmdir()
+
+    if not dry_run and (counts['written'] or counts['removed'] or files != previous
+                        or not (output_dir / MANIFEST_NAME).exists()):
+        manifest = {'files': files}
+        write_atomic(output_dir / MANIFEST_NAME,
+                     json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode('utf-8'))
+    return counts
+
+
+def parse_args() -> argparse.Namespace:
+    """コマンドライン引数を解析"""
+    parser = argparse.ArgumentParser(description="APIレスポンスを静的JSONとして書き出し")
+    parser.add_argument('--mirror', type=Path, default=MIRROR_DB, help="ミラーのSQLiteファイル")
+    parser.add_argument('--output', type=Path, default=OUTPUT_DIR, help="出力先ディレクトリ")
+    parser.add_argument('--offline', action='store_true', help="同期せずにミラーの現在値から書き出し")
+    parser.add_argument('--full-sync', action='store_true',
+                        help="前回の同期以降の差分ではなく全件を取得してから書き出し")
+    parser.add_argument('--gzip', action='store_true', help="gzip圧縮した .json.gz も書き出す")
+    parser.add_argument('--dry-run', action='store_true', help="書き込まずに変更件数だけ表示")
+    metrics.add_metrics_args(parser)
+    return parser.parse_args()
+
+
+def main():
+    """メイン処理"""
+    args = parse_args()
+    metrics.start_run('export_static_api', args)
+    conn = open_mirror(args.mirror)
+
+    if not args.offline:
+        print("=== ミラーを同期 ===")
+        sync(conn, get_client(), list(MIRROR_TABLES), args.full_sync)
+
+    print("\n=== 静的APIの書き出し ===")
+    with metrics.span('build') as span:
+        payloads = build_payloads(conn)
+        span['rows'] = len(payloads)
+    with metrics.span('write') as span:
+        counts = export_payloads(payloads, args.output, args.gzip, args.dry_run)
+        span['rows'] = counts['written']
+        span['bytes'] = counts['bytes']
+
+    print(f"対象: {len(payloads):,}ファイル（{args.output}）")
+    line = f"書き込み: {counts['written']:,}件（{counts['bytes'] / 1024:,.1f}KB"
+    if args.gzip:
+        line += f"、gzip {counts['gzip_bytes'] / 1024:,.1f}KB"
+    print(line + "）")
+    print(f"変更なし: {counts['unchanged']:,}件 / 削除: {counts['removed']:,}件")
+    if args.dry_run:
+        print("ドライラン: 書き込みは行っていません")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        metrics.finish()
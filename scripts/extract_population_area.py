@@ -4,10 +4,12 @@
 """
 import pandas as pd
 import json
+from pathlib import Path
+from stat_cache import read_excel_cached, with_header
 
 # 総務省Excelファイルを読み込み
 # このファイルは令和4年（2022年）1月1日時点のデータ
-excel_file = 'data/soumu_population_2022.xlsx'
+excel_file = Path('data/soumu_population_2022.xlsx')
 
 try:
     # Excelファイルの全シートを確認
@@ -18,7 +20,8 @@ try:
     # よくあるシート名: '市区町村', '都道府県・市区町村', '表1', etc.
     for sheet_name in xls.sheet_names[:5]:  # 最初の5シートを確認
         print(f"\n=== シート: {sheet_name} ===")
-        df = pd.read_excel(excel_file, sheet_name=sheet_name, nrows=10)
+        # 2回目以降はParquetキャッシュから読み込む
+        df = with_header(read_excel_cached(excel_file, sheet_name), 0).head(10)
         print(df.head())
         print(f"カラム: {df.columns.tolist()}")
 
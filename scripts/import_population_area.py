@@ -4,19 +4,6 @@
 東京都62自治体の人口・面積データを抽出してSupabaseに投入
 """
 import pandas as pd
-import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
-
-# 環境変数読み込み
-load_dotenv()
-supabase_url = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
-supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-
-if not supabase_url or not supabase_key:
-    raise Exception('.env.localにSupabaseの環境変数が設定されていません')
-
-supabase: Client = create_client(supabase_url, supabase_key)
 
 # Excelファイルを読み込み
 excel_file = 'data/stat_municipalities_2022_2023.xls'
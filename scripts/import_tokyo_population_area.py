@@ -1,101 +1,159 @@
 #!/usr/bin/env python3
 """
-統計局データから東京都62自治体の人口・面積データを抽出して
+統計局データから自治体の人口・面積データを抽出して
 Supabaseに投入（2022年度データ）
+
+既定は東京都（13）。--prefectures で任意の都道府県、--all で全国を対象にする。
+.xls は stat_cache.py のParquetキャッシュ経由で読み込む。
 """
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
 import pandas as pd
-import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
-
-# 環境変数読み込み
-load_dotenv()
-supabase_url = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
-supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-
-if not supabase_url or not supabase_key:
-    raise Exception('.env.localにSupabaseの環境変数が設定されていません')
-
-supabase: Client = create_client(supabase_url, supabase_key)
-
-# 1. 人口データを読み込み（人口・世帯ファイル）
-print("=== 人口データ読み込み ===")
-df_pop = pd.read_excel('../data/population_households_2022.xls', sheet_name='A', header=None)
-
-# データ行を抽出（10行目以降）
-df_pop_data = df_pop.iloc[10:].copy()
-
-# 団体コード列（32列目）でフィルタ
-df_pop_data[32] = df_pop_data[32].astype(str).str.strip()
-df_pop_tokyo = df_pop_data[df_pop_data[32].str.match(r'^13\d{3}$', na=False)]
-
-print(f"人口データ: {len(df_pop_tokyo)}件")
-
-# 2. 面積データを読み込み（自然環境ファイル）
-print("\n=== 面積データ読み込み ===")
-df_area = pd.read_excel('../data/natural_environment_2022.xls', sheet_name='B', header=None)
-
-# データ行を抽出（10行目以降）
-df_area_data = df_area.iloc[10:].copy()
-
-# 団体コード列（12列目）でフィルタ
-df_area_data[12] = df_area_data[12].astype(str).str.strip()
-df_area_tokyo = df_area_data[df_area_data[12].str.match(r'^13\d{3}$', na=False)]
-
-print(f"面積データ: {len(df_area_tokyo)}件")
-
-# 3. データをマージして更新
-print("\n=== データ更新中 ===")
-updated_count = 0
-not_found_count = 0
-
-for idx in df_pop_tokyo.index:
-    city_code = df_pop_tokyo.loc[idx, 32]
-    name = str(df_pop_tokyo.loc[idx, 8]).strip()  # 市区町村名
+from db import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_WORKERS,
+    diff_rows,
+    get_client,
+    print_diff,
+    select_all,
+    upsert_batches
+)
+from stat_cache import AREA_XLS, POPULATION_XLS, filter_prefectures, load_area_table, load_population_table
+
+DEFAULT_PREFECTURES = ['13']
+
+
+def load_population(prefectures: Optional[Sequence[str]],
+                    path: Path = POPULATION_XLS) -> pd.DataFrame:
+    """人口データを読み込み（city_code / name / population_2020 / population_2015）"""
+    return filter_prefectures(load_population_table(path), prefectures).reset_index()
+
+
+def load_area(prefectures: Optional[Sequence[str]],
+              path: Path = AREA_XLS) -> pd.DataFrame:
+    """面積データを読み込み（city_code / area_km2、団体コードの重複は先頭を採用）"""
+    return filter_prefectures(load_area_table(path), prefectures).reset_index()
+
+
+def merge_population_area(df_pop: pd.DataFrame, df_area: pd.DataFrame) -> pd.DataFrame:
+    """
+    人口と面積を団体コードで結合
+
+    人口は2020年住民基本台帳人口、欠損なら2015年国勢調査人口を使う。
+
+    Returns:
+        city_code / name / population / area_km2 / population_source / has_area_row
+    """
+    merged = df_pop.merge(df_area.assign(has_area_row=True), on='city_code', how='left')
+    merged['has_area_row'] = merged['has_area_row'].fillna(False).astype(bool)
+    merged['population'] = merged['population_2020'].fillna(merged['population_2015'])
+    merged['population_source'] = '2020'
+    merged.loc[merged['population_2020'].isna(), 'population_source'] = '2015'
+    merged.loc[merged['population'].isna(), 'population_source'] = None
+    return merged
+
+
+def validate(merged: pd.DataFrame) -> Dict[str, int]:
+    """結合結果を一括検証して件数を集計"""
+    return {
+        'rows': len(merged),
+        'duplicate_codes': int(merged['city_code'].duplicated().sum()),
+        'population_missing': int(merged['population'].isna().sum()),
+        'population_fallback_2015': int((merged['population_source'] == '2015').sum()),
+        'area_row_missing': int((~merged['has_area_row']).sum()),
+        'area_nan': int((merged['has_area_row'] & merged['area_km2'].isna()).sum())
+    }
+
+
+def build_new_values(merged: pd.DataFrame) -> Dict[str, Dict]:
+    """団体コード -> {population, area_km2}（欠損値は更新しない）"""
+    new_values = {}
+    for city_code, population, area_km2 in zip(merged['city_code'].tolist(),
+                                               merged['population'].tolist(),
+                                               merged['area_km2'].tolist()):
+        values = {}
+        if pd.notna(population):
+            values['population'] = int(population)
+        if pd.notna(area_km2):
+            values['area_km2'] = float(area_km2)
+        if values:
+            new_values[city_code] = values
+    return new_values
+
+
+def fetch_municipalities(supabase, prefectures: Optional[Sequence[str]]) -> List[Dict]:
+    """対象都道府県の自治体マスターを取得"""
+    filters = []
+    if prefectures is not None:
+        filters = [('prefecture_code', 'in', f"({','.join(prefectures)})")]
+    return select_all(supabase, 'municipalities', order='city_code', filters=filters)
+
+
+def parse_args() -> argparse.Namespace:
+    """コマンドライン引数を解析"""
+    parser = argparse.ArgumentParser(description="人口・面積データをSupabaseに投入")
+    parser.add_argument('--prefectures', nargs='+', default=DEFAULT_PREFECTURES,
+                        help="対象の都道府県コード（デフォルト: 13）")
+    parser.add_argument('--all', action='store_true', help="全国の自治体を対象にする")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="1リクエストあたりの行数")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="同時リクエスト数")
+    parser.add_argument('--dry-run', action='store_true', help="書き込まずに差分だけ表示")
+    return parser.parse_args()
+
+
+def main():
+    """メイン処理"""
+    args = parse_args()
+    prefectures = None if args.all else [code.zfill(2) for code in args.prefectures]
+    target = '全国' if prefectures is None else ', '.join(prefectures)
+
+    supabase = get_client()
+
+    # 1. 人口データを読み込み（人口・世帯ファイル）
+    print(f"=== 人口データ読み込み（{target}） ===")
+    df_pop = load_population(prefectures)
+    print(f"人口データ: {len(df_pop)}件")
+
+    # 2. 面積データを読み込み（自然環境ファイル）
+    print("\n=== 面積データ読み込み ===")
+    df_area = load_area(prefectures)
+    print(f"面積データ: {len(df_area)}件")
+
+    # 3. 団体コードで結合して一括検証
+    print("\n=== 結合・検証 ===")
+    merged = merge_population_area(df_pop, df_area)
+    checks = validate(merged)
+    print(f"結合: {checks['rows']}件 / 団体コード重複: {checks['duplicate_codes']}件")
+    print(f"人口欠損: {checks['population_missing']}件"
+          f" / 2015年国勢調査で代替: {checks['population_fallback_2015']}件")
+    print(f"面積データなし: {checks['area_row_missing']}件 / 面積欠損: {checks['area_nan']}件")
+
+    # 4. 既存の自治体マスターと比較して、変わる行だけをまとめてupsert
+    print("\n=== データ更新中 ===")
+    new_values = build_new_values(merged)
+    current_rows = fetch_municipalities(supabase, prefectures)
+    existing = {row['city_code'] for row in current_rows}
+    not_found = sorted(set(new_values) - existing)
+    for city_code in not_found:
+        print(f"  ⚠️  municipalitiesテーブルに {city_code} が見つかりません")
+
+    changed = diff_rows(current_rows, new_values)
+    print_diff(changed)
+
+    updated_count = 0
+    if not args.dry_run:
+        updated_count = upsert_batches(supabase, 'municipalities', [row for row, _ in changed],
+                                       args.batch_size, args.workers)
+
+    print(f"\n=== 完了 ===")
+    print(f"変更あり: {len(changed)}件 / 変更なし: {len(new_values) - len(not_found) - len(changed)}件")
+    if args.dry_run:
+        print("ドライラン: 書き込みは行っていません")
+    else:
+        print(f"更新成功: {updated_count}件")
+    print(f"見つからない: {len(not_found)}件")
 
-    # 人口（2020年住民基本台帳人口を使用 - 列13）
-    population = df_pop_tokyo.loc[idx, 13]
-    if pd.isna(population):
-        # 2015年国勢調査人口を代替（列10）
-        population = df_pop_tokyo.loc[idx, 10]
 
-    if pd.notna(population):
-        population = int(float(population))
-    else:
-        population = None
-
-    # 面積データを探す
-    area_rows = df_area_tokyo[df_area_tokyo[12] == city_code]
-    area_km2 = None
-    if not area_rows.empty:
-        area_val = area_rows.iloc[0, 10]  # 総面積（列10）
-        if pd.notna(area_val):
-            area_km2 = float(area_val)
-
-    print(f"{city_code} {name:15s} 人口:{population:>8} 面積:{area_km2}km²")
-
-    # Supabase更新
-    try:
-        update_data = {}
-        if population is not None:
-            update_data['population'] = population
-        if area_km2 is not None:
-            update_data['area_km2'] = area_km2
-
-        if update_data:
-            result = supabase.table('municipalities')\
-                .update(update_data)\
-                .eq('city_code', city_code)\
-                .execute()
-
-            if result.data:
-                updated_count += 1
-            else:
-                not_found_count += 1
-                print(f"  ⚠️  municipalitiesテーブルに {city_code} が見つかりません")
-    except Exception as e:
-        print(f"  ❌ エラー: {e}")
-
-print(f"\n=== 完了 ===")
-print(f"更新成功: {updated_count}件")
-print(f"見つからない: {not_found_count}件")
+if __name__ == "__main__":
+    main()
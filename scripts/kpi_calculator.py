@@ -3,7 +3,12 @@ KPI計算ロジック
 content.mdの計算式を実装
 """
 import numpy as np
-from typing import Dict, List, Tuple
+from typing import Dict, List, Tuple, Union
+
+ArrayLike = Union[float, int, np.ndarray, List[float]]
+
+# 同規模グループの人口境界（5万 / 10万 / 20万 / 50万人）
+POPULATION_BAND_EDGES = (50_000, 100_000, 200_000, 500_000)
 
 
 def calc_actual_pace(base_emission: float, latest_emission: float,
@@ -191,3 +196,280 @@ def calc_emission_per_capita(total_emission: float, population: int) -> float:
     # 千t → t に変換してから人口で割る
     per_capita = (total_emission * 1000) / population
     return round(per_capita, 3)
+
+
+# ============================================================
+# バッチ版（NumPy配列で全自治体を一括計算）
+# スカラー版と同じ丸め・ゼロ/負値ガードを適用する
+# ============================================================
+
+def round_like_python(values: np.ndarray, ndigits: int) -> np.ndarray:
+    """
+    Python組み込みの round() と同じ結果になるよう配列を丸める
+
+    np.round は 10**ndigits 倍してから丸めるため、ちょうど .5 付近で
+    round() と結果が変わることがある。その付近の要素だけ round() で丸め直す。
+    """
+    values = np.asarray(values, dtype=float)
+    scale = 10.0 ** ndigits
+    scaled = values * scale
+    rounded = np.round(values, ndigits)
+
+    with np.errstate(invalid='ignore'):
+        near_tie = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6
+    for idx in np.flatnonzero(near_tie):
+        rounded.flat[idx] = round(float(values.flat[idx]), ndigits)
+    return rounded
+
+
+def calc_actual_pace_batch(base_emission: ArrayLike, latest_emission: ArrayLike,
+                           base_year: ArrayLike = 2013, latest_year: ArrayLike = 2022) -> np.ndarray:
+    """
+    実績ペースを一括計算（calc_actual_pace の配列版）
+
+    Returns:
+        年平均削減率（%/年）の配列
+    """
+    base = np.asarray(base_emission, dtype=float)
+    latest = np.asarray(latest_emission, dtype=float)
+    years = np.asarray(latest_year) - np.asarray(base_year)
+
+    valid = (base > 0) & (latest > 0) & (years > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = (1 - (latest / base) ** (1 / years)) * 100
+    return np.where(valid, round_like_python(np.where(valid, rate, 0.0), 2), 0.0)
+
+
+def calc_required_pace_batch(base_emission: ArrayLike,
+                             target_reduction_rate: ArrayLike = 0.46,
+                             base_year: ArrayLike = 2013,
+                             target_year: ArrayLike = 2030) -> np.ndarray:
+    """
+    必要ペースを一括計算（calc_required_pace の配列版）
+
+    Returns:
+        必要な年平均削減率（%/年）の配列
+    """
+    base = np.asarray(base_emission, dtype=float)
+    target_emission = base * (1 - np.asarray(target_reduction_rate, dtype=float))
+    years = np.asarray(target_year) - np.asarray(base_year)
+
+    valid = (base > 0) & (years > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = (1 - (target_emission / base) ** (1 / years)) * 100
+    return np.where(valid, round_like_python(np.where(valid, rate, 0.0), 2), 0.0)
+
+
+def calc_pace_achievement_rate_batch(actual_pace: ArrayLike, required_pace: ArrayLike) -> np.ndarray:
+    """
+    ペース達成率を一括計算（calc_pace_achievement_rate の配列版）
+
+    Returns:
+        ペース達成率（%）の配列
+    """
+    actual = np.asarray(actual_pace, dtype=float)
+    required = np.asarray(required_pace, dtype=float)
+
+    valid = required > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = actual / required * 100
+    return np.where(valid, round_like_python(np.where(valid, rate, 0.0), 1), 0.0)
+
+
+def calc_shortfall_2030_batch(base_emission: ArrayLike,
+                              actual_pace: ArrayLike,
+                              base_year: ArrayLike = 2013,
+                              target_year: ArrayLike = 2030,
+                              target_reduction_rate: ArrayLike = 0.46) -> np.ndarray:
+    """
+    2030年予測不足量を一括計算（calc_shortfall_2030 の配列版）
+
+    Returns:
+        2030年予測不足量（千t-CO₂）の配列
+    """
+    base = np.asarray(base_emission, dtype=float)
+    pace = np.asarray(actual_pace, dtype=float)
+    years = np.asarray(target_year) - np.asarray(base_year)
+
+    target = base * (1 - np.asarray(target_reduction_rate, dtype=float))
+    with np.errstate(invalid='ignore', over='ignore'):
+        forecast = base * ((1 - pace / 100) ** years)
+    shortfall = np.maximum(forecast - target, 0)
+
+    valid = base > 0
+    return np.where(valid, round_like_python(np.where(valid, shortfall, 0.0), 1), 0.0)
+
+
+def calc_reduction_rate_batch(base_emission: ArrayLike, latest_emission: ArrayLike) -> np.ndarray:
+    """
+    削減率を一括計算（calc_reduction_rate の配列版）
+
+    Returns:
+        削減率（%）の配列
+    """
+    base = np.asarray(base_emission, dtype=float)
+    latest = np.asarray(latest_emission, dtype=float)
+
+    valid = base > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = ((latest - base) / base) * 100
+    return np.where(valid, round_like_python(np.where(valid, rate, 0.0), 2), 0.0)
+
+
+def determine_status_batch(pace_achievement_rate: ArrayLike) -> np.ndarray:
+    """
+    ステータスを一括判定（determine_status の配列版）
+
+    Returns:
+        ステータス文字列の配列
+    """
+    rate = np.asarray(pace_achievement_rate, dtype=float)
+    return np.where(rate >= 100, 'on-track', np.where(rate >= 80, 'at-risk', 'off-track'))
+
+
+def calc_emission_per_capita_batch(total_emission: ArrayLike, population: ArrayLike) -> np.ndarray:
+    """
+    一人あたり排出量を一括計算（calc_emission_per_capita の配列版）
+
+    人口が欠損（NaN）の要素は NaN のまま返す。
+
+    Returns:
+        一人あたり排出量（t-CO₂/人）の配列
+    """
+    total = np.asarray(total_emission, dtype=float)
+    pop = np.asarray(population, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        per_capita = (total * 1000) / pop
+        valid = pop > 0
+    rounded = round_like_python(np.where(valid, per_capita, 0.0), 3)
+    return np.where(np.isnan(pop), np.nan, np.where(valid, rounded, 0.0))
+
+
+def calc_deviation_scores(values: ArrayLike, groups: ArrayLike = None) -> np.ndarray:
+    """
+    偏差値を一括計算（calc_deviation_score の配列版）
+
+    平均・標準偏差はグループごとに1回だけ計算し、全要素を1パスで採点する。
+
+    Args:
+        values: 対象の値の配列
+        groups: グループキーの配列（都道府県コード、人口規模帯など）。
+                省略時は全体を1グループとして扱う
+
+    Returns:
+        偏差値（平均50、標準偏差10）の配列
+    """
+    values = np.asarray(values, dtype=float)
+    if values.size == 0:
+        return np.zeros(0)
+
+    if groups is None:
+        if values.size < 2:
+            return np.full(values.shape, 50.0)
+        mean = np.mean(values)
+        std = np.std(values)
+        if std == 0:
+            return np.full(values.shape, 50.0)
+        return round_like_python(50 + 10 * (values - mean) / std, 1)
+
+    _, inverse = np.unique(np.asarray(groups), return_inverse=True)
+    inverse = inverse.reshape(-1)
+    counts = np.bincount(inverse)
+    means = np.bincount(inverse, weights=values) / counts
+    deviations = values - means[inverse]
+    stds = np.sqrt(np.bincount(inverse, weights=deviations ** 2) / counts)
+
+    std = stds[inverse]
+    valid = (counts[inverse] >= 2) & (std != 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = 50 + 10 * deviations / std
+    return np.where(valid, round_like_python(np.where(valid, scores, 50.0), 1), 50.0)
+
+
+def population_band(population: ArrayLike,
+                    edges: Tuple[int, ...] = POPULATION_BAND_EDGES) -> np.ndarray:
+    """
+    人口規模帯を判定（同規模グループの偏差値計算用）
+
+    Args:
+        population: 人口の配列
+        edges: 規模帯の境界（昇順）
+
+    Returns:
+        規模帯番号の配列（0〜len(edges)、人口欠損は-1）
+    """
+    pop = np.asarray(population, dtype=float)
+    bands = np.digitize(pop, edges)
+    return np.where(np.isnan(pop), -1, bands)
+
+
+def calc_ranks(values: ArrayLike, groups: ArrayLike = None) -> np.ndarray:
+    """
+    降順の順位を一括計算（同じ値はデータ順に別の順位）
+
+    sorted(..., reverse=True) で順に番号を振った場合と同じ結果になる。
+
+    Args:
+        values: 順位付けする値の配列（大きいほど上位）
+        groups: グループキーの配列（都道府県コードなど）。省略時は全体で順位付け
+
+    Returns:
+        1始まりの順位の配列
+    """
+    values = np.asarray(values, dtype=float)
+    if values.size == 0:
+        return np.zeros(0, dtype=int)
+
+    if groups is None:
+        inverse = np.zeros(values.size, dtype=int)
+    else:
+        _, inverse = np.unique(np.asarray(groups), return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+    # グループ → 値の降順 → データ順 で並べる（lexsort は安定ソート）
+    order = np.lexsort((-values, inverse))
+    group_start = np.searchsorted(inverse[order], inverse[order], side='left')
+    ranks = np.empty(values.size, dtype=int)
+    ranks[order] = np.arange(values.size) - group_start + 1
+    return ranks
+
+
+def calc_kpis_batch(base_emission: ArrayLike, latest_emission: ArrayLike,
+                    base_year: ArrayLike = 2013, latest_year: ArrayLike = 2022,
+                    target_reduction_rate: float = 0.46, target_year: int = 2030,
+                    population: ArrayLike = None) -> Dict[str, np.ndarray]:
+    """
+    全KPIを一括計算
+
+    Args:
+        base_emission: 基準年の排出量の配列（千t-CO₂）
+        latest_emission: 最新年の排出量の配列（千t-CO₂）
+        base_year: 基準年（スカラーまたは配列）
+        latest_year: 最新年（スカラーまたは配列）
+        target_reduction_rate: 目標削減率
+        target_year: 目標年
+        population: 人口の配列（省略時は一人あたり排出量を計算しない）
+
+    Returns:
+        KPI名 -> 配列 の辞書
+    """
+    base = np.asarray(base_emission, dtype=float)
+    latest = np.asarray(latest_emission, dtype=float)
+
+    actual_pace = calc_actual_pace_batch(base, latest, base_year, latest_year)
+    required_pace = calc_required_pace_batch(base, target_reduction_rate, base_year, target_year)
+    pace_achievement_rate = calc_pace_achievement_rate_batch(actual_pace, required_pace)
+
+    kpis = {
+        'reduction_rate': calc_reduction_rate_batch(base, latest),
+        'actual_pace': actual_pace,
+        'required_pace': required_pace,
+        'pace_achievement_rate': pace_achievement_rate,
+        'shortfall_2030': calc_shortfall_2030_batch(base, actual_pace, base_year,
+                                                    target_year, target_reduction_rate),
+        'status': determine_status_batch(pace_achievement_rate)
+    }
+    if population is not None:
+        kpis['emission_per_capita'] = calc_emission_per_capita_batch(latest, population)
+    return kpis
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Supabaseの4テーブルのローカルミラー（SQLite）とオフライン再計算
+
+municipalities / emissions / municipality_kpis / prefecture_kpis を
+data/processed/supabase_mirror.sqlite に同期し、
+偏差値・一人当たり排出量・順位・都道府県KPIをミラーに対する集合クエリと
+配列計算でまとめて再計算する。Supabaseには値が変わった行の変わったカラムだけを送る。
+
+同期は前回の同期以降に updated_at が変わった行だけを取得する（初回と --full-sync は全件）。
+削除された行は、Supabaseとミラーの行数が違うときだけ主キーを全件取得して検出する。
+updated_at 列のない（create_schema.sql の 6. を実行していない）DBでは毎回全件を取得する。
+再計算に使わない emissions は、--sync-only か --tables で指定した場合だけ同期する。
+
+実行: python local_mirror.py                    # 同期 → 再計算 → 差分だけ反映
+      python local_mirror.py --offline --dry-run  # ネットワークなしで再計算のみ
+      python local_mirror.py --sync-only --tables municipalities municipality_kpis
+      python local_mirror.py --sync-only --full-sync   # 全件を取得し直す
+"""
+import argparse
+import re
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+from kpi_calculator import calc_deviation_scores, calc_emission_per_capita_batch, calc_ranks, population_band
+from prefectures import STATUS_COLUMNS, build_prefecture_kpi_rows
+from db import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_WORKERS,
+    count_rows,
+    diff_rows,
+    get_client,
+    is_missing_object_error,
+    print_diff,
+    same_value,
+    select_all,
+    update_batches,
+    upsert_batches
+)
+import metrics
+
+# 設定
+DATA_DIR = Path(__file__).parent.parent / "data"
+PROCESSED_DIR = DATA_DIR / "processed"
+MIRROR_DB = PROCESSED_DIR / "supabase_mirror.sqlite"
+
+BASE_YEAR = 2013
+LATEST_YEAR = 2022
+TARGET_REDUCTION_RATE = 0.46  # 46%削減
+
+# 差分取得に使う更新日時のカラムと、前回の同期から遡って取り直す秒数
+# （updated_at はトランザクション開始時刻のため、同期中にコミットされた長いトランザクションの行を取りこぼさない）
+UPDATED_AT = 'updated_at'
+SYNC_OVERLAP_SECONDS = 600
+
+
+class MirrorTable(NamedTuple):
+    """ミラーするテーブルの主キー・カラム・取得時の並び順"""
+    key: Tuple[str, ...]
+    columns: Tuple[str, ...]
+    order: str
+
+
+# create_schema.sql のカラム（id・created_at・updated_at はDB側で付与するため除く）
+MIRROR_TABLES: Dict[str, MirrorTable] = {
+    'municipalities': MirrorTable(
+        ('city_code',),
+        ('city_code', 'name', 'prefecture_code', 'prefecture_name', 'prefecture_slug', 'region',
+         'population', 'area_km2', 'zero_carbon_declared', 'zero_carbon_year'),
+        'city_code'
+    ),
+    'emissions': MirrorTable(
+        ('city_code', 'fiscal_year', 'sector'),
+        ('city_code', 'fiscal_year', 'sector', 'value_kt_co2'),
+        'id'
+    ),
+    'municipality_kpis': MirrorTable(
+        ('city_code',),
+        ('city_code', 'base_year', 'latest_year', 'base_emission_kt', 'latest_emission_kt',
+         'reduction_rate', 'actual_pace', 'required_pace', 'pace_achievement_rate', 'status',
+         'shortfall_2030_kt', 'emission_per_capita', 'deviation_score', 'pref_rank', 'national_rank'),
+        'city_code'
+    ),
+    'prefecture_kpis': MirrorTable(
+        ('prefecture_code',),
+        ('prefecture_code', 'prefecture_name', 'prefecture_slug', 'latest_year', 'base_emission_mt',
+         'latest_emission_mt', 'reduction_rate', 'actual_pace', 'required_pace',
+         'pace_achievement_rate', 'status', 'shortfall_2030_mt', 'municipality_count',
+         'on_track_count', 'at_risk_count', 'off_track_count', 'national_rank'),
+        'prefecture_code'
+    ),
+}
+# 再計算で読むテーブル（再計算の前に必ず同期する）
+RECOMPUTE_TABLES = ('municipalities', 'municipality_kpis', 'prefecture_kpis')
+# テーブルごとに同期済みの updated_at を記録するテーブル
+SYNC_STATE_TABLE = '_sync_state'
+
+
+def open_mirror(path: Path = MIRROR_DB) -> sqlite3.Connection:
+    """
+    ミラーのDBを開く（テーブルがなければ作成）
+
+    値はSupabaseから受け取った型のまま保存する（カラムの型は指定しない）。
+
+    Args:
+        path: SQLiteファイルのパス（':memory:' も可）
+
+    Returns:
+        SQLiteの接続
+    """
+    if str(path) != ':memory:':
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path))
+    conn.row_factory = sqlite3.Row
+    for table, spec in MIRROR_TABLES.items():
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                     f"({', '.join(spec.columns)}, PRIMARY KEY ({', '.join(spec.key)})) WITHOUT ROWID")
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {SYNC_STATE_TABLE} "
+                 f"(table_name TEXT PRIMARY KEY, synced_until TEXT)")
+    conn.commit()
+    return conn
+
+
+def read_rows(conn: sqlite3.Connection, table: str) -> List[Dict]:
+    """ミラーの全行を取得（主キー順）"""
+    spec = MIRROR_TABLES[table]
+    cursor = conn.execute(f"SELECT {', '.join(spec.columns)} FROM {table} ORDER BY {', '.join(spec.key)}")
+    return [dict(row) for row in cursor]
+
+
+def write_rows(conn: sqlite3.Connection, table: str, rows: List[Dict]):
+    """行をミラーに書き込み（主キーが同じ行は置き換え、コミットは呼び出し側）"""
+    spec = MIRROR_TABLES[table]
+    placeholders = ', '.join('?' for _ in spec.columns)
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {table} ({', '.join(spec.columns)}) VALUES ({placeholders})",
+        ([row.get(column) for column in spec.columns] for row in rows)
+    )
+
+
+def delete_rows(conn: sqlite3.Connection, table: str, keys: List[Tuple]):
+    """主キーを指定してミラーから削除（コミットは呼び出し側）"""
+    spec = MIRROR_TABLES[table]
+    condition = ' AND '.join(f"{column} = ?" for column in spec.key)
+    conn.executemany(f"DELETE FROM {table} WHERE {condition}", keys)
+
+
+def read_watermark(conn: sqlite3.Connection, table: str) -> Optional[str]:
+    """前回の同期で取得した updated_at の最大値（未同期・全件取得のみのときは None）"""
+    row = conn.execute(f"SELECT synced_until FROM {SYNC_STATE_TABLE} WHERE table_name = ?",
+                       (table,)).fetchone()
+    return row[0] if row else None
+
+
+def write_watermark(conn: sqlite3.Connection, table: str, synced_until: Optional[str]):
+    """同期済みの updated_at を記録（コミットは呼び出し側）"""
+    conn.execute(f"INSERT OR REPLACE INTO {SYNC_STATE_TABLE} (table_name, synced_until) VALUES (?, ?)",
+                 (table, synced_until))
+
+
+def shift_timestamp(value: str, seconds: float) -> str:
+    """
+    PostgRESTが返したISO 8601の日時を seconds 秒ずらす
+
+    Python 3.7 の fromisoformat() が読めるように、末尾の Z と小数秒の桁数をそろえてから変換する。
+    """
+    value = value.replace('Z', '+00:00').replace(' ', 'T')
+    value = re.sub(r'\.(\d+)', lambda m: '.' + (m.group(1) + '000000')[:6], value)
+    shifted = datetime.fromisoformat(value) + timedelta(seconds=seconds)
+    return shifted.isoformat(timespec='microseconds')
+
+
+def fetch_remote(supabase, table: str, since: Optional[str],
+                 with_updated_at: bool = True) -> List[Dict]:
+    """ミラーするカラム（と updated_at）を取得（since を指定するとそれ以降に更新された行だけ）"""
+    spec = MIRROR_TABLES[table]
+    columns = spec.columns + ((UPDATED_AT,) if with_updated_at else ())
+    filters = [(UPDATED_AT, 'gte', since)] if since else []
+    return select_all(supabase, table, ','.join(columns), order=spec.order, filters=filters)
+
+
+def sync_table(conn: sqlite3.Connection, supabase, table: str, full: bool = False) -> Dict[str, int]:
+    """
+    1テーブルをSupabaseからミラーへ同期（前回の同期以降に更新された行だけ取得）
+
+    前回の同期で記録した updated_at の最大値（から SYNC_OVERLAP_SECONDS 秒前）以降の行を取得し、
+    主キーごとに比較して追加・変更された行だけをミラーに書き込む。
+    削除は updated_at では分からないため、行数がSupabaseと違うときだけ
+    主キーを全件取得して、Supabaseにない行をミラーから削除する。
+    初回・full 指定時・updated_at 列のないDBでは全件を取得する。
+
+    Args:
+        conn: ミラーの接続
+        supabase: Supabaseクライアント
+        table: テーブル名
+        full: 前回の同期に関係なく全件を取得する
+
+    Returns:
+        {'rows': 取得行数, 'changed': 追加・変更行数, 'deleted': 削除行数, 'full': 全件取得したか}
+    """
+    spec = MIRROR_TABLES[table]
+    watermark = None if full else read_watermark(conn, table)
+    since = shift_timestamp(watermark, -SYNC_OVERLAP_SECONDS) if watermark else None
+    has_updated_at = True
+    try:
+        remote = fetch_remote(supabase, table, since)
+    except Exception as error:
+        if not is_missing_object_error(error):
+            raise
+        print(f"  [INFO] {table} に {UPDATED_AT} 列がないため全件を取得します"
+              f"（create_schema.sql を実行すると差分だけ取得します）")
+        remote = fetch_remote(supabase, table, None, with_updated_at=False)
+        since = None
+        has_updated_at = False
+    local = {tuple(row[column] for column in spec.key): row for row in read_rows(conn, table)}
+
+    changed = []
+    for row in remote:
+        current = local.pop(tuple(row[column] for column in spec.key), None)
+        if current is None or not all(same_value(current[column], row.get(column))
+                                      for column in spec.columns):
+            changed.append(row)
+    write_rows(conn, table, changed)
+
+    if since is None:
+        # 全件取得: 取得しなかった行はSupabaseで削除されている
+        deleted = list(local)
+    elif len(local) + len(remote) != count_rows(supabase, table, spec.key[0]):
+        # 差分取得: 行数が合わないときだけ主キーを全件取得して削除された行を探す
+        keys = select_all(supabase, table, ','.join(spec.key), order=spec.order)
+        remaining = {tuple(row[column] for column in spec.key) for row in keys}
+        deleted = [key for key in local if key not in remaining]
+    else:
+        deleted = []
+    delete_rows(conn, table, deleted)
+
+    if has_updated_at:
+        write_watermark(conn, table, max((row[UPDATED_AT] for row in remote if row[UPDATED_AT]),
+                                         default=watermark))
+    conn.commit()
+    return {'rows': len(remote), 'changed': len(changed), 'deleted': len(deleted), 'full': since is None}
+
+
+def sync(conn: sqlite3.Connection, supabase, tables: Sequence[str] = tuple(MIRROR_TABLES),
+         full: bool = False):
+    """指定したテーブルをミラーへ同期して件数を表示"""
+    for table in tables:
+        with metrics.span(f"sync:{table}") as span:
+            counts = sync_table(conn, supabase, table, full)
+            span['rows'] = counts['rows']
+        mode = '全件' if counts['full'] else '差分'
+        print(f"同期 {table}（{mode}）: {counts['rows']:,}行"
+              f"（追加・変更 {counts['changed']:,} / 削除 {counts['deleted']:,}）")
+
+
+def query_columns(conn: sqlite3.Connection, sql: str) -> Dict[str, np.ndarray]:
+    """クエリ結果を カラム名 -> 配列 の辞書で取得"""
+    cursor = conn.execute(sql)
+    names = [description[0] for description in cursor.description]
+    rows = cursor.fetchall()
+    return {name: np.array([row[i] for row in rows], dtype=object) for i, name in enumerate(names)}
+
+
+def fetch_prefecture_aggregates(conn: sqlite3.Connection) -> Dict[str, np.ndarray]:
+    """
+    都道府県ごとの排出量合計・自治体数・ステータス件数をミラーで集計
+
+    queries.fetch_prefecture_aggregates() と同じ形式（都道府県コード順）で返す。
+    """
+    status_counts = ', '.join(f"SUM(status = '{status}') AS {column}"
+                              for status, column in STATUS_COLUMNS.items())
+    aggregates = query_columns(conn, f"""
+        SELECT substr(city_code, 1, 2) AS prefecture_code,
+               COUNT(*) AS municipality_count,
+               SUM(base_emission_kt) AS base_emission_kt,
+               SUM(latest_emission_kt) AS latest_emission_kt,
+               {status_counts}
+        FROM municipality_kpis
+        GROUP BY 1
+        ORDER BY 1
+    """)
+    for column, values in aggregates.items():
+        if column != 'prefecture_code':
+            aggregates[column] = values.astype(float if column.endswith('_kt') else int)
+    return aggregates
+
+
+def recompute(conn: sqlite3.Connection, group_by: str = 'none') -> Dict[str, Dict[str, Dict]]:
+    """
+    偏差値・一人当たり排出量・順位・都道府県KPIをミラーの値からまとめて再計算
+
+    自治体KPIと人口はJOINした1回のクエリで取得し、計算は kpi_calculator の
+    配列版（recalc_*.py・seed_supabase.py と同じ丸め）で全自治体を一括で行う。
+
+    Args:
+        conn: ミラーの接続
+        group_by: 偏差値の比較グループ（none / prefecture / population）
+
+    Returns:
+        テーブル名 -> {主キー: 新しい値}
+    """
+    kpis = query_columns(conn, """
+        SELECT k.city_code, k.reduction_rate, k.latest_emission_kt, k.pace_achievement_rate,
+               m.population
+        FROM municipality_kpis k
+        LEFT JOIN municipalities m ON m.city_code = k.city_code
+        ORDER BY k.city_code
+    """)
+    city_codes = kpis['city_code'].tolist()
+    prefectures = [code[:2] for code in city_codes]
+    population = np.array([value or np.nan for value in kpis['population']], dtype=float)
+    reduction_rates = np.abs(kpis['reduction_rate'].astype(float))
+    pace = kpis['pace_achievement_rate'].astype(float)
+
+    groups = None
+    if group_by == 'prefecture':
+        groups = prefectures
+    elif group_by == 'population':
+        groups = population_band(population)
+    deviation_scores = calc_deviation_scores(reduction_rates, groups).tolist()
+    emission_per_capita = calc_emission_per_capita_batch(
+        kpis['latest_emission_kt'].astype(float), population).tolist()
+    pref_ranks = calc_ranks(pace, prefectures).tolist()
+    national_ranks = calc_ranks(pace).tolist()
+
+    municipality_kpis = {}
+    for i, city_code in enumerate(city_codes):
+        values = {
+            'deviation_score': deviation_scores[i],
+            'pref_rank': pref_ranks[i],
+            'national_rank': national_ranks[i]
+        }
+        # 人口データのない自治体は一人当たり排出量を変更しない
+        if not np.isnan(population[i]):
+            values['emission_per_capita'] = emission_per_capita[i]
+        municipality_kpis[city_code] = values
+
+    pref_rows = build_prefecture_kpi_rows(fetch_prefecture_aggregates(conn), BASE_YEAR, LATEST_YEAR,
+                                          TARGET_REDUCTION_RATE)
+    return {
+        'municipality_kpis': municipality_kpis,
+        'prefecture_kpis': {row['prefecture_code']: row for row in pref_rows}
+    }
+
+
+def diff_table(conn: sqlite3.Connection, table: str,
+               new_values: Dict[str, Dict]) -> List[Tuple[Dict, Dict]]:
+    """
+    ミラーの現在値と比べて値が変わる行を抽出（ミラーにない行は追加として扱う）
+
+    Returns:
+        (新しい値を反映した行, {カラム: (旧値, 新値)}) のリスト
+    """
+    key = MIRROR_TABLES[table].key[0]
+    rows = read_rows(conn, table)
+    changed = diff_rows(rows, new_values, key)
+    existing = {row[key] for row in rows}
+    for code, values in new_values.items():
+        if code not in existing:
+            changed.append((values, {column: (None, value) for column, value in values.items()}))
+    return changed
+
+
+def push_changes(conn: sqlite3.Connection, supabase, table: str, changed: List[Tuple[Dict, Dict]],
+                 batch_size: int = DEFAULT_BATCH_SIZE, workers: int = DEFAULT_WORKERS) -> int:
+    """
+    変更をSupabaseへ送信し、成功したらミラーにも反映
+
+    ミラーにある行は値が変わったカラムだけを update_batches() で batch_size 行ずつまとめて
+    更新する（ミラーの他のカラムが古くても、Supabase側の値を上書きしない）。
+    ミラーにない行（新しい都道府県KPIなど）は再計算した行をそのままupsertする。
+
+    Args:
+        conn: ミラーの接続
+        supabase: Supabaseクライアント
+        table: テーブル名
+        changed: diff_table() の結果
+
+    Returns:
+        送信した行数
+    """
+    if not changed:
+        return 0
+    key = MIRROR_TABLES[table].key[0]
+    existing = {row[0] for row in conn.execute(f"SELECT {key} FROM {table}")}
+    updates = {
+        row[key]: {column: new for column, (_, new) in changes.items()}
+        for row, changes in changed if row[key] in existing
+    }
+    inserts = [row for row, _ in changed if row[key] not in existing]
+    with metrics.span(f"push:{table}", rows=len(changed)):
+        sent = update_batches(supabase, table, updates, key, batch_size, workers)
+        sent += upsert_batches(supabase, table, inserts, batch_size, workers)
+    write_rows(conn, table, [row for row, _ in changed])
+    conn.commit()
+    return sent
+
+
+def parse_args() -> argparse.Namespace:
+    """コマンドライン引数を解析"""
+    parser = argparse.ArgumentParser(description="Supabaseのローカルミラーとオフライン再計算")
+    parser.add_argument('--mirror', type=Path, default=MIRROR_DB, help="ミラーのSQLiteファイル")
+    parser.add_argument('--tables', nargs='+', choices=list(MIRROR_TABLES),
+                        help="同期するテーブル（既定: --sync-only では全テーブル、"
+                             "それ以外は再計算に使う municipalities / municipality_kpis / prefecture_kpis）")
+    parser.add_argument('--offline', action='store_true', help="同期せずにミラーの現在値で再計算")
+    parser.add_argument('--sync-only', action='store_true', help="同期だけ行い再計算しない")
+    parser.add_argument('--full-sync', action='store_true',
+                        help="前回の同期以降の差分ではなく全件を取得する")
+    parser.add_argument('--group-by', choices=['none', 'prefecture', 'population'], default='none',
+                        help="偏差値の比較グループ（none: 全体 / prefecture: 都道府県 / population: 人口規模帯）")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="1リクエストあたりの行数")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="同時リクエスト数")
+    parser.add_argument('--dry-run', action='store_true', help="Supabaseにもミラーにも書き込まずに差分だけ表示")
+    metrics.add_metrics_args(parser)
+    args = parser.parse_args()
+
+    if args.tables is None:
+        args.tables = list(MIRROR_TABLES) if args.sync_only else list(RECOMPUTE_TABLES)
+    elif not args.offline and not args.sync_only:
+        # 同期していないテーブルの古い値で再計算しないようにする
+        missing = [table for table in RECOMPUTE_TABLES if table not in args.tables]
+        if missing:
+            parser.error(f"再計算には {', '.join(missing)} の同期が必要です"
+                         f"（同期だけ行う場合は --sync-only、ミラーの値で再計算する場合は --offline）")
+    return args
+
+
+def main():
+    """メイン処理"""
+    args = parse_args()
+    metrics.start_run('local_mirror', args)
+    conn = open_mirror(args.mirror)
+
+    # オフラインのドライランではSupabaseに接続しない
+    supabase = None if args.offline and args.dry_run else get_client()
+
+    if not args.offline:
+        print("=== ミラーを同期 ===")
+        sync(conn, supabase, args.tables, args.full_sync)
+    if args.sync_only:
+        return
+
+    print("\n=== 再計算 ===")
+    started = time.perf_counter()
+    with metrics.span('recompute') as span:
+        new_values = recompute(conn, args.group_by)
+        changes = {table: diff_table(conn, table, values) for table, values in new_values.items()}
+        span['rows'] = len(new_values['municipality_kpis'])
+    elapsed = time.perf_counter() - started
+    print(f"対象: {len(new_values['municipality_kpis']):,}自治体 / "
+          f"{len(new_values['prefecture_kpis'])}都道府県（{elapsed * 1000:.0f}ms）")
+
+    for table, changed in changes.items():
+        print(f"\n--- {table}: 変更あり {len(changed)}件 ---")
+        print_diff(changed, MIRROR_TABLES[table].key[0])
+        if not args.dry_run:
+            sent = push_changes(conn, supabase, table, changed, args.batch_size, args.workers)
+            print(f"更新: {sent}件")
+    if args.dry_run:
+        print("\nドライラン: 書き込みは行っていません")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        metrics.finish()
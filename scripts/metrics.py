@@ -0,0 +1,244 @@
+"""
+処理時間・件数の計測とメトリクス出力
+
+段階（stage）・ファイル（file）・バッチ（batch）ごとに所要時間・行数・バイト数・
+リトライ回数を記録し、data/processed/metrics.jsonl に1スパン1行で追記する。
+finish() を呼ぶと段階・種類ごとの集計表を表示する（スクリプトの最後に try/finally で呼ぶ）。
+
+    metrics.start_run('seed_supabase', args)   # add_metrics_args() を追加した引数
+    try:
+        with metrics.span('emissions') as s:
+            ...
+            s['rows'] = len(rows)
+        metrics.record('upsert:emissions', latency, kind='batch', rows=1000)
+    finally:
+        metrics.finish()
+
+start_run() を呼んでいない場合（ライブラリとして使う場合）、記録は何もしない。
+"""
+import argparse
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+# 設定
+DATA_DIR = Path(__file__).parent.parent / "data"
+PROCESSED_DIR = DATA_DIR / "processed"
+METRICS_JSONL = PROCESSED_DIR / "metrics.jsonl"
+PROFILE_DIR = PROCESSED_DIR / "profiles"
+
+# 集計表で合計するスパンの属性
+SUMMED_ATTRS = ('rows', 'bytes', 'retries')
+
+
+def percentile(values: List[float], p: float) -> float:
+    """パーセンタイル（最近傍法）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """このプロセスのピークRSS（MB、取得できない環境ではNone）"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS は bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class MetricsRun:
+    """1回の実行のスパンを記録し、JSONLへの追記・集計表の表示を行う"""
+
+    def __init__(self, script: str, output_path: Optional[Path] = METRICS_JSONL,
+                 profile: bool = False, trace_memory: bool = False):
+        self.script = script
+        self.run_id = f"{script}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.output_path = output_path
+        self.spans: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.finished = False
+        self.file = None
+        if output_path:
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(output_path, 'a', encoding='utf-8')
+
+        self.profiler = None
+        if profile:
+            # cProfile はメインスレッドだけを計測する
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        if trace_memory:
+            tracemalloc.start()
+
+    def record(self, name: str, duration: float, kind: str = 'stage', **attrs):
+        """計測済みのスパンを1件記録"""
+        span = {
+            'run_id': self.run_id,
+            'script': self.script,
+            'kind': kind,
+            'name': name,
+            'ts': time.time() - duration,
+            'duration': round(duration, 6),
+            'status': 'ok',
+            **attrs
+        }
+        with self.lock:
+            self.spans.append(span)
+            if self.file:
+                self.file.write(json.dumps(span, ensure_ascii=False, default=str) + '\n')
+                self.file.flush()
+
+    def summary_rows(self) -> List[Dict[str, Any]]:
+        """(種類, 名前) ごとの集計（記録順）"""
+        groups: Dict[tuple, List[Dict]] = {}
+        for span in self.spans:
+            groups.setdefault((span['kind'], span['name']), []).append(span)
+        rows = []
+        for (kind, name), spans in groups.items():
+            durations = [span['duration'] for span in spans]
+            row = {
+                'kind': kind,
+                'name': name,
+                'count': len(spans),
+                'total': sum(durations),
+                'p95': percentile(durations, 95),
+                'max': max(durations),
+                'errors': sum(1 for span in spans if span['status'] != 'ok')
+            }
+            for attr in SUMMED_ATTRS:
+                row[attr] = sum(span.get(attr) or 0 for span in spans)
+            rows.append(row)
+        return rows
+
+    def print_summary(self):
+        """集計表を表示"""
+        elapsed = time.perf_counter() - self.started
+        peak = peak_rss_mb()
+        print("\n" + "-" * 60)
+        print(f"メトリクス: {self.run_id}（全体 {elapsed:.2f}s"
+              f"{f'、ピークRSS {peak:.0f}MB' if peak is not None else ''}）")
+        rows = self.summary_rows()
+        if rows:
+            print(f"{'種類':<6}{'名前':<28}{'回数':>6}{'合計':>10}{'p95':>9}{'最大':>9}"
+                  f"{'行数':>10}{'KB':>9}{'再送':>5}{'失敗':>5}")
+            for row in rows:
+                print(f"{row['kind']:<6}{row['name'][:28]:<28}{row['count']:>6}"
+                      f"{row['total']:>9.2f}s{row['p95']:>8.3f}s{row['max']:>8.3f}s"
+                      f"{row['rows']:>10,}{row['bytes'] / 1024:>9,.0f}{row['retries']:>5}{row['errors']:>5}")
+        if self.output_path:
+            print(f"出力: {self.output_path}")
+
+    def finish(self):
+        """プロファイル・メモリ計測を止めて結果を出力（2回目以降は何もしない）"""
+        if self.finished:
+            return
+        self.finished = True
+        self.print_summary()
+
+        if self.profiler:
+            self.profiler.disable()
+            PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+            profile_path = PROFILE_DIR / f"{self.run_id}.prof"
+            self.profiler.dump_stats(str(profile_path))
+            stream = io.StringIO()
+            pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(15)
+            print(f"\nプロファイル（累積時間の上位）: {profile_path}")
+            print(stream.getvalue().strip())
+
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+            tracemalloc.stop()
+            print(f"\nメモリ: 現在 {current / 1024 / 1024:.1f}MB / ピーク {peak / 1024 / 1024:.1f}MB")
+            for stat in top:
+                print(f"  {stat}")
+
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+_active: Optional[MetricsRun] = None
+
+
+def add_metrics_args(parser: argparse.ArgumentParser):
+    """計測用のコマンドライン引数を追加"""
+    parser.add_argument('--metrics', type=Path, default=METRICS_JSONL,
+                        help=f"メトリクスの追記先（JSON Lines、デフォルト {METRICS_JSONL.name}）")
+    parser.add_argument('--no-metrics', action='store_true', help="メトリクスをファイルに書かない")
+    parser.add_argument('--profile', action='store_true',
+                        help="cProfile で計測して data/processed/profiles/ に保存")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="tracemalloc でメモリ使用量のピークと確保箇所の上位を表示")
+
+
+def start_run(script: str, args: Optional[argparse.Namespace] = None) -> MetricsRun:
+    """
+    計測を開始（集計表・プロファイルの出力は finish() で行う）
+
+    Args:
+        script: スクリプト名（run_id の接頭辞）
+        args: add_metrics_args() を追加した引数（省略時はファイル出力のみ）
+
+    Returns:
+        実行中の MetricsRun
+    """
+    global _active
+    output_path = METRICS_JSONL
+    profile = trace_memory = False
+    if args is not None:
+        output_path = None if args.no_metrics else args.metrics
+        profile = args.profile
+        trace_memory = args.trace_memory
+    _active = MetricsRun(script, output_path, profile, trace_memory)
+    return _active
+
+
+def finish():
+    """計測を終えて集計表・プロファイルを出力（計測中でなければ何もしない）"""
+    global _active
+    if _active is not None:
+        _active.finish()
+        _active = None
+
+
+def record(name: str, duration: float, kind: str = 'stage', **attrs):
+    """計測済みのスパンを記録（計測中でなければ何もしない）"""
+    if _active is not None:
+        _active.record(name, duration, kind, **attrs)
+
+
+@contextmanager
+def span(name: str, kind: str = 'stage', **attrs) -> Iterator[Dict[str, Any]]:
+    """
+    with ブロックの所要時間をスパンとして記録
+
+    ブロック内で yield された辞書に rows / bytes などを設定すると一緒に記録される。
+    例外が起きた場合は status='error' として記録し、例外はそのまま送出する。
+    """
+    values = dict(attrs)
+    started = time.perf_counter()
+    try:
+        yield values
+    except BaseException as e:
+        values['status'] = 'error'
+        values['error'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record(name, time.perf_counter() - started, kind, **values)
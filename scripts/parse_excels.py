@@ -1,12 +1,28 @@
 """
 Excelファイルをパースして排出量データを抽出
 """
+import argparse
+import hashlib
+import io
 import json
 import csv
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext, redirect_stdout
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
 import openpyxl
-from openpyxl.worksheet.worksheet import Worksheet
+from emissions_store import (
+    EMISSIONS_JSON,
+    EMISSIONS_NDJSON,
+    EMISSIONS_PARQUET,
+    NdjsonWriter,
+    write_emissions_parquet
+)
+import metrics
 
 
 # 設定
@@ -14,122 +30,572 @@ DATA_DIR = Path(__file__).parent.parent / "data"
 RAW_DIR = DATA_DIR / "raw"
 PROCESSED_DIR = DATA_DIR / "processed"
 MUNICIPALITIES_CSV = DATA_DIR / "tokyo_municipalities.csv"
+TIMINGS_CSV = PROCESSED_DIR / "parse_timings.csv"
+PARSE_CACHE_JSON = PROCESSED_DIR / "parse_cache.json"
+
+# パース処理の結果が変わる変更を入れたら上げる（キャッシュを無効化）
+PARSER_VERSION = 2
 
 # Excelシート設定
 SHEET_NAME = "データシート1"
 HEADER_ROW = 8  # 8行目がヘッダー
 DATA_START_ROW = 9  # 9行目からデータ
 
-# 列インデックス（1ベース）
+# 既定の列インデックス（1ベース、見出しで列が特定できない場合に使う）
 COL_YEAR = 5  # 西暦
 COL_CITY_CODE = 7  # 団体コード
 COL_CITY_NAME = 8  # 自治体名
 COL_DATA_START = 10  # データ開始列（製造業から）
 
 
-def parse_excel(file_path: Path, city_code: str, city_name: str) -> Optional[Dict]:
+# ヘッダー行の探索範囲（シート先頭からの行数）
+HEADER_SCAN_ROWS = 20
+
+# 部門名の対応表（"aa_" と "部門" を除いた見出し -> 部門名）
+SECTOR_NAMES = ['製造業', '建設業', '農林水産業', '業務その他', '家庭',
+                '旅客', '貨物', '鉄道', '船舶', '廃棄物']
+SECTOR_ALIASES: Dict[str, str] = {
+    **{name: name for name in SECTOR_NAMES},
+    # 自治体排出量カルテの見出し
+    '建設業・鉱業': '建設業',
+    '旅客自動車': '旅客',
+    '貨物自動車': '貨物',
+    '一般廃棄物': '廃棄物',
+}
+# 完全一致しない見出しはキーワードで判定する（先に書いた部門を優先）。
+# "貨物自動車" が旅客にならないよう、貨物は旅客・自動車より先に判定する
+SECTOR_KEYWORDS = [
+    ('製造業', ['製造']),
+    ('建設業', ['建設', '鉱業']),
+    ('農林水産業', ['農林', '農業']),
+    ('業務その他', ['業務']),
+    ('家庭', ['家庭']),
+    ('貨物', ['貨物']),
+    ('旅客', ['旅客', '自動車']),
+    ('鉄道', ['鉄道']),
+    ('船舶', ['船舶']),
+    ('廃棄物', ['廃棄']),
+]
+# 各部門を先読みのグループにした1つの正規表現。先頭位置で左から順に試すので
+# 文字列中の出現位置ではなく SECTOR_KEYWORDS の順に判定される
+SECTOR_PATTERN = re.compile('|'.join(
+    '((?=.*(?:{})))'.format('|'.join(map(re.escape, keywords)))
+    for _, keywords in SECTOR_KEYWORDS
+), re.S)
+
+# 部門以外の列の見出し（見つからなければ部門列からの相対位置で既定値を使う）
+# 年度は西暦の列を優先し、なければ和暦以外の「年度」の列を使う
+YEAR_HEADERS = (re.compile(r'西暦'), re.compile(r'^(?!.*(?:和暦|元号)).*年度'))
+CITY_CODE_HEADER = re.compile(r'団体コード|市区町村コード')
+CITY_NAME_HEADER = re.compile(r'自治体名|市区町村名|団体名')
+
+
+class SheetLayout(NamedTuple):
+    """シートの列配置（列番号は1ベース）"""
+    header_row: int
+    year_col: int
+    city_code_col: int
+    city_name_col: int
+    sectors: Tuple[Tuple[int, str], ...]  # (列番号, 部門名)
+
+    @property
+    def data_start_row(self) -> int:
+        return self.header_row + 1
+
+
+# (ヘッダー行番号, ヘッダー行の値) -> 検出済みの列配置。
+# 同じ様式のファイルは2件目以降で照合だけを行う
+_LAYOUT_CACHE: Dict[Tuple[int, tuple], SheetLayout] = {}
+
+
+def _strip_sector_header(header) -> str:
+    """ヘッダー文字列から接頭辞 "aa_" と "部門" を除く"""
+    return str(header).replace('aa_', '').replace('部門', '')
+
+
+def match_sector(header) -> Optional[str]:
+    """
+    ヘッダー文字列を既知の部門名に変換
+
+    部門に当たった見出しは SECTOR_ALIASES に追加するので、同じ見出しの2回目以降は
+    辞書引きだけになる。部門でない見出し（年度・備考など）は追加しない
+    （任意の文字列で辞書が増え続けないようにするため）。
+
+    Args:
+        header: ヘッダーセルの値（例: "aa_製造業"）
+
+    Returns:
+        部門名（例: "製造業"）、部門の見出しでなければNone
+    """
+    if header is None or header == '':
+        return None
+    name = _strip_sector_header(header)
+    if name in SECTOR_ALIASES:
+        return SECTOR_ALIASES[name]
+    match = SECTOR_PATTERN.match(name)
+    if not match:
+        return None
+    sector = SECTOR_KEYWORDS[match.lastindex - 1][0]
+    SECTOR_ALIASES[name] = sector
+    return sector
+
+
+def normalize_sector_name(header) -> str:
+    """
+    ヘッダー文字列を部門名に正規化
+
+    Args:
+        header: ヘッダーセルの値（例: "aa_製造業"）
+
+    Returns:
+        部門名（例: "製造業"）、既知の部門でなければ接頭辞を除いた見出し
+    """
+    return match_sector(header) or _strip_sector_header(header)
+
+
+def _find_column(header_values: tuple, *patterns) -> Optional[int]:
+    """
+    見出しが正規表現に一致する最初の列番号（1ベース）
+
+    Args:
+        header_values: ヘッダー行の値
+        *patterns: 正規表現（複数あれば先に書いたものに一致する列を優先）
+
+    Returns:
+        列番号、どの正規表現にも一致しなければNone
+    """
+    for pattern in patterns:
+        for col, value in enumerate(header_values, 1):
+            if isinstance(value, str) and pattern.search(value):
+                return col
+    return None
+
+
+def detect_layout(header_rows: List[tuple]) -> Optional[SheetLayout]:
+    """
+    シート先頭の行から列配置を検出
+
+    部門の見出しが最も多い行をヘッダー行とし、年度・団体コード・自治体名・
+    各部門の列を見出しで特定する。年度などの見出しがない場合は、
+    部門列の開始位置からの相対位置（既定の COL_* と同じ間隔）を使う。
+    検出結果はヘッダー行の値をキーにキャッシュする。
+
+    Args:
+        header_rows: 1行目からの行の値（values_only の iter_rows の結果）
+
+    Returns:
+        列配置、部門の見出しが見つからなければNone
+    """
+    for (row, signature), layout in _LAYOUT_CACHE.items():
+        if row <= len(header_rows) and header_rows[row - 1] == signature:
+            return layout
+
+    best_row, best_sectors = 0, []
+    for row, values in enumerate(header_rows, 1):
+        # 同じ部門に当たる見出しが複数あれば（小計列など）最初の列を使う
+        sectors = {}
+        for col, value in enumerate(values, 1):
+            sector = match_sector(value)
+            if sector and sector not in sectors:
+                sectors[sector] = col
+        if len(sectors) > len(best_sectors):
+            best_row, best_sectors = row, sorted((col, sector) for sector, col in sectors.items())
+    if not best_sectors:
+        return None
+
+    header_values = header_rows[best_row - 1]
+    offset = best_sectors[0][0] - COL_DATA_START
+    layout = SheetLayout(
+        header_row=best_row,
+        year_col=_find_column(header_values, *YEAR_HEADERS) or COL_YEAR + offset,
+        city_code_col=_find_column(header_values, CITY_CODE_HEADER) or COL_CITY_CODE + offset,
+        city_name_col=_find_column(header_values, CITY_NAME_HEADER) or COL_CITY_NAME + offset,
+        sectors=tuple(best_sectors)
+    )
+    _LAYOUT_CACHE[(best_row, header_values)] = layout
+    return layout
+
+
+def read_layout(ws) -> Optional[SheetLayout]:
+    """ワークシートの先頭 HEADER_SCAN_ROWS 行を読んで列配置を検出"""
+    return detect_layout(list(ws.iter_rows(min_row=1, max_row=HEADER_SCAN_ROWS, values_only=True)))
+
+
+def _build_result(city_code: str, city_name: str, years_set: set,
+                  emissions_by_sector: Dict) -> Optional[Dict]:
+    """パース結果の辞書を構築（データがなければNone）"""
+    if not years_set:
+        print(f"[ERROR] {city_code} - データが見つかりません")
+        return None
+
+    years = sorted(list(years_set))
+
+    return {
+        "city_code": city_code,
+        "city_name": city_name,
+        "years": years,
+        "emissions": emissions_by_sector
+    }
+
+
+def _city_code_key(value) -> str:
+    """団体コードのセル値を文字列に（数値セルは5桁にゼロ埋め）"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, int):
+        return str(value).zfill(5)
+    return str(value).strip()
+
+
+def _read_city_rows(file_path: Path, city_names: Optional[Dict[str, str]],
+                    only_listed: bool, label: str) -> Optional[Dict[str, Dict]]:
     """
-    Excelファイルをパースして排出量データを抽出
+    ワークブックを1回走査し、団体コードごとに行を振り分けてパース
 
     Args:
         file_path: Excelファイルパス
-        city_code: 団体コード
-        city_name: 自治体名
+        city_names: 団体コード -> 自治体名（シートの自治体名より優先）
+        only_listed: Trueなら city_names にある団体コードの行だけを処理
+        label: エラーメッセージに付ける名前
 
     Returns:
-        パース結果の辞書、エラー時はNone
+        団体コード -> パース結果（シートに現れた順）、エラー時はNone
     """
+    city_names = city_names or {}
     try:
-        wb = openpyxl.load_workbook(file_path, data_only=True)
+        wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    except Exception as e:
+        print(f"[ERROR] {label} - パース失敗: {e}")
+        return None
 
+    try:
         if SHEET_NAME not in wb.sheetnames:
-            print(f"[ERROR] {city_code} - シート '{SHEET_NAME}' が見つかりません")
+            print(f"[ERROR] {label} - シート '{SHEET_NAME}' が見つかりません")
             return None
 
-        ws: Worksheet = wb[SHEET_NAME]
+        ws = wb[SHEET_NAME]
+        layout = read_layout(ws)
+        if layout is None:
+            print(f"[ERROR] {label} - 部門のヘッダー行が見つかりません")
+            return None
 
-        # ヘッダー行から部門名を取得
-        # Column 10-19のみ（排出量データ）を読み取る
-        sectors = {}
-        for col in range(COL_DATA_START, COL_DATA_START + 10):  # 10-19列目のみ
-            header = ws.cell(HEADER_ROW, col).value
-            if header:
-                # "aa_製造業" -> "製造業" のように変換
-                sector_name = str(header).replace('aa_', '').replace('部門', '')
-                # 簡易的な部門名マッピング
-                if '製造' in sector_name:
-                    sector_name = '製造業'
-                elif '建設' in sector_name or '鉱業' in sector_name:
-                    sector_name = '建設業'
-                elif '農林' in sector_name or '農業' in sector_name:
-                    sector_name = '農林水産業'
-                elif '業務' in sector_name:
-                    sector_name = '業務その他'
-                elif '家庭' in sector_name:
-                    sector_name = '家庭'
-                elif '旅客' in sector_name or '自動車' in sector_name:
-                    sector_name = '旅客'
-                elif '貨物' in sector_name:
-                    sector_name = '貨物'
-                elif '鉄道' in sector_name:
-                    sector_name = '鉄道'
-                elif '船舶' in sector_name:
-                    sector_name = '船舶'
-                elif '廃棄' in sector_name:
-                    sector_name = '廃棄物'
-                sectors[col] = sector_name
-
-        # データ行を走査
-        emissions_by_sector = {}
-        years_set = set()
-
-        for row in range(DATA_START_ROW, ws.max_row + 1):
-            # 団体コードが一致する行のみ処理
-            row_city_code = ws.cell(row, COL_CITY_CODE).value
-            if row_city_code and str(row_city_code) == str(city_code):
-                year_val = ws.cell(row, COL_YEAR).value
-                if year_val:
+        # 必要な列の範囲だけを読み、行タプル内の位置に変換
+        first_col = min(layout.year_col, layout.city_code_col, layout.city_name_col,
+                        layout.sectors[0][0])
+        last_col = max(layout.year_col, layout.city_code_col, layout.city_name_col,
+                       layout.sectors[-1][0])
+        year_idx = layout.year_col - first_col
+        code_idx = layout.city_code_col - first_col
+        name_idx = layout.city_name_col - first_col
+        sector_idx = [(col - first_col, name) for col, name in layout.sectors]
+
+        # 団体コード -> (年度の集合, 部門 -> {年度: 排出量}, シート上の自治体名)
+        cities: Dict[str, Tuple[set, Dict, str]] = {}
+
+        for values in ws.iter_rows(min_row=layout.data_start_row,
+                                   min_col=first_col, max_col=last_col,
+                                   values_only=True):
+            if len(values) <= max(code_idx, year_idx):
+                continue
+            row_city_code = values[code_idx]
+            if not row_city_code:
+                continue
+            city_code = _city_code_key(row_city_code)
+            if only_listed and city_code not in city_names:
+                continue
+            year_val = values[year_idx]
+            if not year_val:
+                continue
+            try:
+                year = int(year_val)
+            except (ValueError, TypeError):
+                continue
+
+            if city_code not in cities:
+                sheet_name = values[name_idx] if name_idx < len(values) else None
+                cities[city_code] = (set(), {}, str(sheet_name).strip() if sheet_name else '')
+            years_set, emissions_by_sector, _ = cities[city_code]
+            years_set.add(year)
+
+            # 各部門のデータを取得
+            for idx, sector_name in sector_idx:
+                if idx >= len(values):
+                    continue
+                value = values[idx]
+                if value is not None:
                     try:
-                        year = int(year_val)
-                        years_set.add(year)
-
-                        # 各部門のデータを取得
-                        for col, sector_name in sectors.items():
-                            value = ws.cell(row, col).value
-                            if value is not None:
-                                try:
-                                    emission_value = float(value)
-                                    if sector_name not in emissions_by_sector:
-                                        emissions_by_sector[sector_name] = {}
-                                    emissions_by_sector[sector_name][year] = emission_value
-                                except (ValueError, TypeError):
-                                    pass
+                        emission_value = float(value)
+                        if sector_name not in emissions_by_sector:
+                            emissions_by_sector[sector_name] = {}
+                        emissions_by_sector[sector_name][year] = emission_value
                     except (ValueError, TypeError):
                         pass
 
-        if not years_set:
-            print(f"[ERROR] {city_code} - データが見つかりません")
-            return None
+        return {
+            city_code: _build_result(city_code, city_names.get(city_code, sheet_name),
+                                     years_set, emissions_by_sector)
+            for city_code, (years_set, emissions_by_sector, sheet_name) in cities.items()
+        }
 
-        years = sorted(list(years_set))
+    except Exception as e:
+        print(f"[ERROR] {label} - パース失敗: {e}")
+        return None
 
-        # 結果を構築
-        result = {
-            "city_code": city_code,
-            "city_name": city_name,
-            "years": years,
-            "emissions": emissions_by_sector
-        }
+    finally:
+        wb.close()
 
-        return result
 
-    except Exception as e:
-        print(f"[ERROR] {city_code} - パース失敗: {e}")
+def parse_workbook(file_path: Path, city_names: Optional[Dict[str, str]] = None) -> Optional[Dict[str, Dict]]:
+    """
+    複数自治体を含むExcel（都道府県・全国シート）を1回の走査でパース
+
+    読み取り専用モードで開き、ヘッダー行から検出した列配置（read_layout()）の
+    必要な列だけを iter_rows で1回走査して、行を団体コードごとに振り分ける。
+
+    Args:
+        file_path: Excelファイルパス
+        city_names: 団体コード -> 自治体名（省略時・未登録はシートの自治体名）
+
+    Returns:
+        団体コード -> パース結果の辞書（シートに現れた順）、エラー時はNone
+    """
+    return _read_city_rows(file_path, city_names, False, file_path.name)
+
+
+def parse_excel(file_path: Path, city_code: str, city_name: str) -> Optional[Dict]:
+    """
+    Excelファイルから1自治体の排出量データを抽出
+
+    parse_workbook() と同じ1回の走査で、指定した団体コードの行だけを処理する。
+
+    Args:
+        file_path: Excelファイルパス
+        city_code: 団体コード
+        city_name: 自治体名
+
+    Returns:
+        パース結果の辞書、エラー時はNone
+    """
+    results = _read_city_rows(file_path, {city_code: city_name}, True, city_code)
+    if results is None:
+        return None
+    if city_code not in results:
+        return _build_result(city_code, city_name, set(), {})
+    return results[city_code]
+
+
+def _parse_task(task: Tuple[str, str, str]) -> Tuple[Optional[Dict], float, str]:
+    """
+    ワーカープロセスで1ファイルをパースし、結果と所要時間を返す
+
+    parse_excel() が表示するエラーメッセージは、並列実行でも進捗の行に
+    続けて表示できるように返り値で受け取る。
+
+    Args:
+        task: (Excelファイルパス, 団体コード, 自治体名)
+
+    Returns:
+        (パース結果, 所要秒数, パース中に表示されたメッセージ)
+    """
+    file_path, city_code, city_name = task
+    output = io.StringIO()
+    started = time.perf_counter()
+    with redirect_stdout(output):
+        result = parse_excel(Path(file_path), city_code, city_name)
+    return result, time.perf_counter() - started, output.getvalue().strip()
+
+
+def iter_parse_results(tasks: List[Tuple[str, str, str]],
+                       workers: int = 1) -> Iterator[Tuple[Optional[Dict], float, str]]:
+    """
+    パース結果を入力順にストリームで返す
+
+    Args:
+        tasks: (Excelファイルパス, 団体コード, 自治体名) のリスト
+        workers: プロセス数（1以下なら直列実行）
+
+    Yields:
+        (パース結果, 所要秒数, パース中に表示されたメッセージ)
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield _parse_task(task)
+        return
+
+    # map() は投入順に結果を返すので出力順は直列実行と同じになる
+    chunksize = max(1, len(tasks) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for item in executor.map(_parse_task, tasks, chunksize=chunksize):
+            yield item
+
+
+def save_timings(timings: List[Dict], output_path: Path = TIMINGS_CSV):
+    """ファイルごとのパース時間をCSVに保存"""
+    with open(output_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['city_code', 'city_name', 'status', 'seconds'])
+        writer.writeheader()
+        for timing in timings:
+            writer.writerow({**timing, 'seconds': f"{timing['seconds']:.4f}"})
+
+
+def file_sha256(file_path: Path) -> str:
+    """ファイル内容のSHA-256を計算"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_parse_cache(cache_path: Path = PARSE_CACHE_JSON) -> Dict[str, Dict]:
+    """
+    パースキャッシュを読み込み
+
+    Returns:
+        団体コード -> キャッシュエントリ の辞書（壊れている場合は空）
+    """
+    if not cache_path.exists():
+        return {}
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def save_parse_cache(cache: Dict[str, Dict], cache_path: Path = PARSE_CACHE_JSON):
+    """パースキャッシュを一時ファイル経由で書き出し"""
+    tmp_path = cache_path.with_suffix('.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
+
+
+def lookup_parse_cache(cache: Dict[str, Dict], file_path: Path, city_code: str) -> Optional[Dict]:
+    """
+    キャッシュ済みのパース結果を取得
+
+    サイズ・mtimeが一致すればハッシュ計算を省略し、
+    mtimeだけ変わった場合（再ダウンロード等）は内容ハッシュで照合する。
+
+    Args:
+        cache: load_parse_cache() の戻り値
+        file_path: Excelファイルパス
+        city_code: 団体コード
+
+    Returns:
+        パース結果の辞書、キャッシュミス時はNone
+    """
+    entry = cache.get(city_code)
+    if not entry or entry.get('parser_version') != PARSER_VERSION:
         return None
 
+    stat = file_path.stat()
+    if entry['size'] != stat.st_size:
+        return None
+    if entry['mtime_ns'] != stat.st_mtime_ns:
+        if entry['sha256'] != file_sha256(file_path):
+            return None
+        entry['mtime_ns'] = stat.st_mtime_ns
+
+    # JSONでは年度キーが文字列になるので int に戻す
+    result = dict(entry['result'])
+    result['emissions'] = {
+        sector: {int(year): value for year, value in yearly.items()}
+        for sector, yearly in result['emissions'].items()
+    }
+    return result
+
+
+def store_parse_cache(cache: Dict[str, Dict], file_path: Path, city_code: str, result: Dict):
+    """パース結果をキャッシュに登録"""
+    stat = file_path.stat()
+    cache[city_code] = {
+        'parser_version': PARSER_VERSION,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_sha256(file_path),
+        'result': result
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    """コマンドライン引数を解析"""
+    parser = argparse.ArgumentParser(description="排出量カルテExcelをパースしてJSONに変換")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="並列パースのプロセス数（デフォルト1 = 直列）")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="パースキャッシュを読み書きしない")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="キャッシュを無視して全ファイルを再パースし、キャッシュを作り直す")
+    parser.add_argument('--format', choices=['json', 'parquet', 'both', 'ndjson'], default='json',
+                        help="出力形式（parquet は縦持ち列指向、pyarrow が必要。"
+                             "ndjson は1自治体1行で逐次書き出し、全件をメモリに持たない）")
+    parser.add_argument('--workbook', type=Path,
+                        help="複数自治体を含むExcel（都道府県・全国シート）を1回でパースし、含まれる全自治体を出力")
+    metrics.add_metrics_args(parser)
+    return parser.parse_args()
+
+
+def write_outputs(all_data: List[Dict], output_format: str) -> List[Path]:
+    """パース結果をJSON / Parquet / NDJSONで保存し、出力したパスを返す"""
+    output_paths = []
+    if output_format == 'ndjson':
+        with metrics.span('write_ndjson', rows=len(all_data)) as span:
+            with NdjsonWriter(EMISSIONS_NDJSON) as writer:
+                for result in all_data:
+                    writer.write(result)
+            span['bytes'] = EMISSIONS_NDJSON.stat().st_size
+        output_paths.append(EMISSIONS_NDJSON)
+    if output_format in ('json', 'both'):
+        with metrics.span('write_json', rows=len(all_data)) as span:
+            with open(EMISSIONS_JSON, 'w', encoding='utf-8') as f:
+                json.dump(all_data, f, ensure_ascii=False, indent=2)
+            span['bytes'] = EMISSIONS_JSON.stat().st_size
+        output_paths.append(EMISSIONS_JSON)
+    if output_format in ('parquet', 'both'):
+        with metrics.span('write_parquet', rows=len(all_data)) as span:
+            write_emissions_parquet(all_data, EMISSIONS_PARQUET)
+            span['bytes'] = EMISSIONS_PARQUET.stat().st_size
+        output_paths.append(EMISSIONS_PARQUET)
+    return output_paths
+
+
+def parse_shared_workbook(workbook: Path, city_names: Dict[str, str], output_format: str):
+    """
+    複数自治体を含むExcelを1回の走査でパースして保存
+
+    Args:
+        workbook: Excelファイルパス
+        city_names: 団体コード -> 自治体名（CSVにない自治体はシートの自治体名）
+        output_format: 出力形式（json / parquet / both）
+    """
+    print(f"{workbook.name} をパース開始（全自治体を1回で走査）")
+    print("-" * 60)
+    started = time.perf_counter()
+    with metrics.span('parse_workbook', bytes=workbook.stat().st_size) as span:
+        results = parse_workbook(workbook, city_names)
+        span['rows'] = len(results or {})
+    if results is None:
+        sys.exit(1)
+
+    all_data = [result for result in results.values() if result]
+    output_paths = write_outputs(all_data, output_format)
+
+    print(f"完了: {len(all_data)} 自治体 ({time.perf_counter() - started:.1f}s)")
+    missing = sorted(set(city_names) - set(results))
+    if missing:
+        print(f"シートにない自治体（CSV）: {len(missing)}件 {', '.join(missing[:10])}")
+    for output_path in output_paths:
+        print(f"出力: {output_path}")
+
 
 def main():
     """メイン処理"""
+    args = parse_args()
+    metrics.start_run('parse_excels', args)
+
     # 出力ディレクトリを作成
     PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -144,43 +610,124 @@ def main():
                 'region': row['region']
             })
 
+    if args.workbook:
+        parse_shared_workbook(args.workbook, {m['city_code']: m['name'] for m in municipalities},
+                              args.format)
+        return
+
     print(f"東京都 {len(municipalities)} 自治体のExcelファイルをパース開始")
+    if args.workers > 1:
+        print(f"並列パース: {args.workers} プロセス")
     print("-" * 60)
 
     success_count = 0
     fail_count = 0
     all_data = []
+    timings = []
+    writer = None
 
-    for i, muni in enumerate(municipalities, 1):
-        city_code = muni['city_code']
-        city_name = muni['name']
-        excel_path = RAW_DIR / f"{city_code}.xlsx"
+    def collect(result: Dict):
+        if writer:
+            writer.write(result)
+        else:
+            all_data.append(result)
 
-        print(f"[{i}/{len(municipalities)}] {city_name} ({city_code})... ", end="", flush=True)
+    use_cache = not args.no_cache
+    cache = load_parse_cache() if use_cache and not args.rebuild else {}
+    cache_hits = {}
 
+    # ファイルが存在し、キャッシュにない自治体だけをパース対象にする
+    tasks = []
+    for muni in municipalities:
+        city_code = muni['city_code']
+        excel_path = RAW_DIR / f"{city_code}.xlsx"
         if not excel_path.exists():
-            print(f"[SKIP] Excelファイルが存在しません")
-            fail_count += 1
             continue
+        cached = lookup_parse_cache(cache, excel_path, city_code) if use_cache else None
+        if cached:
+            cache_hits[city_code] = cached
+        else:
+            tasks.append((str(excel_path), city_code, muni['name']))
+
+    # NDJSONはパースできた順に書き出し、結果を all_data に溜めない。
+    # 途中で例外が起きた場合は一時ファイルを削除し、前回の出力を残す
+    with (NdjsonWriter(EMISSIONS_NDJSON) if args.format == 'ndjson' else nullcontext()) as writer:
+        started = time.perf_counter()
+        results = iter_parse_results(tasks, args.workers)
+
+        for i, muni in enumerate(municipalities, 1):
+            city_code = muni['city_code']
+            city_name = muni['name']
+            excel_path = RAW_DIR / f"{city_code}.xlsx"
+
+            print(f"[{i}/{len(municipalities)}] {city_name} ({city_code})... ", end="", flush=True)
+
+            if not excel_path.exists():
+                print(f"[SKIP] Excelファイルが存在しません")
+                fail_count += 1
+                continue
+
+            if city_code in cache_hits:
+                result = cache_hits[city_code]
+                collect(result)
+                success_count += 1
+                print(f"[OK] {len(result['years'])}年度分 (キャッシュ)")
+                metrics.record('parse_excel', 0.0, kind='file', city_code=city_code, cached=True)
+                continue
+
+            result, elapsed, message = next(results)
+            metrics.record('parse_excel', elapsed, kind='file', city_code=city_code,
+                           bytes=excel_path.stat().st_size, rows=len(result['years']) if result else 0,
+                           status='ok' if result else 'error')
+
+            if result:
+                collect(result)
+                success_count += 1
+                print(f"[OK] {len(result['years'])}年度分 ({elapsed:.2f}s)")
+                if use_cache:
+                    store_parse_cache(cache, excel_path, city_code, result)
+            else:
+                fail_count += 1
+                # parse_excel() のエラーメッセージに所要時間を付けて進捗の行に続ける
+                print(f"{message or '[ERROR]'} ({elapsed:.2f}s)")
+
+            timings.append({
+                'city_code': city_code,
+                'city_name': city_name,
+                'status': 'OK' if result else 'ERROR',
+                'seconds': elapsed
+            })
 
-        result = parse_excel(excel_path, city_code, city_name)
+        results.close()
+    total_elapsed = time.perf_counter() - started
+    metrics.record('parse', total_elapsed, rows=success_count, workers=args.workers)
 
-        if result:
-            all_data.append(result)
-            success_count += 1
-            print(f"[OK] {len(result['years'])}年度分")
-        else:
-            fail_count += 1
+    # JSON / Parquetとして保存
+    if args.format == 'ndjson':
+        output_paths = [EMISSIONS_NDJSON]
+    else:
+        output_paths = write_outputs(all_data, args.format)
 
-    # JSONファイルとして保存
-    output_path = PROCESSED_DIR / "tokyo_emissions.json"
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(all_data, f, ensure_ascii=False, indent=2)
+    save_timings(timings)
+    if use_cache:
+        save_parse_cache(cache)
 
     print("-" * 60)
     print(f"完了: 成功 {success_count} / 失敗 {fail_count} / 合計 {len(municipalities)}")
-    print(f"出力: {output_path}")
+    if use_cache:
+        print(f"キャッシュ: ヒット {len(cache_hits)} / ミス {len(tasks)}")
+    print(f"パース時間: {total_elapsed:.1f}s")
+    if timings:
+        print("遅いファイル:")
+        for timing in sorted(timings, key=lambda t: t['seconds'], reverse=True)[:5]:
+            print(f"  {timing['city_code']} {timing['city_name']}: {timing['seconds']:.2f}s")
+    for output_path in output_paths:
+        print(f"出力: {output_path}")
+    print(f"タイミング: {TIMINGS_CSV}")
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        metrics.finish()
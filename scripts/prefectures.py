@@ -0,0 +1,201 @@
+"""
+都道府県マスターと都道府県KPIの集計
+
+団体コードの上2桁（都道府県コード）で自治体をグループ化し、
+全都道府県のKPIを1回の集計で計算する。
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from kpi_calculator import ArrayLike, calc_kpis_batch, calc_ranks, round_like_python
+
+# 都道府県コード -> (都道府県名, スラッグ)
+PREFECTURES: Dict[str, Tuple[str, str]] = {
+    '01': ('北海道', 'hokkaido'),
+    '02': ('青森県', 'aomori'),
+    '03': ('岩手県', 'iwate'),
+    '04': ('宮城県', 'miyagi'),
+    '05': ('秋田県', 'akita'),
+    '06': ('山形県', 'yamagata'),
+    '07': ('福島県', 'fukushima'),
+    '08': ('茨城県', 'ibaraki'),
+    '09': ('栃木県', 'tochigi'),
+    '10': ('群馬県', 'gunma'),
+    '11': ('埼玉県', 'saitama'),
+    '12': ('千葉県', 'chiba'),
+    '13': ('東京都', 'tokyo'),
+    '14': ('神奈川県', 'kanagawa'),
+    '15': ('新潟県', 'niigata'),
+    '16': ('富山県', 'toyama'),
+    '17': ('石川県', 'ishikawa'),
+    '18': ('福井県', 'fukui'),
+    '19': ('山梨県', 'yamanashi'),
+    '20': ('長野県', 'nagano'),
+    '21': ('岐阜県', 'gifu'),
+    '22': ('静岡県', 'shizuoka'),
+    '23': ('愛知県', 'aichi'),
+    '24': ('三重県', 'mie'),
+    '25': ('滋賀県', 'shiga'),
+    '26': ('京都府', 'kyoto'),
+    '27': ('大阪府', 'osaka'),
+    '28': ('兵庫県', 'hyogo'),
+    '29': ('奈良県', 'nara'),
+    '30': ('和歌山県', 'wakayama'),
+    '31': ('鳥取県', 'tottori'),
+    '32': ('島根県', 'shimane'),
+    '33': ('岡山県', 'okayama'),
+    '34': ('広島県', 'hiroshima'),
+    '35': ('山口県', 'yamaguchi'),
+    '36': ('徳島県', 'tokushima'),
+    '37': ('香川県', 'kagawa'),
+    '38': ('愛媛県', 'ehime'),
+    '39': ('高知県', 'kochi'),
+    '40': ('福岡県', 'fukuoka'),
+    '41': ('佐賀県', 'saga'),
+    '42': ('長崎県', 'nagasaki'),
+    '43': ('熊本県', 'kumamoto'),
+    '44': ('大分県', 'oita'),
+    '45': ('宮崎県', 'miyazaki'),
+    '46': ('鹿児島県', 'kagoshima'),
+    '47': ('沖縄県', 'okinawa'),
+}
+
+STATUS_COLUMNS = {
+    'on-track': 'on_track_count',
+    'at-risk': 'at_risk_count',
+    'off-track': 'off_track_count',
+}
+
+
+def prefecture_code(city_code: str) -> str:
+    """団体コードから都道府県コードを取得"""
+    return city_code[:2]
+
+
+def prefecture_columns(city_code: str) -> Dict[str, str]:
+    """municipalities テーブルの都道府県カラム（prefecture_code / name / slug）"""
+    code = prefecture_code(city_code)
+    name, slug = PREFECTURES[code]
+    return {'prefecture_code': code, 'prefecture_name': name, 'prefecture_slug': slug}
+
+
+def aggregate_by_prefecture(city_codes: Sequence[str],
+                            base_emission: ArrayLike,
+                            latest_emission: ArrayLike,
+                            status: Optional[Sequence[Optional[str]]] = None) -> Dict[str, np.ndarray]:
+    """
+    自治体の排出量・ステータスを都道府県ごとに集計
+
+    合計・自治体数・ステータス件数は都道府県コードごとの bincount で1パスで求める。
+    合計は自治体をデータ順に足し上げるので、都道府県ごとに sum() した値と一致する。
+    DBのビュー prefecture_kpi_aggregates と同じカラムを返す。
+
+    Args:
+        city_codes: 団体コードの配列
+        base_emission: 基準年の排出量（千t-CO₂）
+        latest_emission: 最新年の排出量（千t-CO₂）
+        status: 自治体ごとのステータス（KPIがない自治体はNone、省略時は件数を0とする）
+
+    Returns:
+        カラム名 -> 都道府県ごとの配列（都道府県コード順）
+    """
+    codes, inverse = np.unique([prefecture_code(code) for code in city_codes], return_inverse=True)
+    inverse = inverse.reshape(-1)
+    n = len(codes)
+
+    aggregates = {
+        'prefecture_code': codes,
+        'municipality_count': np.bincount(inverse, minlength=n),
+        'base_emission_kt': np.bincount(inverse, weights=np.asarray(base_emission, dtype=float), minlength=n),
+        'latest_emission_kt': np.bincount(inverse, weights=np.asarray(latest_emission, dtype=float), minlength=n)
+    }
+    statuses = np.asarray(status if status is not None else [None] * len(city_codes), dtype=object)
+    for value, column in STATUS_COLUMNS.items():
+        aggregates[column] = np.bincount(inverse, weights=(statuses == value).astype(float),
+                                         minlength=n).astype(int)
+    return aggregates
+
+
+def build_prefecture_kpi_rows(aggregates: Dict[str, np.ndarray],
+                              base_year: int = 2013,
+                              latest_year: int = 2022,
+                              target_reduction_rate: float = 0.46) -> List[Dict]:
+    """
+    都道府県ごとの集計値から prefecture_kpis テーブルの行を作成
+
+    KPIは都道府県の配列に対して calc_kpis_batch() でまとめて計算する。
+
+    Args:
+        aggregates: aggregate_by_prefecture() と同じ形式の集計値
+        base_year: 基準年
+        latest_year: 最新年
+        target_reduction_rate: 目標削減率
+
+    Returns:
+        prefecture_kpis テーブルの行のリスト（national_rank 付き）
+    """
+    codes = [str(code) for code in aggregates['prefecture_code']]
+    if not codes:
+        return []
+
+    total_base = np.asarray(aggregates['base_emission_kt'], dtype=float)
+    total_latest = np.asarray(aggregates['latest_emission_kt'], dtype=float)
+    kpis = calc_kpis_batch(total_base, total_latest, base_year, latest_year,
+                           target_reduction_rate)
+    # 千t → 百万t に変換
+    base_mt = round_like_python(total_base / 1000, 2)
+    latest_mt = round_like_python(total_latest / 1000, 2)
+    shortfall_mt = round_like_python(kpis['shortfall_2030'] / 1000, 2)
+    # 全国順位（ペース達成率順）
+    national_rank = calc_ranks(kpis['pace_achievement_rate'])
+
+    rows = []
+    for i, code in enumerate(codes):
+        name, slug = PREFECTURES[code]
+        rows.append({
+            'prefecture_code': code,
+            'prefecture_name': name,
+            'prefecture_slug': slug,
+            'latest_year': latest_year,
+            'base_emission_mt': float(base_mt[i]),
+            'latest_emission_mt': float(latest_mt[i]),
+            'reduction_rate': float(kpis['reduction_rate'][i]),
+            'actual_pace': float(kpis['actual_pace'][i]),
+            'required_pace': float(kpis['required_pace'][i]),
+            'pace_achievement_rate': float(kpis['pace_achievement_rate'][i]),
+            'status': str(kpis['status'][i]),
+            'shortfall_2030_mt': float(shortfall_mt[i]),
+            'municipality_count': int(aggregates['municipality_count'][i]),
+            'on_track_count': int(aggregates['on_track_count'][i]),
+            'at_risk_count': int(aggregates['at_risk_count'][i]),
+            'off_track_count': int(aggregates['off_track_count'][i]),
+            'national_rank': int(national_rank[i])
+        })
+    return rows
+
+
+def build_prefecture_kpis(city_codes: Sequence[str],
+                          base_emission: ArrayLike,
+                          latest_emission: ArrayLike,
+                          status: Optional[Sequence[Optional[str]]] = None,
+                          base_year: int = 2013,
+                          latest_year: int = 2022,
+                          target_reduction_rate: float = 0.46) -> List[Dict]:
+    """
+    自治体の排出量から全都道府県のKPIを一括集計
+
+    Args:
+        city_codes: 団体コードの配列
+        base_emission: 基準年の排出量（千t-CO₂）
+        latest_emission: 最新年の排出量（千t-CO₂）
+        status: 自治体ごとのステータス（KPIがない自治体はNone）
+        base_year: 基準年
+        latest_year: 最新年
+        target_reduction_rate: 目標削減率
+
+    Returns:
+        prefecture_kpis テーブルの行のリスト（都道府県コード順、national_rank 付き）
+    """
+    if len(city_codes) == 0:
+        return []
+    aggregates = aggregate_by_prefecture(city_codes, base_emission, latest_emission, status)
+    return build_prefecture_kpi_rows(aggregates, base_year, latest_year, target_reduction_rate)
@@ -0,0 +1,93 @@
+"""
+KPIテーブルの集計クエリ
+
+絞り込み（都道府県コード）・カラムの選択・集計をDB側で行い、
+必要な分だけを取得する。集計ビュー（create_schema.sql の
+prefecture_kpi_aggregates）が未作成のDBではローカル集計にフォールバックする。
+"""
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from db import is_missing_object_error, select_all
+from prefectures import STATUS_COLUMNS, aggregate_by_prefecture
+
+AGGREGATES_VIEW = 'prefecture_kpi_aggregates'
+AGGREGATE_COLUMNS = ['prefecture_code', 'municipality_count', 'base_emission_kt',
+                     'latest_emission_kt', *STATUS_COLUMNS.values()]
+
+
+def fetch_municipality_kpis(supabase, columns: str = '*',
+                            prefecture_codes: Optional[Sequence[str]] = None) -> List[Dict]:
+    """
+    自治体KPIを必要なカラム・都道府県だけ取得
+
+    都道府県は団体コードの前方一致でDB側で絞り込む
+    （create_schema.sql の city_code の varchar_pattern_ops インデックスを使う）。
+
+    Args:
+        supabase: Supabaseクライアント
+        columns: 取得するカラム（PostgRESTのselect構文）
+        prefecture_codes: 対象の都道府県コード（省略時は全国）
+
+    Returns:
+        行のリスト（団体コード順）
+    """
+    if not prefecture_codes:
+        return select_all(supabase, 'municipality_kpis', columns, order='city_code')
+
+    rows = []
+    for code in sorted(prefecture_codes):
+        rows.extend(select_all(supabase, 'municipality_kpis', columns, order='city_code',
+                               filters=[('city_code', 'like', f"{code}*")]))
+    return rows
+
+
+def _rows_to_columns(rows: List[Dict]) -> Dict[str, np.ndarray]:
+    """ビューの行を aggregate_by_prefecture() と同じ列配列に変換"""
+    rows = sorted(rows, key=lambda row: row['prefecture_code'])
+    aggregates = {'prefecture_code': np.array([row['prefecture_code'] for row in rows], dtype=object)}
+    for column in AGGREGATE_COLUMNS[1:]:
+        dtype = float if column.endswith('_kt') else int
+        aggregates[column] = np.array([row[column] or 0 for row in rows], dtype=dtype)
+    return aggregates
+
+
+def fetch_prefecture_aggregates(supabase,
+                                prefecture_codes: Optional[Sequence[str]] = None,
+                                use_view: bool = True) -> Dict[str, np.ndarray]:
+    """
+    都道府県ごとの排出量合計・自治体数・ステータス件数を取得
+
+    ビューがあれば集計済みの1都道府県1行（数KB）だけを受け取り、
+    なければ集計に必要な4カラムだけを取得してローカルで集計する。
+
+    Args:
+        supabase: Supabaseクライアント
+        prefecture_codes: 対象の都道府県コード（省略時は全国）
+        use_view: Falseならビューを使わずローカルで集計
+
+    Returns:
+        カラム名 -> 都道府県ごとの配列（都道府県コード順）
+    """
+    if use_view:
+        filters = []
+        if prefecture_codes:
+            filters = [('prefecture_code', 'in', f"({','.join(prefecture_codes)})")]
+        try:
+            rows = select_all(supabase, AGGREGATES_VIEW, ','.join(AGGREGATE_COLUMNS),
+                              order='prefecture_code', filters=filters)
+            return _rows_to_columns(rows)
+        except Exception as e:
+            # ビューを作成していないDBだけローカル集計に切り替え、それ以外のエラーはそのまま送出
+            if not is_missing_object_error(e):
+                raise
+            print(f"[INFO] {AGGREGATES_VIEW} がないためローカルで集計します"
+                  f"（create_schema.sql を実行すると集計済みの値だけを取得します）: {e}")
+
+    rows = fetch_municipality_kpis(supabase, 'city_code, base_emission_kt, latest_emission_kt, status',
+                                   prefecture_codes)
+    return aggregate_by_prefecture(
+        [row['city_code'] for row in rows],
+        [float(row['base_emission_kt']) for row in rows],
+        [float(row['latest_emission_kt']) for row in rows],
+        [row['status'] for row in rows]
+    )
@@ -2,57 +2,90 @@
 """
 すべての自治体の偏差値を再計算
 """
-import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
-from kpi_calculator import calc_deviation_score
+import argparse
+from kpi_calculator import calc_deviation_scores, population_band
+from db import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_WORKERS,
+    diff_rows,
+    get_client,
+    print_diff,
+    select_all,
+    update_batches
+)
+import metrics
 
-# 環境変数読み込み
-load_dotenv()
-supabase_url = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
-supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
+parser = argparse.ArgumentParser(description="偏差値の再計算")
+parser.add_argument('--group-by', choices=['none', 'prefecture', 'population'], default='none',
+                    help="偏差値の比較グループ（none: 全体 / prefecture: 都道府県 / population: 人口規模帯）")
+parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="1リクエストあたりの行数")
+parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="同時リクエスト数")
+parser.add_argument('--dry-run', action='store_true', help="書き込まずに差分だけ表示")
+metrics.add_metrics_args(parser)
+args = parser.parse_args()
+metrics.start_run('recalc_deviation_scores', args)
 
-if not supabase_url or not supabase_key:
-    raise Exception('.env.localにSupabaseの環境変数が設定されていません')
+try:
+    supabase = get_client()
 
-supabase: Client = create_client(supabase_url, supabase_key)
+    print("=== 偏差値の再計算 ===\n")
 
-print("=== 偏差値の再計算 ===\n")
+    # 全国の自治体KPIを、計算に使うカラムと人口だけ取得
+    # （PostgRESTは1回で最大1000行までしか返さないため、ページングして全件取得）
+    with metrics.span('fetch_kpis') as span:
+        kpis = select_all(supabase, 'municipality_kpis',
+                          'city_code, reduction_rate, deviation_score, municipalities(population)',
+                          order='city_code')
+        span['rows'] = len(kpis)
 
-# 東京都の全自治体KPIを取得
-result = supabase.table('municipality_kpis')\
-    .select('city_code, reduction_rate')\
-    .execute()
+    if not kpis:
+        print("データが見つかりません")
+        exit(1)
 
-if not result.data:
-    print("データが見つかりません")
-    exit(1)
+    # 削減率の絶対値リストを作成
+    reduction_rates = [abs(float(kpi['reduction_rate'])) for kpi in kpis]
 
-# 削減率の絶対値リストを作成
-reduction_rates = [abs(float(kpi['reduction_rate'])) for kpi in result.data]
+    print(f"対象自治体数: {len(kpis)}件")
+    print(f"削減率の範囲: {min(reduction_rates):.1f}% 〜 {max(reduction_rates):.1f}%")
+    print(f"削減率の平均: {sum(reduction_rates)/len(reduction_rates):.1f}%\n")
 
-print(f"対象自治体数: {len(result.data)}件")
-print(f"削減率の範囲: {min(reduction_rates):.1f}% 〜 {max(reduction_rates):.1f}%")
-print(f"削減率の平均: {sum(reduction_rates)/len(reduction_rates):.1f}%\n")
+    # 比較グループ
+    groups = None
+    if args.group_by == 'prefecture':
+        groups = [kpi['city_code'][:2] for kpi in kpis]
+    elif args.group_by == 'population':
+        populations = [
+            (kpi.get('municipalities') or {}).get('population') or float('nan')
+            for kpi in kpis
+        ]
+        groups = population_band(populations)
 
-# 各自治体の偏差値を再計算
-updated = 0
-for kpi in result.data:
-    city_code = kpi['city_code']
-    reduction_rate = abs(float(kpi['reduction_rate']))
+    # 全自治体の偏差値を一括計算（削減率が高いほど偏差値が高い）
+    with metrics.span('deviation_scores', rows=len(reduction_rates)):
+        deviation_scores = calc_deviation_scores(reduction_rates, groups).tolist()
 
-    # 偏差値を計算（削減率が高いほど偏差値が高い）
-    deviation_score = calc_deviation_score(reduction_rates, reduction_rate)
+    # 値が変わる自治体だけを、変わったカラムだけまとめて更新
+    # （読み込んだ行全体を書き戻すと、その間に他で更新された値を古い値で上書きしてしまう）
+    new_values = {
+        kpi['city_code']: {'deviation_score': deviation_score}
+        for kpi, deviation_score in zip(kpis, deviation_scores)
+    }
+    changed = diff_rows(kpis, new_values)
+    print_diff(changed)
 
-    # 更新
-    update_result = supabase.table('municipality_kpis')\
-        .update({'deviation_score': deviation_score})\
-        .eq('city_code', city_code)\
-        .execute()
+    updated = 0
+    if not args.dry_run:
+        updates = {row['city_code']: {column: new for column, (_, new) in changes.items()}
+                   for row, changes in changed}
+        with metrics.span('update', rows=len(changed)):
+            updated = update_batches(supabase, 'municipality_kpis', updates, 'city_code',
+                                     args.batch_size, args.workers)
 
-    if update_result.data:
-        updated += 1
-        print(f"{city_code}: 削減率 {reduction_rate:.1f}% → 偏差値 {deviation_score:.1f}")
-
-print(f"\n=== 完了 ===")
-print(f"更新: {updated}件")
+    print(f"\n=== 完了 ===")
+    print(f"変更あり: {len(changed)}件 / 変更なし: {len(kpis) - len(changed)}件")
+    if args.dry_run:
+        print("ドライラン: 書き込みは行っていません")
+    else:
+        print(f"更新: {updated}件")
+finally:
+    metrics.finish()
@@ -2,79 +2,85 @@
 """
 人口データを使って一人当たりCO2排出量を再計算
 """
-import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
-
-# 環境変数読み込み
-load_dotenv()
-supabase_url = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
-supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-
-if not supabase_url or not supabase_key:
-    raise Exception('.env.localにSupabaseの環境変数が設定されていません')
-
-supabase: Client = create_client(supabase_url, supabase_key)
-
-def calc_emission_per_capita(total_emission_kt: float, population: int) -> float:
-    """
-    一人当たりCO2排出量を計算（t-CO₂/人）
-
-    Args:
-        total_emission_kt: 総排出量（千t-CO₂）
-        population: 人口（人）
-
-    Returns:
-        一人当たり排出量（t-CO₂/人）
-    """
-    if population <= 0:
-        return 0.0
-
-    # 千t-CO₂ → t-CO₂ に変換してから人口で割る
-    per_capita = (total_emission_kt * 1000) / population
-    return round(per_capita, 3)
-
-print("=== 一人当たりCO2排出量の再計算 ===\n")
-
-# municipality_kpisとmunicipalitiesをJOINして取得
-result = supabase.table('municipality_kpis')\
-    .select('city_code, latest_emission_kt, municipalities(population)')\
-    .execute()
-
-if not result.data:
-    print("データが見つかりません")
-    exit(1)
-
-updated_count = 0
-skipped_count = 0
-
-for kpi in result.data:
-    city_code = kpi['city_code']
-    latest_emission_kt = float(kpi['latest_emission_kt'])
-
-    municipality = kpi.get('municipalities')
-    if not municipality or not municipality.get('population'):
-        print(f"{city_code}: 人口データなし（スキップ）")
-        skipped_count += 1
-        continue
-
-    population = municipality['population']
-
-    # 一人当たり排出量を計算
-    emission_per_capita = calc_emission_per_capita(latest_emission_kt, population)
-
-    # 更新
-    update_result = supabase.table('municipality_kpis')\
-        .update({'emission_per_capita': emission_per_capita})\
-        .eq('city_code', city_code)\
-        .execute()
-
-    if update_result.data:
-        print(f"{city_code}: {emission_per_capita:.3f} t-CO₂/人 (人口: {population:,}人)")
-        updated_count += 1
+import argparse
+from kpi_calculator import calc_emission_per_capita_batch
+from db import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_WORKERS,
+    diff_rows,
+    get_client,
+    print_diff,
+    select_all,
+    update_batches
+)
+import metrics
+
+parser = argparse.ArgumentParser(description="一人当たりCO2排出量の再計算")
+parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="1リクエストあたりの行数")
+parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="同時リクエスト数")
+parser.add_argument('--dry-run', action='store_true', help="書き込まずに差分だけ表示")
+metrics.add_metrics_args(parser)
+args = parser.parse_args()
+metrics.start_run('recalc_emission_per_capita', args)
+
+try:
+    supabase = get_client()
+
+    print("=== 一人当たりCO2排出量の再計算 ===\n")
+
+    # municipality_kpisとmunicipalitiesをJOINして、計算に使うカラムだけ取得
+    # （PostgRESTは1回で最大1000行までしか返さないため、ページングして全件取得）
+    with metrics.span('fetch_kpis') as span:
+        kpis = select_all(supabase, 'municipality_kpis',
+                          'city_code, latest_emission_kt, emission_per_capita, municipalities(population)',
+                          order='city_code')
+        span['rows'] = len(kpis)
+
+    if not kpis:
+        print("データが見つかりません")
+        exit(1)
+
+    # 人口データのある自治体だけを対象にする
+    targets = []
+    skipped_count = 0
+    for kpi in kpis:
+        municipality = kpi.get('municipalities')
+        if not municipality or not municipality.get('population'):
+            print(f"{kpi['city_code']}: 人口データなし（スキップ）")
+            skipped_count += 1
+            continue
+        targets.append(kpi)
+
+    # 一人当たり排出量を一括計算
+    with metrics.span('emission_per_capita', rows=len(targets)):
+        emission_per_capita = calc_emission_per_capita_batch(
+            [float(kpi['latest_emission_kt']) for kpi in targets],
+            [kpi['municipalities']['population'] for kpi in targets]
+        ).tolist()
+
+    # 値が変わる自治体だけを、変わったカラムだけまとめて更新
+    # （読み込んだ行全体を書き戻すと、その間に他で更新された値を古い値で上書きしてしまう）
+    new_values = {
+        kpi['city_code']: {'emission_per_capita': value}
+        for kpi, value in zip(targets, emission_per_capita)
+    }
+    changed = diff_rows(targets, new_values)
+    print_diff(changed)
+
+    updated_count = 0
+    if not args.dry_run:
+        updates = {row['city_code']: {column: new for column, (_, new) in changes.items()}
+                   for row, changes in changed}
+        with metrics.span('update', rows=len(changed)):
+            updated_count = update_batches(supabase, 'municipality_kpis', updates, 'city_code',
+                                           args.batch_size, args.workers)
+
+    print(f"\n=== 完了 ===")
+    print(f"変更あり: {len(changed)}件 / 変更なし: {len(targets) - len(changed)}件")
+    if args.dry_run:
+        print("ドライラン: 書き込みは行っていません")
     else:
-        print(f"{city_code}: 更新失敗")
-
-print(f"\n=== 完了 ===")
-print(f"更新: {updated_count}件")
-print(f"スキップ: {skipped_count}件")
+        print(f"更新: {updated_count}件")
+    print(f"スキップ: {skipped_count}件")
+finally:
+    metrics.finish()
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+データパイプラインの一括実行
+
+各スクリプトを入力・出力・依存関係を宣言したステージとして扱い、
+入力ファイルの内容（SHA-256）が前回成功時から変わったステージだけを実行する。
+依存関係のないステージは並列に実行し、ステージごとの所要時間を記録する。
+
+    download ─▶ parse ──────────────┐
+                                    ▼
+    municipalities ─┬──────────▶ seed ─┐
+                    └─▶ population_area ─┴─▶ per_capita
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# 設定
+ROOT_DIR = Path(__file__).parent.parent
+SCRIPTS_DIR = ROOT_DIR / "scripts"
+PROCESSED_DIR = ROOT_DIR / "data" / "processed"
+# ファイルハッシュと成功時のステージキーの保存先
+PIPELINE_STATE_JSON = PROCESSED_DIR / "pipeline_state.json"
+# ステージごとの実行時間
+PIPELINE_TIMINGS_CSV = PROCESSED_DIR / "pipeline_timings.csv"
+# ステージごとの標準出力・標準エラー
+PIPELINE_LOG_DIR = PROCESSED_DIR / "pipeline_logs"
+
+DEFAULT_JOBS = 2
+
+
+class Stage(NamedTuple):
+    """
+    パイプラインの1ステージ
+
+    Attributes:
+        name: ステージ名
+        command: scripts/ からの相対パスのスクリプトと引数
+        inputs: 入力ファイル（リポジトリルートからの相対パス、globパターン可）
+        outputs: 出力ファイル（存在しなければ再実行、DBに書き込むだけのステージは空）
+        deps: 先に完了している必要があるステージ
+    """
+    name: str
+    command: List[str]
+    inputs: List[str]
+    outputs: List[str]
+    deps: List[str]
+
+
+STAGES = [
+    Stage('download', ['download_excels.py'],
+          inputs=['data/tokyo_municipalities.csv', 'scripts/download_excels.py'],
+          outputs=['data/raw/*.xlsx'],
+          deps=[]),
+    Stage('parse', ['parse_excels.py'],
+          inputs=['data/raw/*.xlsx', 'data/tokyo_municipalities.csv',
+                  'scripts/parse_excels.py', 'scripts/emissions_store.py'],
+          outputs=['data/processed/tokyo_emissions.json'],
+          deps=['download']),
+    Stage('municipalities', ['seed_supabase.py', '--steps', 'municipalities'],
+          inputs=['data/tokyo_municipalities.csv', 'scripts/seed_supabase.py'],
+          outputs=[],
+          deps=[]),
+    Stage('population_area', ['import_tokyo_population_area.py'],
+          inputs=['data/population_households_2022.xls', 'data/natural_environment_2022.xls',
+                  'scripts/import_tokyo_population_area.py', 'scripts/stat_cache.py'],
+          outputs=[],
+          deps=['municipalities']),
+    Stage('seed', ['seed_supabase.py', '--steps', 'emissions', 'kpis'],
+          inputs=['data/processed/tokyo_emissions.json', 'data/processed/tokyo_emissions.parquet',
+                  'data/processed/tokyo_emissions.ndjson',
+                  'scripts/seed_supabase.py', 'scripts/emissions_cube.py',
+                  'scripts/emissions_store.py', 'scripts/kpi_calculator.py', 'scripts/db.py'],
+          outputs=[],
+          deps=['parse', 'municipalities']),
+    Stage('per_capita', ['recalc_emission_per_capita.py'],
+          inputs=['scripts/recalc_emission_per_capita.py', 'scripts/kpi_calculator.py',
+                  'scripts/db.py'],
+          outputs=[],
+          deps=['seed', 'population_area']),
+    Stage('export', ['export_static_api.py'],
+          inputs=['scripts/export_static_api.py', 'scripts/local_mirror.py'],
+          outputs=['public/data/api/manifest.json'],
+          deps=['per_capita']),
+]
+
+
+def load_pipeline_state(state_path: Path = PIPELINE_STATE_JSON) -> Dict:
+    """前回のファイルハッシュとステージキーを読み込み"""
+    if state_path.exists():
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if isinstance(state, dict):
+                state.setdefault('files', {})
+                state.setdefault('stages', {})
+                return state
+        except (OSError, ValueError):
+            pass
+    return {'files': {}, 'stages': {}}
+
+
+def save_pipeline_state(state: Dict, state_path: Path = PIPELINE_STATE_JSON):
+    """状態を一時ファイル経由で書き出し"""
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = state_path.with_suffix('.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, state_path)
+
+
+def expand_patterns(patterns: List[str]) -> List[Path]:
+    """globパターンをリポジトリ内の既存ファイルに展開（重複なし・パス順）"""
+    paths = set()
+    for pattern in patterns:
+        paths.update(p for p in ROOT_DIR.glob(pattern) if p.is_file())
+    return sorted(paths)
+
+
+def file_digest(path: Path, file_cache: Dict[str, List]) -> str:
+    """
+    ファイルのSHA-256
+
+    サイズと更新時刻が前回と同じならハッシュを再計算しない。
+
+    Args:
+        path: 対象ファイル
+        file_cache: 相対パス -> [サイズ, 更新時刻(ns), SHA-256]（更新される）
+    """
+    stat = path.stat()
+    rel = path.relative_to(ROOT_DIR).as_posix()
+    cached = file_cache.get(rel)
+    if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    file_cache[rel] = [stat.st_size, stat.st_mtime_ns, digest]
+    return digest
+
+
+def stage_key(stage: Stage, dep_keys: Dict[str, str], file_cache: Dict[str, List]) -> str:
+    """
+    ステージの入力全体を表すキー
+
+    コマンド・入力ファイルの内容・依存ステージのキーから計算する。
+    上流のキーが変われば下流のキーも変わる。
+    """
+    sha = hashlib.sha256()
+    sha.update(json.dumps(stage.command).encode('utf-8'))
+    for path in expand_patterns(stage.inputs):
+        sha.update(path.relative_to(ROOT_DIR).as_posix().encode('utf-8'))
+        sha.update(file_digest(path, file_cache).encode('ascii'))
+    for dep in stage.deps:
+        sha.update(f"{dep}={dep_keys.get(dep, '')}".encode('utf-8'))
+    return sha.hexdigest()
+
+
+def is_fresh(stage: Stage, key: str, state: Dict) -> bool:
+    """前回成功時と入力が同じで、出力がそろっているか"""
+    previous = state['stages'].get(stage.name)
+    if not previous or previous.get('key') != key:
+        return False
+    return all(expand_patterns([pattern]) for pattern in stage.outputs)
+
+
+def run_stage(stage: Stage, log_dir: Path = PIPELINE_LOG_DIR) -> Tuple[int, float]:
+    """
+    ステージのスクリプトを実行（出力はログファイルへ）
+
+    Returns:
+        (終了コード, 所要時間(秒))
+    """
+    log_dir.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    with open(log_dir / f"{stage.name}.log", 'w', encoding='utf-8') as log:
+        process = subprocess.run(
+            [sys.executable, *stage.command],
+            cwd=str(SCRIPTS_DIR),
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            env={**os.environ, 'PYTHONUNBUFFERED': '1'}
+        )
+    return process.returncode, time.perf_counter() - started
+
+
+def select_stages(only: Optional[List[str]]) -> List[Stage]:
+    """--only で指定したステージだけを残す（それ以外の依存は完了済みとみなす）"""
+    if not only:
+        return list(STAGES)
+    return [stage for stage in STAGES if stage.name in only]
+
+
+def run_pipeline(stages: List[Stage], state: Dict, jobs: int = DEFAULT_JOBS,
+                 force: Optional[List[str]] = None, dry_run: bool = False) -> List[Dict]:
+    """
+    依存関係の順にステージを実行
+
+    依存ステージがすべて終わったものから並列に実行する。
+    ステージのキーは上流のキーを含むので、上流の入力が変われば下流も実行される。
+    失敗したステージの下流は実行しない。
+
+    Args:
+        stages: 実行対象のステージ
+        state: load_pipeline_state() の結果（成功したステージのキーが更新される）
+        jobs: 同時に実行するステージ数
+        force: 入力が変わっていなくても実行するステージ（空リストなら全ステージ）
+        dry_run: 実行せずに実行予定だけを表示
+
+    Returns:
+        ステージごとの結果（stage / status / seconds）のリスト
+    """
+    names = {stage.name for stage in stages}
+    pending = {stage.name: stage for stage in stages}
+    keys = {name: info.get('key', '') for name, info in state['stages'].items()}
+    finished = {}  # ステージ名 -> 'ran' / 'skipped' / 'planned' / 'failed' / 'blocked'
+    results = []
+
+    def ready(stage: Stage) -> bool:
+        return all(dep not in names or dep in finished for dep in stage.deps)
+
+    def forced(stage: Stage) -> bool:
+        return force is not None and (not force or stage.name in force)
+
+    def execute(stage: Stage, key: str) -> Tuple[Stage, str, str, float]:
+        code, seconds = run_stage(stage)
+        return stage, key, 'ran' if code == 0 else 'failed', seconds
+
+    def record(stage: Stage, status: str, seconds: float = 0.0):
+        finished[stage.name] = status
+        results.append({'stage': stage.name, 'status': status, 'seconds': round(seconds, 3)})
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        running = {}
+        while pending or running:
+            for stage in [s for s in pending.values() if ready(s)]:
+                del pending[stage.name]
+
+                if any(finished.get(dep) in ('failed', 'blocked') for dep in stage.deps):
+                    print(f"[BLOCKED] {stage.name} - 依存ステージが失敗")
+                    record(stage, 'blocked')
+                    continue
+
+                key = stage_key(stage, keys, state['files'])
+                if not forced(stage) and is_fresh(stage, key, state):
+                    print(f"[SKIP] {stage.name} - 入力に変更なし")
+                    keys[stage.name] = key
+                    record(stage, 'skipped')
+                    continue
+
+                if dry_run:
+                    # 実行したものとして下流の判定を進める
+                    print(f"[PLAN] {stage.name} - {' '.join(stage.command)}")
+                    keys[stage.name] = key
+                    record(stage, 'planned')
+                    continue
+
+                print(f"[RUN] {stage.name} - {' '.join(stage.command)}")
+                running[executor.submit(execute, stage, key)] = stage.name
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                stage, key, status, seconds = future.result()
+                if status == 'ran':
+                    print(f"[OK] {stage.name} ({seconds:.2f}s)")
+                    keys[stage.name] = key
+                    state['stages'][stage.name] = {
+                        'key': key,
+                        'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        'seconds': round(seconds, 3)
+                    }
+                    save_pipeline_state(state)
+                else:
+                    print(f"[FAIL] {stage.name} ({seconds:.2f}s) - ログ: {PIPELINE_LOG_DIR / (stage.name + '.log')}")
+                record(stage, status, seconds)
+
+    return results
+
+
+def save_timings(results: List[Dict], output_path: Path = PIPELINE_TIMINGS_CSV):
+    """ステージごとの結果と所要時間をCSVに書き出し"""
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['stage', 'status', 'seconds'])
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def parse_args() -> argparse.Namespace:
+    """コマンドライン引数を解析"""
+    stage_names = [stage.name for stage in STAGES]
+    parser = argparse.ArgumentParser(description="データパイプラインを依存関係の順に実行")
+    parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS,
+                        help=f"同時に実行するステージ数（デフォルト{DEFAULT_JOBS}）")
+    parser.add_argument('--only', nargs='+', choices=stage_names,
+                        help="指定したステージだけを実行（それ以外の依存は完了済みとみなす）")
+    parser.add_argument('--force', nargs='*', choices=stage_names,
+                        help="入力に変更がなくても実行するステージ（ステージ名を省略すると全ステージ）")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="実行せずに実行予定のステージだけを表示")
+    return parser.parse_args()
+
+
+def main():
+    """メイン処理"""
+    args = parse_args()
+    stages = select_stages(args.only)
+    state = load_pipeline_state()
+
+    print("=" * 60)
+    print(f"パイプライン実行: {len(stages)} ステージ / 同時実行数 {args.jobs}")
+    print("=" * 60)
+
+    started = time.perf_counter()
+    results = run_pipeline(stages, state, args.jobs, args.force, args.dry_run)
+    elapsed = time.perf_counter() - started
+
+    if not args.dry_run:
+        # 変更がなくてもファイルハッシュのキャッシュは保存しておく
+        save_pipeline_state(state)
+        save_timings(results)
+
+    print("-" * 60)
+    for result in results:
+        print(f"  {result['stage']:16s} {result['status']:8s} {result['seconds']:8.2f}s")
+    print("-" * 60)
+    print(f"合計: {elapsed:.2f}s")
+    if not args.dry_run:
+        print(f"タイミング: {PIPELINE_TIMINGS_CSV}")
+
+    if any(result['status'] in ('failed', 'blocked') for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,55 @@
 """
 パース済みデータからKPIを計算してSupabaseに投入
 """
-import json
+import argparse
 import csv
+import json
 import os
+import sys
 from pathlib import Path
-from typing import Dict, List
-from dotenv import load_dotenv
-from supabase import create_client, Client
-from kpi_calculator import (
-    calc_actual_pace,
-    calc_required_pace,
-    calc_pace_achievement_rate,
-    calc_shortfall_2030,
-    calc_reduction_rate,
-    calc_emission_per_capita,
-    calc_deviation_score,
-    determine_status
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from supabase import Client
+from kpi_calculator import calc_deviation_scores, calc_kpis_batch, calc_ranks
+from prefectures import build_prefecture_kpis, prefecture_columns
+from emissions_store import (
+    EMISSIONS_JSON,
+    EMISSIONS_NDJSON,
+    EMISSIONS_PARQUET,
+    iter_emissions_ndjson,
+    iter_prefecture_chunks
+)
+from emissions_cube import EmissionsCube, load_emissions_cube
+import bulk_copy
+import metrics
+from db import (
+    DEFAULT_WORKERS,
+    get_client,
+    print_upload_stats,
+    replay_dead_letters,
+    select_all,
+    upload_batches
 )
-
-# 環境変数読み込み
-load_dotenv()
 
 # 設定
 DATA_DIR = Path(__file__).parent.parent / "data"
 PROCESSED_DIR = DATA_DIR / "processed"
 MUNICIPALITIES_CSV = DATA_DIR / "tokyo_municipalities.csv"
-EMISSIONS_JSON = PROCESSED_DIR / "tokyo_emissions.json"
-
-# Supabase接続
-SUPABASE_URL = os.getenv("NEXT_PUBLIC_SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")  # 書き込み用
+# 投入済み排出量のフィンガープリント（差分投入用）
+EMISSIONS_STATE_JSON = PROCESSED_DIR / "emissions_seed_state.json"
+# 投入に失敗したバッチの退避先（--replay-dead-letter で再送）
+EMISSIONS_DEAD_LETTER = PROCESSED_DIR / "emissions_dead_letter.ndjson"
+EMISSIONS_KEY_COLUMNS = ('city_code', 'fiscal_year', 'sector')
+# 投入ステップ（--steps で一部だけ実行可能）
+SEED_STEPS = ('municipalities', 'emissions', 'kpis')
+# 排出量の投入方法（copy はPostgreSQLに直接接続、compare は両方を実行して時間を比較）
+LOAD_METHODS = ('postgrest', 'copy', 'compare')
 
 BASE_YEAR = 2013
 LATEST_YEAR = 2022
 TARGET_REDUCTION_RATE = 0.46  # 46%削減
 
 
-def get_supabase_client() -> Client:
-    """Supabaseクライアントを取得"""
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        raise ValueError("環境変数 NEXT_PUBLIC_SUPABASE_URL と SUPABASE_SERVICE_ROLE_KEY が必要です")
-    return create_client(SUPABASE_URL, SUPABASE_KEY)
-
-
 def load_municipality_info() -> Dict[str, Dict]:
     """自治体情報をCSVから読み込み"""
     municipalities = {}
@@ -57,17 +63,6 @@ def load_municipality_info() -> Dict[str, Dict]:
     return municipalities
 
 
-def calc_total_emission(emissions_by_sector: Dict, year: int) -> float:
-    """指定年度の全部門合計排出量を計算"""
-    total = 0.0
-    year_str = str(year)  # JSONのキーは文字列
-    for sector_data in emissions_by_sector.values():
-        value = sector_data.get(year_str)
-        if value is not None:
-            total += value
-    return round(total, 2)
-
-
 def seed_municipalities(supabase: Client, muni_info: Dict):
     """自治体マスターを投入"""
     print("\n自治体マスターを投入中...")
@@ -77,12 +72,10 @@ def seed_municipalities(supabase: Client, muni_info: Dict):
         municipalities_data.append({
             'city_code': city_code,
             'name': info['name'],
-            'prefecture_code': '13',
-            'prefecture_name': '東京都',
-            'prefecture_slug': 'tokyo',
+            **prefecture_columns(city_code),
             'region': info['region'],
-            'population': None,  # 後で更新可能
-            'area_km2': None,
+            # population / area_km2 は import_tokyo_population_area.py で投入するため
+            # ここでは送らない（再投入しても既存の値を消さない）
             'zero_carbon_declared': False,
             'zero_carbon_year': None
         })
@@ -92,180 +85,520 @@ def seed_municipalities(supabase: Client, muni_info: Dict):
     print(f"✓ {len(municipalities_data)} 件の自治体を投入")
 
 
-def seed_emissions(supabase: Client, emissions_data: List[Dict]):
-    """排出量データを投入"""
-    print("\n排出量データを投入中...")
+def emission_key(city_code: str, fiscal_year, sector: str) -> str:
+    """排出量1行の識別キー（city_code|fiscal_year|sector）"""
+    return f"{city_code}|{int(fiscal_year)}|{sector}"
 
-    all_emissions = []
-    for muni_data in emissions_data:
-        city_code = muni_data['city_code']
-        emissions_by_sector = muni_data['emissions']
-
-        for sector, yearly_data in emissions_by_sector.items():
-            for year, value in yearly_data.items():
-                if value is not None:
-                    all_emissions.append({
-                        'city_code': city_code,
-                        'fiscal_year': year,
-                        'sector': sector,
-                        'value_kt_co2': value
-                    })
-
-    # バッチ投入（1000件ずつ）
-    batch_size = 1000
-    for i in range(0, len(all_emissions), batch_size):
-        batch = all_emissions[i:i + batch_size]
-        supabase.table('emissions').upsert(batch).execute()
-        print(f"  {i + len(batch)} / {len(all_emissions)} 件投入済み")
-
-    print(f"✓ {len(all_emissions)} 件の排出量データを投入")
-
-
-def seed_municipality_kpis(supabase: Client, emissions_data: List[Dict]):
-    """自治体KPIを計算・投入"""
-    print("\n自治体KPIを計算・投入中...")
 
-    kpis_data = []
-    reduction_rates = []  # 偏差値計算用
+def emission_fingerprint(value) -> str:
+    """排出量の値のフィンガープリント（DBの NUMERIC(10,2) に合わせて丸める）"""
+    return f"{float(value):.2f}"
 
-    for muni_data in emissions_data:
-        city_code = muni_data['city_code']
-        emissions_by_sector = muni_data['emissions']
 
-        # 基準年と最新年の総排出量を計算
-        base_emission = calc_total_emission(emissions_by_sector, BASE_YEAR)
-        latest_emission = calc_total_emission(emissions_by_sector, LATEST_YEAR)
+def build_emission_rows(cube: EmissionsCube) -> List[Dict]:
+    """排出量キューブを emissions テーブルの行に展開"""
+    return list(cube.iter_rows())
 
-        if base_emission == 0 or latest_emission == 0:
-            continue
 
-        # KPI計算
-        reduction_rate = calc_reduction_rate(base_emission, latest_emission)
-        actual_pace = calc_actual_pace(base_emission, latest_emission, BASE_YEAR, LATEST_YEAR)
-        required_pace = calc_required_pace(base_emission, TARGET_REDUCTION_RATE, BASE_YEAR)
-        pace_achievement_rate = calc_pace_achievement_rate(actual_pace, required_pace)
-        shortfall = calc_shortfall_2030(base_emission, actual_pace, BASE_YEAR)
-        status = determine_status(pace_achievement_rate)
+def fetch_emission_state(supabase: Client) -> Dict[str, str]:
+    """DBの emissions から (city_code, fiscal_year, sector) ごとのフィンガープリントを取得"""
+    rows = select_all(supabase, 'emissions', 'city_code, fiscal_year, sector, value_kt_co2', order='id')
+    return {
+        emission_key(row['city_code'], row['fiscal_year'], row['sector']):
+            emission_fingerprint(row['value_kt_co2'])
+        for row in rows if row['value_kt_co2'] is not None
+    }
 
+
+def load_emission_state() -> Optional[Dict[str, str]]:
+    """前回投入時のフィンガープリントを読み込み（なければNone）"""
+    if not EMISSIONS_STATE_JSON.exists():
+        return None
+    try:
+        with open(EMISSIONS_STATE_JSON, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_emission_state(state: Dict[str, str]):
+    """投入済みのフィンガープリントを保存"""
+    tmp_path = EMISSIONS_STATE_JSON.with_suffix('.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, EMISSIONS_STATE_JSON)
+
+
+def diff_emissions(rows: List[Dict], state: Dict[str, str]) -> Tuple[List[Dict], List[Dict], List[str]]:
+    """
+    今回の行と投入済みフィンガープリントを比較
+
+    削除は今回パースできた自治体の範囲に限る（Excelがなくパースされなかった
+    自治体の行は消さない）。
+
+    Args:
+        rows: build_emission_rows() の戻り値
+        state: キー -> フィンガープリント の辞書
+
+    Returns:
+        (追加する行, 更新する行, 削除するキー)
+    """
+    inserts = []
+    updates = []
+    seen = set()
+    city_codes = set()
+    for row in rows:
+        key = emission_key(row['city_code'], row['fiscal_year'], row['sector'])
+        seen.add(key)
+        city_codes.add(row['city_code'])
+        previous = state.get(key)
+        if previous is None:
+            inserts.append(row)
+        elif previous != emission_fingerprint(row['value_kt_co2']):
+            updates.append(row)
+
+    deletes = [
+        key for key in state
+        if key not in seen and key.split('|', 1)[0] in city_codes
+    ]
+    return inserts, updates, deletes
+
+
+def delete_emissions(supabase: Client, keys: List[str]):
+    """キーで指定した排出量の行を削除（自治体・部門ごとにまとめて1リクエスト）"""
+    grouped = {}
+    for key in keys:
+        city_code, fiscal_year, sector = key.split('|', 2)
+        grouped.setdefault((city_code, sector), []).append(int(fiscal_year))
+
+    for (city_code, sector), years in grouped.items():
+        supabase.table('emissions').delete()\
+            .eq('city_code', city_code)\
+            .eq('sector', sector)\
+            .in_('fiscal_year', sorted(years))\
+            .execute()
+
+
+def seed_emissions(supabase: Client, cube: EmissionsCube,
+                   state: Optional[Dict[str, str]] = None,
+                   workers: int = DEFAULT_WORKERS) -> Dict:
+    """
+    排出量データを投入
+
+    Args:
+        supabase: Supabaseクライアント
+        cube: 排出量キューブ
+        state: 投入済みのフィンガープリント（Noneなら全件upsert）
+        workers: 同時リクエスト数
+
+    Returns:
+        upload_batches() の統計
+    """
+    print("\n排出量データを投入中...")
+
+    all_emissions = build_emission_rows(cube)
+
+    if state is None:
+        inserts, updates, deletes = all_emissions, [], []
+        state = {}
+    else:
+        inserts, updates, deletes = diff_emissions(all_emissions, state)
+
+    print(f"  追加 {len(inserts)} / 更新 {len(updates)} / 削除 {len(deletes)} / "
+          f"変更なし {len(all_emissions) - len(inserts) - len(updates)}")
+
+    # バッチ投入（1000件ずつ、主キー順に並列送信）
+    changed = inserts + updates
+    stats = upload_batches(supabase, 'emissions', changed, batch_size=1000, workers=workers,
+                           on_conflict='city_code,fiscal_year,sector',
+                           sort_keys=EMISSIONS_KEY_COLUMNS,
+                           dead_letter_path=EMISSIONS_DEAD_LETTER)
+    print_upload_stats(stats)
+    if deletes:
+        delete_emissions(supabase, deletes)
+
+    # 投入に失敗した行は次回も差分として扱う
+    failed = {
+        emission_key(row['city_code'], row['fiscal_year'], row['sector'])
+        for row in stats['failed_rows']
+    }
+    for row in changed:
+        key = emission_key(row['city_code'], row['fiscal_year'], row['sector'])
+        if key not in failed:
+            state[key] = emission_fingerprint(row['value_kt_co2'])
+    for key in deletes:
+        state.pop(key, None)
+    save_emission_state(state)
+
+    print(f"✓ {stats['rows']} 件の排出量データを投入、{len(deletes)} 件を削除")
+    if failed:
+        print(f"[ERROR] {len(failed)} 件の投入に失敗しました: {EMISSIONS_DEAD_LETTER}")
+        print("  --replay-dead-letter で再送できます")
+    return stats
+
+
+def seed_emissions_copy(cube: EmissionsCube) -> Dict:
+    """
+    排出量データを COPY で一括投入（PostgreSQLに直接接続、psycopg2 が必要）
+
+    全行を一時テーブルに流し込み、値が変わった行だけを1トランザクションでマージする。
+    差分の判定はDB側で行うので、投入後は全行のフィンガープリントを保存し直す。
+
+    Args:
+        cube: 排出量キューブ
+
+    Returns:
+        bulk_copy.copy_emissions() の結果
+    """
+    print("\n排出量データを COPY で投入中...")
+
+    all_emissions = build_emission_rows(cube)
+    conn = bulk_copy.connect()
+    try:
+        result = bulk_copy.copy_emissions(conn, all_emissions)
+    finally:
+        conn.close()
+
+    save_emission_state({
+        emission_key(row['city_code'], row['fiscal_year'], row['sector']):
+            emission_fingerprint(row['value_kt_co2'])
+        for row in all_emissions
+    })
+    print(f"  {result['rows']:,} 行 / {result['bytes'] / 1024:,.0f} KB / {result['seconds']:.2f}s "
+          f"({result['rows'] / max(result['seconds'], 1e-9):,.0f} 行/秒、"
+          f"COPY {result['copy_seconds']:.2f}s・マージ {result['merge_seconds']:.2f}s)")
+    print(f"✓ {result['upserted']} 件を追加・更新、{result['deleted']} 件を削除")
+    return result
+
+
+def compare_load_methods(supabase: Client, cube: EmissionsCube,
+                         workers: int = DEFAULT_WORKERS) -> Dict[str, Dict]:
+    """
+    PostgRESTの全件upsertとCOPYを同じ開始状態から実行して所要時間を比較
+
+    どちらの方法も、投入する自治体の排出量を空にしてから全行を投入する
+    （先に実行した方法の結果に対して後の方法が何もしないマージになるのを防ぐ）。
+    空にする時間は計測に含めない。
+
+    Args:
+        supabase: Supabaseクライアント
+        cube: 排出量キューブ
+        workers: 同時リクエスト数
+
+    Returns:
+        投入方法 -> {'rows', 'seconds', ...}
+    """
+    load_times = {}
+    conn = bulk_copy.connect()
+    try:
+        deleted = bulk_copy.clear_emissions(conn, cube.city_codes)
+        print(f"\n比較のため {cube.n_cities} 自治体の排出量 {deleted:,} 行を削除")
+        with metrics.span('emissions') as span:
+            stats = seed_emissions(supabase, cube, None, workers)
+            span.update(rows=stats['rows'], bytes=stats['bytes'])
+        load_times['postgrest'] = {'rows': stats['rows'], 'seconds': stats['elapsed']}
+
+        deleted = bulk_copy.clear_emissions(conn, cube.city_codes)
+        print(f"\n比較のため {cube.n_cities} 自治体の排出量 {deleted:,} 行を削除")
+    finally:
+        conn.close()
+    with metrics.span('emissions_copy') as span:
+        result = seed_emissions_copy(cube)
+        span.update(rows=result['rows'], bytes=result['bytes'])
+    load_times['copy'] = result
+    return load_times
+
+
+def build_municipality_kpi_rows(cube: EmissionsCube, rank: bool = True) -> List[Dict]:
+    """
+    基準年・最新年の排出量がある自治体のKPIを計算して municipality_kpis の行を作成
+
+    Args:
+        cube: 排出量キューブ
+        rank: 偏差値・順位も計算するか（キューブが全国の一部の場合は False にして、
+              全自治体の行が揃ってから assign_deviation_and_ranks() を呼ぶ）
+    """
+    # 基準年と最新年の総排出量（キューブの年度合計スライス）
+    base_totals = cube.totals(BASE_YEAR)
+    latest_totals = cube.totals(LATEST_YEAR)
+    valid = (base_totals != 0) & (latest_totals != 0)
+
+    city_codes = [code for code, ok in zip(cube.city_codes, valid.tolist()) if ok]
+    base_emissions = base_totals[valid].tolist()
+    latest_emissions = latest_totals[valid].tolist()
+
+    # KPI計算（全自治体を一括）
+    kpis = calc_kpis_batch(base_emissions, latest_emissions, BASE_YEAR, LATEST_YEAR,
+                           TARGET_REDUCTION_RATE)
+
+    kpis_data = []
+    for i, city_code in enumerate(city_codes):
         kpis_data.append({
             'city_code': city_code,
             'base_year': BASE_YEAR,
             'latest_year': LATEST_YEAR,
-            'base_emission_kt': base_emission,
-            'latest_emission_kt': latest_emission,
-            'reduction_rate': reduction_rate,
-            'actual_pace': actual_pace,
-            'required_pace': required_pace,
-            'pace_achievement_rate': pace_achievement_rate,
-            'status': status,
-            'shortfall_2030_kt': shortfall,
+            'base_emission_kt': base_emissions[i],
+            'latest_emission_kt': latest_emissions[i],
+            'reduction_rate': float(kpis['reduction_rate'][i]),
+            'actual_pace': float(kpis['actual_pace'][i]),
+            'required_pace': float(kpis['required_pace'][i]),
+            'pace_achievement_rate': float(kpis['pace_achievement_rate'][i]),
+            'status': str(kpis['status'][i]),
+            'shortfall_2030_kt': float(kpis['shortfall_2030'][i]),
             'emission_per_capita': None,  # 人口データが必要
             'deviation_score': None,  # 後で計算
             'pref_rank': None,  # 後で計算
-            'national_rank': None
+            'national_rank': None  # 後で計算
         })
 
-        reduction_rates.append(abs(reduction_rate))
+    if rank:
+        assign_deviation_and_ranks(kpis_data)
+    return kpis_data
 
-    # 偏差値を計算
-    for kpi in kpis_data:
-        deviation = calc_deviation_score(reduction_rates, abs(kpi['reduction_rate']))
+
+def assign_deviation_and_ranks(kpis_data: List[Dict]):
+    """自治体KPIの行に偏差値（削減率の絶対値）と順位（ペース達成率順、都道府県内と全国）を設定"""
+    if not kpis_data:
+        return
+    reduction_rates = np.abs([kpi['reduction_rate'] for kpi in kpis_data])
+    pace = np.array([kpi['pace_achievement_rate'] for kpi in kpis_data])
+    prefectures = [kpi['city_code'][:2] for kpi in kpis_data]
+
+    deviation_scores = calc_deviation_scores(reduction_rates).tolist()
+    pref_ranks = calc_ranks(pace, prefectures).tolist()
+    national_ranks = calc_ranks(pace).tolist()
+    for kpi, deviation, pref_rank, national_rank in zip(kpis_data, deviation_scores,
+                                                         pref_ranks, national_ranks):
         kpi['deviation_score'] = deviation
+        kpi['pref_rank'] = pref_rank
+        kpi['national_rank'] = national_rank
+
 
-    # ランキングを計算（ペース達成率順）
-    kpis_data_sorted = sorted(kpis_data, key=lambda x: x['pace_achievement_rate'], reverse=True)
-    for rank, kpi in enumerate(kpis_data_sorted, 1):
-        kpi['pref_rank'] = rank
+def build_seed_prefecture_kpi_rows(cube: EmissionsCube, municipality_kpis: List[Dict]) -> List[Dict]:
+    """排出量キューブと自治体KPI（ステータス件数用）から prefecture_kpis の行を作成"""
+    # 自治体ステータスは投入した自治体KPIから数える（DBから読み直さない）
+    status_by_city = {kpi['city_code']: kpi['status'] for kpi in municipality_kpis}
+    return build_prefecture_kpis(
+        cube.city_codes,
+        cube.totals(BASE_YEAR),
+        cube.totals(LATEST_YEAR),
+        [status_by_city.get(code) for code in cube.city_codes],
+        BASE_YEAR, LATEST_YEAR, TARGET_REDUCTION_RATE
+    )
+
+
+def seed_municipality_kpis(supabase: Client, cube: EmissionsCube) -> List[Dict]:
+    """自治体KPIを計算・投入（投入した行を返す）"""
+    print("\n自治体KPIを計算・投入中...")
+
+    kpis_data = build_municipality_kpi_rows(cube)
 
     # 投入
     result = supabase.table('municipality_kpis').upsert(kpis_data).execute()
     print(f"✓ {len(kpis_data)} 件の自治体KPIを投入")
+    return kpis_data
 
 
-def seed_prefecture_kpi(supabase: Client, emissions_data: List[Dict]):
-    """都道府県KPIを集計・投入"""
+def seed_prefecture_kpis(supabase: Client, cube: EmissionsCube, municipality_kpis: List[Dict]):
+    """
+    全都道府県のKPIを集計・投入
+
+    Args:
+        supabase: Supabaseクライアント
+        cube: 排出量キューブ
+        municipality_kpis: seed_municipality_kpis() で投入した自治体KPI（ステータス件数用）
+    """
     print("\n都道府県KPIを集計・投入中...")
 
-    # 全自治体の合計を計算
-    total_base = 0.0
-    total_latest = 0.0
-
-    for muni_data in emissions_data:
-        emissions_by_sector = muni_data['emissions']
-        total_base += calc_total_emission(emissions_by_sector, BASE_YEAR)
-        total_latest += calc_total_emission(emissions_by_sector, LATEST_YEAR)
-
-    # 千t → 百万t に変換
-    base_mt = round(total_base / 1000, 2)
-    latest_mt = round(total_latest / 1000, 2)
-
-    # KPI計算
-    reduction_rate = calc_reduction_rate(total_base, total_latest)
-    actual_pace = calc_actual_pace(total_base, total_latest, BASE_YEAR, LATEST_YEAR)
-    required_pace = calc_required_pace(total_base, TARGET_REDUCTION_RATE, BASE_YEAR)
-    pace_achievement_rate = calc_pace_achievement_rate(actual_pace, required_pace)
-    shortfall_mt = round(calc_shortfall_2030(total_base, actual_pace, BASE_YEAR) / 1000, 2)
-    status = determine_status(pace_achievement_rate)
-
-    # 自治体ステータスカウント
-    kpis_result = supabase.table('municipality_kpis').select('status').execute()
-    status_counts = {'on-track': 0, 'at-risk': 0, 'off-track': 0}
-    for kpi in kpis_result.data:
-        status_counts[kpi['status']] += 1
-
-    pref_data = {
-        'prefecture_code': '13',
-        'prefecture_name': '東京都',
-        'prefecture_slug': 'tokyo',
-        'latest_year': LATEST_YEAR,
-        'base_emission_mt': base_mt,
-        'latest_emission_mt': latest_mt,
-        'reduction_rate': reduction_rate,
-        'actual_pace': actual_pace,
-        'required_pace': required_pace,
-        'pace_achievement_rate': pace_achievement_rate,
-        'status': status,
-        'shortfall_2030_mt': shortfall_mt,
-        'municipality_count': len(emissions_data),
-        'on_track_count': status_counts['on-track'],
-        'at_risk_count': status_counts['at-risk'],
-        'off_track_count': status_counts['off-track'],
-        'national_rank': None
-    }
+    pref_data = build_seed_prefecture_kpi_rows(cube, municipality_kpis)
 
-    result = supabase.table('prefecture_kpis').upsert([pref_data]).execute()
-    print(f"✓ 東京都の集計KPIを投入")
+    # 全都道府県を1回でupsert
+    result = supabase.table('prefecture_kpis').upsert(pref_data).execute()
+    names = '・'.join(row['prefecture_name'] for row in pref_data[:3])
+    print(f"✓ {len(pref_data)} 都道府県の集計KPIを投入（{names}{' 他' if len(pref_data) > 3 else ''}）")
+
+
+def seed_streaming(supabase: Client, records: Iterable[Dict],
+                   steps: Sequence[str] = SEED_STEPS,
+                   workers: int = DEFAULT_WORKERS):
+    """
+    パース結果を都道府県ごとに読み込みながら排出量・KPIを投入
+
+    排出量は都道府県ごとにキューブを作って展開・送信し、次の都道府県に進む前に破棄する。
+    全国で計算する偏差値・順位・都道府県KPIのために残すのは、自治体ごとのKPI行と
+    基準年・最新年の合計だけなので、メモリ使用量は自治体数によらずほぼ一定になる。
+    差分検出用のフィンガープリント（全行分）は使わず、排出量は全件upsertする。
+
+    Args:
+        supabase: Supabaseクライアント
+        records: 団体コード順のパース結果（iter_emissions_ndjson() など）
+        steps: 実行するステップ（emissions / kpis）
+        workers: 同時リクエスト数
+    """
+    print("\n都道府県ごとに排出量を投入・KPIを計算中...")
+    kpis_data = []
+    city_codes = []
+    base_totals = []
+    latest_totals = []
+    total = {'rows': 0, 'bytes': 0, 'failed_batches': 0}
+
+    for chunk in iter_prefecture_chunks(records):
+        code = chunk[0]['city_code'][:2]
+        cube = EmissionsCube.from_records(chunk)
+        line = f"  {code}: {cube.n_cities} 自治体"
+        if 'emissions' in steps:
+            with metrics.span('emissions', prefecture_code=code) as span:
+                stats = upload_batches(supabase, 'emissions', build_emission_rows(cube), batch_size=1000,
+                                       workers=workers, on_conflict='city_code,fiscal_year,sector',
+                                       sort_keys=EMISSIONS_KEY_COLUMNS,
+                                       dead_letter_path=EMISSIONS_DEAD_LETTER)
+                span.update(rows=stats['rows'], bytes=stats['bytes'], retries=stats['retries'])
+            for key in total:
+                total[key] += stats[key]
+            line += f" / {stats['rows']:,} 行 ({stats['elapsed']:.2f}s)"
+        kpis_data.extend(build_municipality_kpi_rows(cube, rank=False))
+        city_codes.extend(cube.city_codes)
+        base_totals.extend(cube.totals(BASE_YEAR).tolist())
+        latest_totals.extend(cube.totals(LATEST_YEAR).tolist())
+        peak = metrics.peak_rss_mb()
+        print(line + (f" / ピークRSS {peak:.0f}MB" if peak is not None else ''))
+
+    if 'emissions' in steps:
+        # フィンガープリントを更新していないので、次回の差分投入ではDBから取り直す
+        if EMISSIONS_STATE_JSON.exists():
+            EMISSIONS_STATE_JSON.unlink()
+        print(f"✓ {total['rows']:,} 件の排出量データを投入（{total['bytes'] / 1024:,.0f} KB）")
+        if total['failed_batches']:
+            print(f"[ERROR] {total['failed_batches']} バッチの投入に失敗しました: {EMISSIONS_DEAD_LETTER}")
+            print("  --replay-dead-letter で再送できます")
+
+    if 'kpis' in steps:
+        assign_deviation_and_ranks(kpis_data)
+        with metrics.span('municipality_kpis', rows=len(kpis_data)):
+            supabase.table('municipality_kpis').upsert(kpis_data).execute()
+        print(f"✓ {len(kpis_data)} 件の自治体KPIを投入")
+
+        status_by_city = {kpi['city_code']: kpi['status'] for kpi in kpis_data}
+        pref_data = build_prefecture_kpis(
+            city_codes, base_totals, latest_totals,
+            [status_by_city.get(code) for code in city_codes],
+            BASE_YEAR, LATEST_YEAR, TARGET_REDUCTION_RATE
+        )
+        with metrics.span('prefecture_kpis', rows=len(pref_data)):
+            supabase.table('prefecture_kpis').upsert(pref_data).execute()
+        print(f"✓ {len(pref_data)} 都道府県の集計KPIを投入")
+
+
+def parse_args() -> argparse.Namespace:
+    """コマンドライン引数を解析"""
+    parser = argparse.ArgumentParser(description="パース済みデータをSupabaseに投入")
+    parser.add_argument('--full', action='store_true',
+                        help="差分検出をせず排出量を全件upsert")
+    parser.add_argument('--refresh-state', action='store_true',
+                        help="ローカルのフィンガープリントを使わずDBから取得し直す")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"排出量投入の同時リクエスト数（デフォルト{DEFAULT_WORKERS}）")
+    parser.add_argument('--replay-dead-letter', action='store_true',
+                        help="前回投入に失敗したバッチを再送して終了")
+    parser.add_argument('--steps', nargs='+', choices=SEED_STEPS, default=list(SEED_STEPS),
+                        help="実行するステップ（デフォルトは全ステップ）")
+    parser.add_argument('--stream', action='store_true',
+                        help="tokyo_emissions.ndjson を都道府県ごとに読み込んで投入（メモリ使用量が自治体数によらない）")
+    parser.add_argument('--load-method', choices=LOAD_METHODS, default='postgrest',
+                        help="排出量の投入方法（copy: SUPABASE_DB_URL にCOPYで一括投入 / "
+                             "compare: 対象自治体の排出量を空にしてからPostgREST全件upsertとCOPYを"
+                             "それぞれ実行して時間を比較）")
+    metrics.add_metrics_args(parser)
+    args = parser.parse_args()
+
+    if args.stream and args.load_method != 'postgrest':
+        # ストリーム投入はPostgRESTで都道府県ごとに送るため、COPY・比較には対応しない
+        parser.error("--stream と --load-method copy / compare は同時に指定できません")
+    return args
 
 
 def main():
     """メイン処理"""
+    args = parse_args()
+    metrics.start_run('seed_supabase', args)
+
     print("=" * 60)
     print("Supabaseデータ投入スクリプト")
     print("=" * 60)
 
+    if args.replay_dead_letter:
+        # 再送はデッドレターの行だけを使う（排出量データの読み込みは不要）
+        if not EMISSIONS_DEAD_LETTER.exists():
+            print("再送するバッチはありません")
+            return
+        supabase = get_client()
+        print(f"\n{EMISSIONS_DEAD_LETTER} を再送中...")
+        with metrics.span('replay_dead_letter') as span:
+            stats = replay_dead_letters(supabase, EMISSIONS_DEAD_LETTER, args.workers)
+            span.update(rows=stats['rows'], bytes=stats['bytes'], retries=stats['retries'])
+        print_upload_stats(stats)
+        return
+
     # データ読み込み
     print("\nデータ読み込み中...")
     muni_info = load_municipality_info()
 
-    if not EMISSIONS_JSON.exists():
-        print(f"[ERROR] {EMISSIONS_JSON} が見つかりません")
-        print("先に parse_excels.py を実行してください")
-        return
+    if args.stream and not EMISSIONS_NDJSON.exists():
+        print(f"[ERROR] {EMISSIONS_NDJSON} が見つかりません")
+        print("先に parse_excels.py --format ndjson を実行してください")
+        sys.exit(1)
 
-    with open(EMISSIONS_JSON, 'r', encoding='utf-8') as f:
-        emissions_data = json.load(f)
+    cube = None
+    if not args.stream and set(args.steps) - {'municipalities'}:
+        # JSON・Parquet・NDJSONのうち最も新しいファイルから排出量キューブを構築
+        with metrics.span('load_emissions') as span:
+            cube = load_emissions_cube()
+            span['rows'] = cube.n_cities if cube is not None else 0
+        if cube is None:
+            print(f"[ERROR] {EMISSIONS_JSON} / {EMISSIONS_PARQUET} / {EMISSIONS_NDJSON} が見つかりません")
+            print("先に parse_excels.py を実行してください")
+            sys.exit(1)
 
-    print(f"✓ {len(emissions_data)} 自治体のデータを読み込み")
+        print(f"✓ {cube.n_cities} 自治体 × {len(cube.years)} 年度 × {len(cube.sectors)} 部門のデータを読み込み")
 
     # Supabase接続
-    supabase = get_supabase_client()
+    supabase = get_client()
     print("✓ Supabaseに接続")
 
     # データ投入
-    seed_municipalities(supabase, muni_info)
-    seed_emissions(supabase, emissions_data)
-    seed_municipality_kpis(supabase, emissions_data)
-    seed_prefecture_kpi(supabase, emissions_data)
+    if 'municipalities' in args.steps:
+        with metrics.span('municipalities', rows=len(muni_info)):
+            seed_municipalities(supabase, muni_info)
+
+    if args.stream:
+        seed_streaming(supabase, iter_emissions_ndjson(EMISSIONS_NDJSON), args.steps, args.workers)
+    elif 'emissions' in args.steps and args.load_method == 'compare':
+        bulk_copy.print_load_comparison(compare_load_methods(supabase, cube, args.workers))
+    elif 'emissions' in args.steps and args.load_method == 'copy':
+        with metrics.span('emissions_copy') as span:
+            result = seed_emissions_copy(cube)
+            span.update(rows=result['rows'], bytes=result['bytes'])
+    elif 'emissions' in args.steps:
+        # 差分投入用のフィンガープリント（ローカルになければDBから取得）
+        state = None
+        if not args.full:
+            state = None if args.refresh_state else load_emission_state()
+            if state is None:
+                print("\n投入済み排出量をDBから取得中...")
+                with metrics.span('fetch_emission_state') as span:
+                    state = fetch_emission_state(supabase)
+                    span['rows'] = len(state)
+                print(f"✓ {len(state)} 件")
+
+        with metrics.span('emissions'):
+            seed_emissions(supabase, cube, state, args.workers)
+
+    if 'kpis' in args.steps and not args.stream:
+        with metrics.span('municipality_kpis') as span:
+            municipality_kpis = seed_municipality_kpis(supabase, cube)
+            span['rows'] = len(municipality_kpis)
+        with metrics.span('prefecture_kpis'):
+            seed_prefecture_kpis(supabase, cube, municipality_kpis)
 
     print("\n" + "=" * 60)
     print("✓ すべてのデータ投入が完了しました")
@@ -273,4 +606,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        metrics.finish()
@@ -2,10 +2,7 @@
 """
 狛江市(13219)と羽村市(13227)の2自治体のKPIとemissionsデータを投入
 """
-import json
-import os
-from supabase import create_client
-from dotenv import load_dotenv
+from emissions_cube import load_emissions_cube
 from kpi_calculator import (
     calc_actual_pace,
     calc_required_pace,
@@ -14,17 +11,12 @@ from kpi_calculator import (
     calc_reduction_rate,
     determine_status
 )
+from db import get_client, upsert_batches
 
-# 環境変数読み込み
-load_dotenv()
-supabase = create_client(os.getenv('NEXT_PUBLIC_SUPABASE_URL'), os.getenv('SUPABASE_SERVICE_ROLE_KEY'))
+supabase = get_client()
 
-# パース済みデータ読み込み（配列形式）
-with open('../data/processed/tokyo_emissions.json', 'r', encoding='utf-8') as f:
-    all_data = json.load(f)
-
-# 辞書形式に変換
-data_by_code = {item['city_code']: item for item in all_data}
+# パース済みデータから排出量キューブを構築（JSON・Parquet・NDJSONのうち最も新しいファイル）
+cube = load_emissions_cube()
 
 # 対象の2自治体のみ処理
 target_codes = ['13219', '13227']
@@ -32,30 +24,20 @@ target_codes = ['13219', '13227']
 print("=== 狛江市・羽村市のKPI・排出量データ投入 ===\n")
 
 for city_code in target_codes:
-    if city_code not in data_by_code:
+    if cube is None or city_code not in cube.city_index:
         print(f'❌ {city_code}: データが見つかりません')
         continue
 
-    city_data = data_by_code[city_code]
-    print(f"\n処理中: {city_code} {city_data['city_name']}")
+    city_name = cube.city_names[cube.city_index[city_code]]
+    print(f"\n処理中: {city_code} {city_name}")
 
     # ========== KPIデータ投入 ==========
 
-    emissions_data = city_data.get('emissions', {})
-
-    # 基準年(2013)と最新年(2021)の総排出量を計算
-    # 構造: emissions[sector][year] = value
-    def calc_total_emission(year_str):
-        total = 0
-        for sector, years_data in emissions_data.items():
-            if year_str in years_data:
-                total += years_data[year_str]
-        return total if total > 0 else None
-
-    base_emission = calc_total_emission('2013')
-    latest_emission = calc_total_emission('2021')
+    # 基準年(2013)と最新年(2021)の総排出量（丸めなし）
+    base_emission = cube.city_total(city_code, 2013, rounded=False)
+    latest_emission = cube.city_total(city_code, 2021, rounded=False)
 
-    if not base_emission or not latest_emission:
+    if base_emission <= 0 or latest_emission <= 0:
         print(f'  ❌ 排出量データが不完全です')
         continue
 
@@ -95,28 +77,14 @@ for city_code in target_codes:
 
     # ========== 排出量データ投入 ==========
 
-    emissions_records = []
-
-    # 構造: emissions[sector][year] = value
-    for sector, years_data in emissions_data.items():
-        for year_str, value in years_data.items():
-            try:
-                fiscal_year = int(year_str)
-                emissions_records.append({
-                    'city_code': city_code,
-                    'fiscal_year': fiscal_year,
-                    'sector': sector,
-                    'value_kt_co2': round(value, 3)
-                })
-            except (ValueError, TypeError):
-                pass
+    emissions_records = [
+        {**row, 'value_kt_co2': round(row['value_kt_co2'], 3)}
+        for row in cube.iter_rows([city_code])
+    ]
 
     # バッチ投入
     if emissions_records:
-        BATCH_SIZE = 100
-        for i in range(0, len(emissions_records), BATCH_SIZE):
-            batch = emissions_records[i:i+BATCH_SIZE]
-            supabase.table('emissions').upsert(batch).execute()
+        upsert_batches(supabase, 'emissions', emissions_records, batch_size=100)
         print(f'  ✅ 排出量データ投入完了 ({len(emissions_records)}件)')
 
 print("\n=== 投入完了 ===")
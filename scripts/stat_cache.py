@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+統計局 .xls ファイルのParquetキャッシュ
+
+xlrd による .xls の読み込みは遅いため、初回にシートを変換して
+data/processed/stat_cache/ に保存し、2回目以降はParquetから読み込む。
+元ファイルのサイズ・mtime（変わっていれば内容ハッシュ）で照合し、
+変更があればキャッシュを作り直す。
+
+    python stat_cache.py            # 既知のシートを変換
+    python stat_cache.py --rebuild  # キャッシュを作り直す
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence
+import numpy as np
+import pandas as pd
+
+# 設定
+DATA_DIR = Path(__file__).parent.parent / "data"
+PROCESSED_DIR = DATA_DIR / "processed"
+STAT_CACHE_DIR = PROCESSED_DIR / "stat_cache"
+STAT_CACHE_MANIFEST = STAT_CACHE_DIR / "manifest.json"
+# 変換処理を変更したら上げる（古いキャッシュを無効化）
+STAT_CACHE_VERSION = 2
+# 数値と文字列が混在する列の数値部分を保存する列名の接尾辞
+NUMERIC_PART_SUFFIX = '.num'
+
+POPULATION_XLS = DATA_DIR / "population_households_2022.xls"
+AREA_XLS = DATA_DIR / "natural_environment_2022.xls"
+
+# データ開始行（10行目以降）
+DATA_START_ROW = 10
+# 人口・世帯ファイル（シートA）の列
+POP_SHEET = 'A'
+POP_CODE_COL = 32      # 団体コード
+POP_NAME_COL = 8       # 市区町村名
+POP_2020_COL = 13      # 2020年住民基本台帳人口
+POP_2015_COL = 10      # 2015年国勢調査人口（2020年が欠損の場合の代替）
+# 自然環境ファイル（シートB）の列
+AREA_SHEET = 'B'
+AREA_CODE_COL = 12     # 団体コード
+AREA_COL = 10          # 総面積
+
+
+def file_sha256(file_path: Path) -> str:
+    """ファイル内容のSHA-256を計算"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_path: Optional[Path] = None) -> Dict[str, Dict]:
+    """キャッシュ名 -> 元ファイル情報 の辞書を読み込み（壊れている場合は空）"""
+    manifest_path = manifest_path or STAT_CACHE_MANIFEST
+    if not manifest_path.exists():
+        return {}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def save_manifest(manifest: Dict[str, Dict], manifest_path: Optional[Path] = None):
+    """マニフェストを一時ファイル経由で書き出し"""
+    manifest_path = manifest_path or STAT_CACHE_MANIFEST
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = manifest_path.with_suffix('.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def _is_fresh(entry: Optional[Dict], source_path: Path, manifest: Dict[str, Dict]) -> bool:
+    """
+    キャッシュが元ファイルと一致するか
+
+    サイズ・mtimeが一致すればハッシュ計算を省略し、
+    mtimeだけ変わった場合は内容ハッシュで照合する（一致すればmtimeを更新）。
+    """
+    if not entry or entry.get('version') != STAT_CACHE_VERSION:
+        return False
+    stat = source_path.stat()
+    if entry['size'] != stat.st_size:
+        return False
+    if entry['mtime_ns'] != stat.st_mtime_ns:
+        if entry['sha256'] != file_sha256(source_path):
+            return False
+        entry['mtime_ns'] = stat.st_mtime_ns
+        save_manifest(manifest)
+    return True
+
+
+def cached_frame(name: str, source_path: Path, build: Callable[[], pd.DataFrame],
+                 rebuild: bool = False) -> pd.DataFrame:
+    """
+    元ファイルから作るDataFrameをParquetにキャッシュして返す
+
+    Args:
+        name: キャッシュ名（stat_cache/{name}.parquet）
+        source_path: 元ファイル（変更されたらキャッシュを作り直す）
+        build: キャッシュがない場合にDataFrameを作る関数
+        rebuild: Trueならキャッシュを使わず作り直す
+
+    Returns:
+        DataFrame
+    """
+    cache_path = STAT_CACHE_DIR / f"{name}.parquet"
+    manifest = load_manifest()
+    if not rebuild and cache_path.exists() and _is_fresh(manifest.get(name), source_path, manifest):
+        return pd.read_parquet(cache_path)
+
+    df = build()
+    STAT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix('.parquet.tmp')
+    df.to_parquet(tmp_path, compression='zstd')
+    os.replace(tmp_path, cache_path)
+
+    stat = source_path.stat()
+    manifest = load_manifest()
+    manifest[name] = {
+        'version': STAT_CACHE_VERSION,
+        'source': source_path.name,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_sha256(source_path)
+    }
+    save_manifest(manifest)
+    return df
+
+
+def _cell_to_str(value) -> Optional[str]:
+    """セルの値を文字列に（整数値の数値は小数点なし、空セルはNone）"""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _is_number(value) -> bool:
+    """セルの値が数値か（文字列の '01100' などは数値として扱わない）"""
+    return isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_)) \
+        and not pd.isna(value)
+
+
+def _restore_number(value: float):
+    """混在列の数値を pd.read_excel と同じ型に戻す（整数値は int）"""
+    return int(value) if float(value).is_integer() else float(value)
+
+
+def read_excel_cached(source_path: Path, sheet_name, rebuild: bool = False,
+                      text_columns: Sequence[int] = ()) -> pd.DataFrame:
+    """
+    シートをヘッダーなし（header=None 相当）で読み込み
+
+    セルの型は pd.read_excel(header=None) と同じになるように保存する。
+    数値だけの列はそのままの数値型、文字列を含む列は文字列のセルと数値のセルを
+    別々の列に保存して読み込み時に組み合わせる（文字列の '01100' は文字列のまま、
+    数値のセルは数値のまま）。団体コードなどの列は text_columns で指定すると、
+    数値で入力されたセルも含めて文字列にする。
+    列名は pd.read_excel(header=None) と同じく 0 始まりの整数。
+
+    Args:
+        source_path: 元の .xls / .xlsx
+        sheet_name: シート名または番号
+        rebuild: Trueならキャッシュを使わず作り直す
+        text_columns: 文字列として読み込む列の番号
+    """
+    text_columns = sorted(set(text_columns))
+
+    def build() -> pd.DataFrame:
+        # 文字列の '01100' が数値に変換されないよう、コード列は型推論せずに読む
+        raw = pd.read_excel(source_path, sheet_name=sheet_name, header=None,
+                            converters={col: _cell_to_str for col in text_columns} or None)
+        columns = {}
+        for col in raw.columns:
+            values = raw[col]
+            if col in text_columns:
+                columns[str(col)] = values.map(_cell_to_str).astype(object)
+                continue
+            if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+                columns[str(col)] = values
+                continue
+            numbers = values.map(_is_number).astype(bool)
+            columns[str(col)] = values.where(~numbers).map(_cell_to_str).astype(object)
+            if numbers.any():
+                columns[f"{col}{NUMERIC_PART_SUFFIX}"] = pd.to_numeric(
+                    values.where(numbers), errors='coerce').astype('float64')
+        return pd.DataFrame(columns)
+
+    name = f"{source_path.stem}.{sheet_name}.raw"
+    if text_columns:
+        name += '.text-' + '-'.join(str(col) for col in text_columns)
+    cached = cached_frame(name, source_path, build, rebuild)
+
+    df = pd.DataFrame(index=cached.index)
+    for col in cached.columns:
+        if col.endswith(NUMERIC_PART_SUFFIX):
+            continue
+        values = cached[col]
+        numeric_col = f"{col}{NUMERIC_PART_SUFFIX}"
+        if numeric_col in cached.columns:
+            numbers = pd.Series([None if pd.isna(value) else _restore_number(value)
+                                 for value in cached[numeric_col]], index=cached.index, dtype=object)
+            values = values.astype(object).where(numbers.isna(), numbers)
+        df[int(col)] = values
+    return df
+
+
+def with_header(raw: pd.DataFrame, header_row: int) -> pd.DataFrame:
+    """header=None で読んだシートを pd.read_excel(header=header_row) 相当に変換"""
+    df = raw.iloc[header_row + 1:].reset_index(drop=True)
+    df.columns = [str(value) if value is not None else f"Unnamed: {i}"
+                  for i, value in enumerate(raw.iloc[header_row].tolist())]
+    return df
+
+
+def extract_coded_rows(raw: pd.DataFrame, code_col: int) -> pd.DataFrame:
+    """
+    データ開始行以降のうち、団体コード（5桁）のある行を抽出（city_code 列を追加）
+
+    数値で入力されて先頭の0が落ちたコード（1100 など4桁）は0を補う。
+    """
+    data = raw.iloc[DATA_START_ROW:].copy()
+    data['city_code'] = data[code_col].map(_cell_to_str).fillna('').str.strip() \
+        .str.replace(r'^(\d{4})$', r'0\1', regex=True)
+    return data[data['city_code'].str.fullmatch(r'\d{5}', na=False)]
+
+
+def load_population_table(source_path: Path = POPULATION_XLS, rebuild: bool = False) -> pd.DataFrame:
+    """
+    人口データ（団体コードをインデックスとする型付きの表）
+
+    Returns:
+        index: city_code / name / population_2020 / population_2015（float64、欠損はNaN）
+    """
+    def build() -> pd.DataFrame:
+        raw = read_excel_cached(source_path, POP_SHEET, rebuild, text_columns=[POP_CODE_COL])
+        rows = extract_coded_rows(raw, POP_CODE_COL)
+        return pd.DataFrame({
+            'name': rows[POP_NAME_COL].map(_cell_to_str).fillna('').str.strip().astype(object),
+            'population_2020': pd.to_numeric(rows[POP_2020_COL], errors='coerce').astype('float64'),
+            'population_2015': pd.to_numeric(rows[POP_2015_COL], errors='coerce').astype('float64')
+        }).set_index(rows['city_code'].rename('city_code'))
+
+    return cached_frame(f"{source_path.stem}.population", source_path, build, rebuild)
+
+
+def load_area_table(source_path: Path = AREA_XLS, rebuild: bool = False) -> pd.DataFrame:
+    """
+    面積データ（団体コードをインデックスとする型付きの表、重複は先頭を採用）
+
+    Returns:
+        index: city_code / area_km2（float64、欠損はNaN）
+    """
+    def build() -> pd.DataFrame:
+        raw = read_excel_cached(source_path, AREA_SHEET, rebuild, text_columns=[AREA_CODE_COL])
+        rows = extract_coded_rows(raw, AREA_CODE_COL)
+        area = pd.DataFrame({
+            'area_km2': pd.to_numeric(rows[AREA_COL], errors='coerce').astype('float64')
+        }).set_index(rows['city_code'].rename('city_code'))
+        return area[~area.index.duplicated(keep='first')]
+
+    return cached_frame(f"{source_path.stem}.area", source_path, build, rebuild)
+
+
+def filter_prefectures(table: pd.DataFrame, prefectures: Optional[Sequence[str]]) -> pd.DataFrame:
+    """団体コードのインデックスを都道府県コードで絞り込む（Noneなら全国）"""
+    if prefectures is None:
+        return table
+    return table[table.index.str[:2].isin(list(prefectures))]
+
+
+def main():
+    """既知の .xls を変換してキャッシュ"""
+    parser = argparse.ArgumentParser(description="統計局 .xls をParquetキャッシュに変換")
+    parser.add_argument('--rebuild', action='store_true', help="キャッシュを作り直す")
+    args = parser.parse_args()
+
+    for label, loader, source_path in [('人口', load_population_table, POPULATION_XLS),
+                                       ('面積', load_area_table, AREA_XLS)]:
+        if not source_path.exists():
+            print(f"[SKIP] {label}: {source_path} が見つかりません")
+            continue
+        started = time.perf_counter()
+        table = loader(source_path, rebuild=args.rebuild)
+        print(f"[OK] {label}: {len(table)}件 ({time.perf_counter() - started:.3f}s)")
+
+    print(f"キャッシュ: {STAT_CACHE_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+scripts/ のテスト共通設定
+
+スクリプトはフラットなモジュールとして互いに import しているため、
+scripts/ を import パスに追加する。Supabaseを使うスクリプトは postgrest フィクスチャ
+（tests/postgrest_server.py のローカルサーバー）に対して実行し、
+create_schema.sql 自体は postgres_database フィクスチャ（pgserver）で確認する。
+"""
+import runpy
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent
+SCHEMA_SQL = SCRIPTS_DIR / 'create_schema.sql'
+sys.path.insert(0, str(SCRIPTS_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+
+@pytest.fixture(autouse=True)
+def isolated_metrics(tmp_path, monkeypatch):
+    """メトリクスは一時ファイルに書き（data/processed/metrics.jsonl に追記しない）、テストの終わりに計測を終える"""
+    import metrics
+
+    monkeypatch.setattr(metrics, 'METRICS_JSONL', tmp_path / 'metrics.jsonl')
+    yield
+    metrics.finish()
+
+
+@pytest.fixture
+def postgrest():
+    """テスト用のPostgREST互換サーバーを起動し、共有クライアントの接続先にする"""
+    import db
+    from postgrest_server import PostgrestServer
+
+    server = PostgrestServer()
+    db.use_endpoint(server.url)
+    yield server
+    db._client.postgrest.session.close()
+    db._client = None
+    server.close()
+
+
+@pytest.fixture
+def run_script(monkeypatch):
+    """scripts/ のスクリプトを引数付きで実行する関数（メトリクスは出力しない）"""
+    def run(name: str, *argv: str):
+        monkeypatch.setattr(sys, 'argv', [name, '--no-metrics', *argv])
+        runpy.run_path(str(SCRIPTS_DIR / name), run_name='__main__')
+    return run
+
+
+def load_schema() -> str:
+    """create_schema.sql からSupabase専用の部分（RLS・ポリシー）を除いたSQL"""
+    sql = SCHEMA_SQL.read_text(encoding='utf-8')
+    tables, _, rest = sql.partition('-- Row Level Security')
+    return tables + rest[rest.index('-- 5.'):]
+
+
+@pytest.fixture(scope='session')
+def postgres_database():
+    """
+    create_schema.sql を実行したPostgreSQLのDBを作る関数（pgserver、呼ぶたびに別のDB）
+
+    psycopg2 か pgserver がなければスキップする。
+    """
+    psycopg2 = pytest.importorskip('psycopg2')
+    pgserver = pytest.importorskip('pgserver')
+    server = pgserver.get_server(tempfile.mkdtemp(prefix='pgdata-'), cleanup_mode='delete')
+    databases = []
+
+    def create() -> str:
+        name = f"test{len(databases)}"
+        conn = psycopg2.connect(server.get_uri())
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"CREATE DATABASE {name}")
+        conn.close()
+        url = server.get_uri(name)
+        conn = psycopg2.connect(url)
+        with conn.cursor() as cursor:
+            cursor.execute(load_schema())
+        conn.commit()
+        conn.close()
+        databases.append(name)
+        return url
+
+    yield create
+    server.cleanup()
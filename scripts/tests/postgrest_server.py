@@ -0,0 +1,278 @@
+"""
+テスト用のPostgREST互換サーバー
+
+Supabaseの代わりにローカルで起動し、スクリプトが送るリクエストだけを処理する。
+本番と同じく1レスポンスあたり最大 max_rows 行（既定1000行）までしか返さないため、
+ページングしない取得は件数が切り詰められる。
+
+対応しているもの:
+    GET    select（JOIN: municipalities(...)）・order・limit・Range ヘッダー・フィルタ・
+           Prefer: count=exact（Content-Range に件数を返す）
+    POST   upsert（on_conflict、Prefer: resolution=merge-duplicates）
+    POST   /rpc/update_rows（create_schema.sql の update_rows()）
+    PATCH  フィルタに一致する行の一部カラムを更新
+    DELETE フィルタに一致する行を削除
+フィルタは eq / neq / in / like / gte / lte / gt / lt / is のみ。
+値が変わった行の updated_at は、create_schema.sql のトリガーと同じく書き込み時刻に更新する。
+"""
+import json
+import re
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+# テーブルの主キー（create_schema.sql と同じ）
+PRIMARY_KEYS = {
+    'municipalities': ('city_code',),
+    'emissions': ('city_code', 'fiscal_year', 'sector'),
+    'municipality_kpis': ('city_code',),
+    'prefecture_kpis': ('prefecture_code',),
+}
+# JOIN先のテーブルと結合に使うカラム
+EMBEDS = {'municipalities': 'city_code'}
+RESERVED_PARAMS = {'select', 'order', 'on_conflict', 'limit', 'offset', 'columns'}
+MAX_ROWS = 1000
+UPDATED_AT = 'updated_at'
+
+
+def _comparable(value, arg) -> Tuple:
+    """数値は数値として、日時などそれ以外は文字列として比べる"""
+    try:
+        return float(value), float(arg)
+    except (TypeError, ValueError):
+        return str(value), arg
+
+
+OPERATORS = {
+    'eq': lambda value, arg: value is not None and str(value) == arg,
+    'neq': lambda value, arg: value is None or str(value) != arg,
+    'gt': lambda value, arg: value is not None and _comparable(value, arg)[0] > _comparable(value, arg)[1],
+    'gte': lambda value, arg: value is not None and _comparable(value, arg)[0] >= _comparable(value, arg)[1],
+    'lt': lambda value, arg: value is not None and _comparable(value, arg)[0] < _comparable(value, arg)[1],
+    'lte': lambda value, arg: value is not None and _comparable(value, arg)[0] <= _comparable(value, arg)[1],
+    'like': lambda value, arg: value is not None and re.fullmatch(
+        re.escape(arg).replace(r'\*', '.*').replace('%', '.*'), str(value)) is not None,
+    'in': lambda value, arg: value is not None and str(value) in
+    [item.strip('"') for item in arg.strip('()').split(',')],
+    'is': lambda value, arg: (value is None) if arg == 'null' else str(value).lower() == arg,
+}
+
+
+def _split_select(select: str) -> Tuple[List[str], Dict[str, List[str]]]:
+    """select=... をカラムとJOIN（テーブル -> カラム）に分ける"""
+    embeds = {table: [c.strip() for c in columns.split(',')]
+              for table, columns in re.findall(r'(\w+)\(([^)]*)\)', select)}
+    columns = [c.strip() for c in re.sub(r'\w+\([^)]*\)', '', select).split(',') if c.strip()]
+    return columns, embeds
+
+
+class PostgrestServer:
+    """
+    テスト用のPostgREST互換サーバー
+
+    Attributes:
+        tables: テーブル名 -> {主キーのタプル: 行}
+        requests: (メソッド, テーブル, 行数) の記録
+        failures: テーブル名 -> 次のPOSTで返すHTTPステータスのリスト（先頭から消費）
+        functions: RPCで呼べる関数（空にすると update_rows() のないDBとして振る舞う）
+        url: 接続先のURL（db.use_endpoint() に渡す）
+    """
+
+    def __init__(self, max_rows: int = MAX_ROWS):
+        self.max_rows = max_rows
+        self.tables: Dict[str, Dict[Tuple, Dict]] = {table: {} for table in PRIMARY_KEYS}
+        self.requests: List[Tuple[str, str, int]] = []
+        self.failures: Dict[str, List[int]] = {}
+        self.functions = {'update_rows'}
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.thread = threading.Thread(target=self.httpd.serve_forever, kwargs={'poll_interval': 0.05},
+                                       daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def insert(self, table: str, rows: List[Dict]):
+        """テストデータを直接投入（既存の行は置き換え、値が変われば updated_at を更新）"""
+        with self.lock:
+            for row in rows:
+                key = self._key(table, row)
+                self._write(table, key, dict(self.tables[table].get(key, {}), **row))
+
+    def delete(self, table: str, keys: List[Tuple]):
+        """テストデータを直接削除"""
+        with self.lock:
+            for key in keys:
+                self.tables[table].pop(key, None)
+
+    def rows(self, table: str) -> List[Dict]:
+        """テーブルの全行（主キー順）"""
+        with self.lock:
+            return [dict(row) for _, row in sorted(self.tables[table].items())]
+
+    def count(self, method: str, table: str) -> int:
+        """指定したメソッド・テーブルのリクエスト数"""
+        return sum(1 for m, t, _ in self.requests if m == method and t == table)
+
+    def _write(self, table: str, key: Tuple, row: Dict):
+        """行を書き込み、追加・変更した行だけ updated_at を現在時刻にする"""
+        current = self.tables[table].get(key)
+        if current is None or any(current.get(column) != value for column, value in row.items()
+                                  if column != UPDATED_AT):
+            row[UPDATED_AT] = datetime.now(timezone.utc).isoformat(timespec='microseconds')
+        self.tables[table][key] = row
+
+    @staticmethod
+    def _key(table: str, row: Dict, columns: Tuple[str, ...] = ()) -> Tuple:
+        return tuple(row[column] for column in (columns or PRIMARY_KEYS[table]))
+
+    def _filter(self, table: str, params: Dict[str, List[str]]) -> List[Dict]:
+        rows = list(self.tables[table].values())
+        for column, conditions in params.items():
+            if column in RESERVED_PARAMS:
+                continue
+            for condition in conditions:
+                negate = condition.startswith('not.')
+                operator, _, arg = condition[4 if negate else 0:].partition('.')
+                test = OPERATORS[operator]
+                rows = [row for row in rows if test(row.get(column), unquote(arg)) != negate]
+        return rows
+
+    def _select(self, table: str, params: Dict[str, List[str]], range_header: str) -> Tuple[List[Dict], int]:
+        """条件に一致する行（Range・limit・max_rows で切り詰めたもの）と切り詰める前の行数"""
+        rows = self._filter(table, params)
+        total = len(rows)
+        for order in reversed(params.get('order', [''])[0].split(',')):
+            if order:
+                column, _, direction = order.partition('.')
+                rows.sort(key=lambda row: (row.get(column) is None, row.get(column)),
+                          reverse=direction.startswith('desc'))
+        start = 0
+        end = len(rows)
+        if range_header:
+            first, _, last = range_header.partition('-')
+            start, end = int(first), int(last) + 1
+        if 'limit' in params:
+            end = min(end, start + int(params['limit'][0]))
+        rows = rows[start:min(end, start + self.max_rows)]
+
+        columns, embeds = _split_select(params.get('select', ['*'])[0])
+        result = []
+        for row in rows:
+            out = dict(row) if '*' in columns else {c: row.get(c) for c in columns}
+            for embed, embed_columns in embeds.items():
+                target = self.tables[embed].get((row.get(EMBEDS[embed]),))
+                if target is not None and '*' not in embed_columns:
+                    target = {c: target.get(c) for c in embed_columns}
+                out[embed] = dict(target) if target is not None else None
+            result.append(out)
+        return result, total
+
+    def _update_rows(self, table: str, key_column: str, rows: List[Dict]) -> int:
+        """create_schema.sql の update_rows() と同じく、行ごとに指定したカラムだけ更新"""
+        updated = 0
+        for values in rows:
+            for key, row in list(self.tables[table].items()):
+                if str(row.get(key_column)) == str(values[key_column]):
+                    self._write(table, key, dict(row, **values))
+                    updated += 1
+        return updated
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # ヘッダーと本文を1回で送る（分けて送ると遅延ACKで1リクエストごとに待たされる）
+            wbufsize = -1
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body=None, headers: Dict[str, str] = None):
+                data = json.dumps(body if body is not None else [], ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _request(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'null')
+                url = urlparse(self.path)
+                table = url.path.rstrip('/').split('/')[-1]
+                return table, parse_qs(url.query), body
+
+            def do_GET(self):
+                table, params, _ = self._request()
+                if table not in server.tables:
+                    return self._send(404, {'code': 'PGRST205',
+                                            'message': f"Could not find the table 'public.{table}'"})
+                with server.lock:
+                    rows, total = server._select(table, params, self.headers.get('Range', ''))
+                    server.requests.append(('GET', table, len(rows)))
+                headers = {}
+                if 'count=exact' in self.headers.get('Prefer', ''):
+                    headers['Content-Range'] = f"0-{max(len(rows) - 1, 0)}/{total}"
+                self._send(200, rows, headers)
+
+            def _rpc(self, function: str, body: Dict):
+                if function not in server.functions:
+                    return self._send(404, {'code': 'PGRST202',
+                                            'message': f"Could not find the function public.{function}"})
+                table = body['target_table']
+                with server.lock:
+                    updated = server._update_rows(table, body['key_column'], body['rows'])
+                    server.requests.append(('RPC', table, len(body['rows'])))
+                self._send(200, [{'updated': updated}])
+
+            def do_POST(self):
+                table, params, body = self._request()
+                if '/rpc/' in urlparse(self.path).path:
+                    return self._rpc(table, body)
+                rows = body if isinstance(body, list) else [body]
+                with server.lock:
+                    pending = server.failures.get(table)
+                    if pending:
+                        status = pending.pop(0)
+                        server.requests.append(('FAIL', table, len(rows)))
+                        return self._send(status, {'message': f"injected {status}"})
+                    conflict = tuple(params.get('on_conflict', [''])[0].split(',')) \
+                        if params.get('on_conflict') else ()
+                    existing = {server._key(table, row, conflict): key
+                                for key, row in server.tables[table].items()}
+                    for row in rows:
+                        key = existing.get(server._key(table, row, conflict))
+                        if key is None:
+                            key = server._key(table, row)
+                        server._write(table, key, dict(server.tables[table].get(key, {}), **row))
+                    server.requests.append(('POST', table, len(rows)))
+                self._send(201, rows)
+
+            def do_PATCH(self):
+                table, params, body = self._request()
+                with server.lock:
+                    rows = server._filter(table, params)
+                    for row in rows:
+                        server._write(table, server._key(table, row), dict(row, **body))
+                    server.requests.append(('PATCH', table, len(rows)))
+                self._send(200, rows)
+
+            def do_DELETE(self):
+                table, params, _ = self._request()
+                with server.lock:
+                    rows = server._filter(table, params)
+                    for row in rows:
+                        server.tables[table].pop(server._key(table, row), None)
+                    server.requests.append(('DELETE', table, len(rows)))
+                self._send(200, rows)
+
+        return Handler
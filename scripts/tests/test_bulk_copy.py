@@ -0,0 +1,140 @@
+"""
+bulk_copy.py のテスト（実際のPostgreSQLに対して実行）
+
+PostgreSQLは pgserver（pip install pgserver）で一時ディレクトリに起動する。
+psycopg2 か pgserver がなければスキップする。
+"""
+import numpy as np
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+pgserver = pytest.importorskip('pgserver')
+
+import bulk_copy  # noqa: E402
+import db  # noqa: E402
+from emissions_cube import EmissionsCube  # noqa: E402
+
+CITY_CODES = ['13101', '13102', '13103']
+SECTORS = ['製造業', '家庭', '廃棄物']
+
+
+@pytest.fixture(scope='module')
+def database_url(postgres_database):
+    """自治体マスターを投入したDB"""
+    url = postgres_database()
+    conn = psycopg2.connect(url)
+    with conn.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO municipalities (city_code, name, prefecture_code, prefecture_name, prefecture_slug) "
+            "VALUES (%s, %s, '13', '東京都', 'tokyo')",
+            [(code, f"区{i}") for i, code in enumerate(CITY_CODES)])
+    conn.commit()
+    conn.close()
+    return url
+
+
+@pytest.fixture
+def conn(database_url):
+    connection = psycopg2.connect(database_url)
+    yield connection
+    with connection.cursor() as cursor:
+        cursor.execute("TRUNCATE emissions")
+    connection.commit()
+    connection.close()
+
+
+def emission_rows(city_codes=CITY_CODES, years=range(2013, 2016), offset=0.0):
+    return [{'city_code': code, 'fiscal_year': year, 'sector': sector,
+             'value_kt_co2': round(i * 1.25 + offset, 2)}
+            for i, (code, year, sector) in enumerate(
+                (code, year, sector) for code in city_codes for year in years for sector in SECTORS)]
+
+
+def fetch(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT city_code, fiscal_year, sector, value_kt_co2 FROM emissions "
+                       "ORDER BY city_code, fiscal_year, sector")
+        return [(code, year, sector, None if value is None else float(value))
+                for code, year, sector, value in cursor.fetchall()]
+
+
+def expected(rows):
+    return sorted((row['city_code'], row['fiscal_year'], row['sector'], row['value_kt_co2'])
+                  for row in rows)
+
+
+def test_copy_inserts_all_rows(conn):
+    rows = emission_rows()
+    result = bulk_copy.copy_emissions(conn, rows)
+
+    assert result['rows'] == len(rows) == 27
+    assert result['upserted'] == 27
+    assert result['deleted'] == 0
+    assert result['bytes'] > 0
+    assert fetch(conn) == expected(rows)
+
+
+def test_copy_skips_unchanged_rows(conn):
+    bulk_copy.copy_emissions(conn, emission_rows())
+    result = bulk_copy.copy_emissions(conn, emission_rows())
+    assert result['upserted'] == 0
+    assert result['deleted'] == 0
+
+
+def test_copy_updates_changed_rows_and_deletes_missing(conn):
+    bulk_copy.copy_emissions(conn, emission_rows())
+    # 13101 だけを投入し直す（2015年度がなくなり、値が変わる）
+    rows = emission_rows(['13101'], range(2013, 2015), offset=0.5)
+    result = bulk_copy.copy_emissions(conn, rows)
+
+    assert result['upserted'] == 6
+    assert result['deleted'] == 3
+    current = fetch(conn)
+    assert [row for row in current if row[0] == '13101'] == expected(rows)
+    # 投入していない自治体の行は残る
+    assert len([row for row in current if row[0] != '13101']) == 18
+
+
+def test_copy_writes_missing_value_as_null(conn):
+    rows = emission_rows(['13101'], [2013])
+    rows[0]['value_kt_co2'] = None
+    bulk_copy.copy_emissions(conn, rows)
+    values = {row[2]: row[3] for row in fetch(conn)}
+    assert values['製造業'] is None
+    assert values['家庭'] == 1.25
+
+
+def test_failed_copy_leaves_emissions_unchanged(conn):
+    bulk_copy.copy_emissions(conn, emission_rows())
+    before = fetch(conn)
+    rows = emission_rows(offset=1.0)
+    rows[-1]['sector'] = '不明'  # valid_sector 制約に違反
+
+    with pytest.raises(psycopg2.Error):
+        bulk_copy.copy_emissions(conn, rows)
+    assert fetch(conn) == before
+
+
+def test_clear_emissions_only_touches_given_cities(conn):
+    bulk_copy.copy_emissions(conn, emission_rows())
+    assert bulk_copy.clear_emissions(conn, ['13101', '13102']) == 18
+    assert {row[0] for row in fetch(conn)} == {'13103'}
+
+
+def test_compare_runs_both_methods_from_empty_tables(conn, database_url, postgrest, tmp_path, monkeypatch):
+    import seed_supabase
+
+    monkeypatch.setenv(bulk_copy.DATABASE_URL_ENV, database_url)
+    monkeypatch.setattr(seed_supabase, 'EMISSIONS_STATE_JSON', tmp_path / 'state.json')
+    monkeypatch.setattr(seed_supabase, 'EMISSIONS_DEAD_LETTER', tmp_path / 'dead.ndjson')
+    values = np.arange(len(CITY_CODES) * 3 * len(SECTORS), dtype=float).reshape(len(CITY_CODES), 3, -1)
+    cube = EmissionsCube(CITY_CODES, ['千代田区', '中央区', '港区'], [2013, 2014, 2015], SECTORS, values)
+    # 前回の投入が残っていても、COPY は空の状態から全行を投入する
+    bulk_copy.copy_emissions(conn, list(cube.iter_rows()))
+
+    results = seed_supabase.compare_load_methods(db.get_client(), cube, workers=1)
+
+    assert results['postgrest']['rows'] == 27
+    assert results['copy']['rows'] == 27
+    assert results['copy']['upserted'] == 27
+    assert fetch(conn) == expected(cube.iter_rows())
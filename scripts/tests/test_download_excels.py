@@ -0,0 +1,191 @@
+"""
+download_excels.py のテスト（ローカルのHTTPサーバーに対して実行）
+
+条件付きGET・途中で切れたダウンロードの再開・429の Retry-After を確認する。
+"""
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+import pytest
+
+import download_excels
+
+CONTENT = bytes(range(256)) * 1024  # 256KB（CHUNK_SIZE の4倍）
+ETAG = '"karte-v1"'
+
+
+class KarteServer:
+    """
+    カルテExcelを返すテスト用サーバー
+
+    responses に積んだ動作（'ok' / 'truncate' / '429' / '503'）を1リクエストごとに消費し、
+    空になったら 'ok' として扱う。受け取ったリクエストヘッダーは requests に記録する。
+    """
+
+    def __init__(self):
+        self.responses: List[str] = []
+        self.requests: List[Dict[str, str]] = []
+        self.retry_after = '2'
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests.append(dict(self.headers))
+                action = server.responses.pop(0) if server.responses else 'ok'
+                if action in ('429', '503'):
+                    self.send_response(int(action))
+                    self.send_header('Retry-After', server.retry_after)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if self.headers.get('If-None-Match') == ETAG:
+                    self.send_response(304)
+                    self.send_header('ETag', ETAG)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                start = 0
+                range_header = self.headers.get('Range', '')
+                if range_header.startswith('bytes=') and self.headers.get('If-Range') == ETAG:
+                    start = int(range_header[6:].rstrip('-'))
+                body = CONTENT[start:]
+                self.send_response(206 if start else 200)
+                self.send_header('ETag', ETAG)
+                self.send_header('Content-Length', str(len(body)))
+                if start:
+                    self.send_header('Content-Range', f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}")
+                self.end_headers()
+                if action == 'truncate':
+                    # 半分だけ送って接続を切る
+                    self.wfile.write(body[:len(body) // 2])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    self.connection.shutdown(2)
+                    return
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, kwargs={'poll_interval': 0.05},
+                                       daemon=True)
+        self.thread.start()
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_port}/{{city_code}}.xlsx"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    karte_server = KarteServer()
+    yield karte_server
+    karte_server.close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> List[float]:
+    """
+    download_excels の待機を実際には待たずに記録
+
+    time.monotonic() は待機した秒数だけ進む仮の時計にする（他のモジュールの time は変えない）。
+    """
+    calls: List[float] = []
+    clock = [time.monotonic()]
+
+    def sleep(seconds: float):
+        calls.append(seconds)
+        clock[0] += seconds
+
+    fake_time = types.SimpleNamespace(**{name: getattr(time, name) for name in dir(time)
+                                         if not name.startswith('_')})
+    fake_time.sleep = sleep
+    fake_time.monotonic = lambda: clock[0]
+    monkeypatch.setattr(download_excels, 'time', fake_time)
+    return calls
+
+
+def download(server: KarteServer, tmp_path, meta: Dict, **kwargs) -> str:
+    return download_excels.download_excel('13101', tmp_path, meta=meta, base_url=server.base_url,
+                                          **kwargs)
+
+
+def test_conditional_get_skips_unchanged_file(server, tmp_path, sleeps):
+    meta = {}
+    assert download(server, tmp_path, meta) == 'OK'
+    assert (tmp_path / '13101.xlsx').read_bytes() == CONTENT
+    assert meta['13101']['etag'] == ETAG
+
+    assert download(server, tmp_path, meta) == 'SKIP'
+    assert server.requests[-1]['If-None-Match'] == ETAG
+    assert (tmp_path / '13101.xlsx').read_bytes() == CONTENT
+
+
+def test_conditional_get_refetches_missing_file(server, tmp_path, sleeps):
+    meta = {'13101': {'etag': ETAG, 'last_modified': None}}
+    assert download(server, tmp_path, meta) == 'OK'
+    assert 'If-None-Match' not in server.requests[0]
+
+
+def test_truncated_download_resumes_with_range(server, tmp_path, sleeps):
+    server.responses = ['truncate']
+    meta = {}
+    assert download(server, tmp_path, meta) == 'OK'
+
+    assert len(server.requests) == 2
+    resumed = server.requests[1]
+    # 切断前に書き込めた分から再開する
+    resumed_from = int(resumed['Range'][len('bytes='):].rstrip('-'))
+    assert 0 < resumed_from <= len(CONTENT) // 2
+    assert resumed['If-Range'] == ETAG
+    assert (tmp_path / '13101.xlsx').read_bytes() == CONTENT
+    assert not (tmp_path / '13101.xlsx.part').exists()
+
+
+def test_retry_after_is_honoured_on_429(server, tmp_path, sleeps):
+    server.responses = ['429']
+    server.retry_after = '7'
+    assert download(server, tmp_path, {}) == 'OK'
+    assert len(server.requests) == 2
+    # バックオフ（1秒）より長い Retry-After の秒数だけ待ってから再送する
+    assert sleeps == [7.0]
+
+
+def test_retry_after_pauses_shared_bucket(server, tmp_path, sleeps):
+    bucket = download_excels.TokenBucket(rate=0)
+    server.responses = ['429']
+    server.retry_after = '5'
+    assert download(server, tmp_path, {}, bucket=bucket) == 'OK'
+
+    # 429を受けたワーカー以外も Retry-After の間はトークンを取得できない
+    sleeps.clear()
+    bucket.pause(5)
+    bucket.acquire()
+    assert sleeps == [pytest.approx(5.0)]
+
+
+def test_token_bucket_limits_rate(sleeps):
+    bucket = download_excels.TokenBucket(rate=2.0)
+    for _ in range(3):
+        bucket.acquire()
+    assert sum(sleeps) == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('3', 3.0),
+    ('0', 0.0),
+    ('100000', download_excels.MAX_RETRY_AFTER),
+    ('Thu, 01 Jan 1970 00:00:00 GMT', 0.0),
+    ('soon', None),
+    (None, None),
+])
+def test_parse_retry_after(value, expected):
+    assert download_excels.parse_retry_after(value) == expected
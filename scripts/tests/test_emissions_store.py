@@ -0,0 +1,141 @@
+"""
+emissions_store.py / emissions_cube.py の読み込み元の選択・部門の合計順と NdjsonWriter のテスト
+"""
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+import parse_excels
+from emissions_cube import EmissionsCube, load_emissions_cube
+from emissions_store import NdjsonWriter, latest_source, load_emissions_data
+
+RECORDS = [
+    {'city_code': '13101', 'city_name': '千代田区', 'years': [2013, 2022],
+     'emissions': {'家庭': {'2013': 100.0, '2022': 80.0}}},
+    {'city_code': '13102', 'city_name': '中央区', 'years': [2013, 2022],
+     'emissions': {'家庭': {'2013': 50.0, '2022': 45.5}}},
+]
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return {
+        'json_path': tmp_path / 'emissions.json',
+        'parquet_path': tmp_path / 'emissions.parquet',
+        'ndjson_path': tmp_path / 'emissions.ndjson',
+    }
+
+
+def write_json(path, records, mtime):
+    path.write_text(json.dumps(records, ensure_ascii=False), encoding='utf-8')
+    os.utime(path, (mtime, mtime))
+
+
+def write_ndjson(path, records, mtime):
+    with NdjsonWriter(path) as writer:
+        for record in records:
+            writer.write(record)
+    os.utime(path, (mtime, mtime))
+
+
+def test_newer_ndjson_is_read_instead_of_json(paths):
+    write_json(paths['json_path'], RECORDS[:1], 1_000_000)
+    write_ndjson(paths['ndjson_path'], RECORDS, 2_000_000)
+
+    assert latest_source(**paths) == paths['ndjson_path']
+    assert load_emissions_data(**paths) == RECORDS
+    cube = load_emissions_cube(**paths)
+    assert cube.city_codes == ['13101', '13102']
+
+
+def test_newer_json_is_read_instead_of_ndjson(paths):
+    write_ndjson(paths['ndjson_path'], RECORDS, 1_000_000)
+    write_json(paths['json_path'], RECORDS[:1], 2_000_000)
+
+    assert load_emissions_data(**paths) == RECORDS[:1]
+    assert load_emissions_cube(**paths).city_codes == ['13101']
+
+
+def test_no_source_returns_none(paths):
+    assert latest_source(**paths) is None
+    assert load_emissions_cube(**paths) is None
+
+
+def test_ndjson_writer_keeps_previous_file_on_error(tmp_path):
+    path = tmp_path / 'emissions.ndjson'
+    write_ndjson(path, RECORDS, 1_000_000)
+    before = path.read_bytes()
+
+    with pytest.raises(RuntimeError):
+        with NdjsonWriter(path) as writer:
+            writer.write(RECORDS[0])
+            raise RuntimeError
+    assert path.read_bytes() == before
+    assert not path.with_suffix('.ndjson.tmp').exists()
+
+
+def test_parse_failure_leaves_no_ndjson_tmp(tmp_path, monkeypatch):
+    raw_dir = tmp_path / 'raw'
+    raw_dir.mkdir()
+    (raw_dir / '13101.xlsx').write_bytes(b'')
+    municipalities_csv = tmp_path / 'municipalities.csv'
+    municipalities_csv.write_text('city_code,name,region\n13101,千代田区,区部\n', encoding='utf-8')
+    ndjson_path = tmp_path / 'emissions.ndjson'
+
+    def broken(tasks, workers=1):
+        raise RuntimeError("parse failed")
+        yield
+
+    monkeypatch.setattr(parse_excels, 'RAW_DIR', raw_dir)
+    monkeypatch.setattr(parse_excels, 'PROCESSED_DIR', tmp_path)
+    monkeypatch.setattr(parse_excels, 'MUNICIPALITIES_CSV', municipalities_csv)
+    monkeypatch.setattr(parse_excels, 'EMISSIONS_NDJSON', ndjson_path)
+    monkeypatch.setattr(parse_excels, 'iter_parse_results', broken)
+    monkeypatch.setattr(sys, 'argv', ['parse_excels.py', '--format', 'ndjson', '--no-cache', '--no-metrics'])
+
+    with pytest.raises(RuntimeError):
+        parse_excels.main()
+    assert list(tmp_path.glob('*.tmp')) == []
+    assert not ndjson_path.exists()
+
+
+def test_stream_rejects_other_load_methods(monkeypatch):
+    import seed_supabase
+
+    monkeypatch.setattr(sys, 'argv', ['seed_supabase.py', '--stream', '--load-method', 'copy'])
+    with pytest.raises(SystemExit):
+        seed_supabase.parse_args()
+    monkeypatch.setattr(sys, 'argv', ['seed_supabase.py', '--stream'])
+    assert seed_supabase.parse_args().load_method == 'postgrest'
+
+
+
+def test_cube_totals_add_sectors_in_each_city_order():
+    # 部門の順が自治体によって違い、足す順で浮動小数点の誤差が変わる値
+    records = [
+        {'city_code': '13101', 'city_name': '千代田区', 'years': [2013],
+         'emissions': {'家庭': {'2013': 0.1}, '製造業': {'2013': 0.2}, '旅客': {'2013': 0.3}}},
+        {'city_code': '13102', 'city_name': '中央区', 'years': [2013],
+         'emissions': {'旅客': {'2013': 0.3}, '製造業': {'2013': 0.2}, '家庭': {'2013': 0.1}}},
+    ]
+    rows = [(record['city_code'], record['city_name'], sector, value)
+            for record in records for sector, yearly_data in record['emissions'].items()
+            for value in yearly_data.values()]
+    columns = {
+        'city_code': np.array([row[0] for row in rows], dtype=object),
+        'city_name': np.array([row[1] for row in rows], dtype=object),
+        'fiscal_year': np.array([2013] * len(rows)),
+        'sector': np.array([row[2] for row in rows], dtype=object),
+        'value_kt_co2': np.array([row[3] for row in rows]),
+    }
+    assert 0.1 + 0.2 + 0.3 != 0.3 + 0.2 + 0.1
+
+    for cube in (EmissionsCube.from_records(records), EmissionsCube.from_columns(columns)):
+        for record in records:
+            expected = 0.0
+            for yearly_data in record['emissions'].values():
+                expected += yearly_data['2013']
+            assert cube.city_total(record['city_code'], 2013, rounded=False) == expected
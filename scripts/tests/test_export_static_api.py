@@ -0,0 +1,54 @@
+"""
+export_static_api.py のテスト（ローカルのPostgREST互換サーバーに対して実行）
+
+2回目以降の書き出しでは、ミラーの同期で更新された行だけを取得する
+（排出量を毎回全件取得しない）ことと、内容が同じファイルを書き換えないことを確認する。
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+CITY_CODES = ['13101', '13102', '13103']
+SECTORS = ['製造業', '家庭', '廃棄物']
+
+
+@pytest.fixture
+def seeded(postgrest):
+    postgrest.insert('municipalities', [
+        {'city_code': code, 'name': f"区{i}", 'prefecture_code': '13', 'population': 1000 * (i + 1)}
+        for i, code in enumerate(CITY_CODES)])
+    postgrest.insert('municipality_kpis', [
+        {'city_code': code, 'base_year': 2013, 'latest_year': 2022, 'base_emission_kt': 100.0,
+         'latest_emission_kt': 80.0, 'reduction_rate': -20.0, 'actual_pace': 2.2, 'required_pace': 2.6,
+         'pace_achievement_rate': 80.0 + i,
+         'status': 'at-risk'}
+        for i, code in enumerate(CITY_CODES)])
+    postgrest.insert('prefecture_kpis', [{'prefecture_code': '13', 'prefecture_name': '東京都',
+                                          'pace_achievement_rate': 80.0}])
+    postgrest.insert('emissions', [
+        {'city_code': code, 'fiscal_year': year, 'sector': sector, 'value_kt_co2': 10.0}
+        for code in CITY_CODES for year in (2013, 2022) for sector in SECTORS])
+    # 投入済みの行は1日おきに更新されたことにする
+    started = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for rows in postgrest.tables.values():
+        for i, row in enumerate(rows.values()):
+            row['updated_at'] = (started + timedelta(days=i)).isoformat(timespec='microseconds')
+    return postgrest
+
+
+def fetched_rows(server, table):
+    return sum(rows for method, name, rows in server.requests if method == 'GET' and name == table)
+
+
+def test_second_export_fetches_only_updated_rows(seeded, run_script, tmp_path):
+    args = ('--mirror', str(tmp_path / 'mirror.sqlite'), '--output', str(tmp_path / 'api'))
+    run_script('export_static_api.py', *args)
+    assert fetched_rows(seeded, 'emissions') == len(CITY_CODES) * 2 * len(SECTORS)
+    assert (tmp_path / 'api' / 'municipalities' / '13101' / 'trajectory.json').exists()
+    manifest = (tmp_path / 'api' / 'manifest.json').read_bytes()
+
+    seeded.requests.clear()
+    run_script('export_static_api.py', *args)
+    # 前回の最終更新から遡って取り直す範囲の1行と、削除を確かめる行数の確認（1行）だけ
+    assert fetched_rows(seeded, 'emissions') == 2
+    assert (tmp_path / 'api' / 'manifest.json').read_bytes() == manifest
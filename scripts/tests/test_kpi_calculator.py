@@ -0,0 +1,85 @@
+"""
+kpi_calculator のバッチ版がスカラー版と完全に一致することの確認
+
+seed_supabase.py などはバッチ版で計算するため、丸め・ゼロ除算などのガード分岐を含めて
+スカラー版（旧実装）と同じ値になることをここで保証する。
+"""
+import numpy as np
+import pytest
+
+from bench_kpi_calculator import calc_kpis_scalar, calc_kpis_vectorized, generate_inputs
+from kpi_calculator import (
+    calc_deviation_score,
+    calc_deviation_scores,
+    calc_emission_per_capita,
+    calc_emission_per_capita_batch,
+    calc_ranks,
+    population_band
+)
+
+
+@pytest.mark.parametrize('size, seed', [(1, 0), (62, 1), (1900, 2), (20000, 3)])
+def test_kpis_batch_matches_scalar(size, seed):
+    inputs = generate_inputs(size, seed)
+    scalar = calc_kpis_scalar(inputs)
+    batch = calc_kpis_vectorized(inputs)
+    for key, expected in scalar.items():
+        assert batch[key].tolist() == expected, key
+
+
+def test_kpis_batch_handles_guard_branches():
+    inputs = {
+        'base': np.array([0.0, 100.0, 100.0, 100.0]),
+        'latest': np.array([50.0, -1.0, 100.0, 120.0]),
+        'population': np.array([1000.0, 0.0, 5000.0, 2000.0])
+    }
+    scalar = calc_kpis_scalar(inputs)
+    batch = calc_kpis_vectorized(inputs)
+    for key, expected in scalar.items():
+        assert batch[key].tolist() == expected, key
+
+
+@pytest.mark.parametrize('values', [
+    [],
+    [12.5],
+    [3.0, 3.0, 3.0],
+    [0.0, 10.0, 20.0, 30.0],
+    np.random.default_rng(4).uniform(0, 60, 1900).round(2).tolist()
+])
+def test_deviation_scores_match_scalar(values):
+    expected = [calc_deviation_score(values, value) for value in values]
+    assert calc_deviation_scores(values).tolist() == expected
+
+
+def test_grouped_deviation_scores_match_scalar_per_group():
+    rng = np.random.default_rng(5)
+    values = rng.uniform(0, 60, 500).round(2)
+    groups = rng.choice(['13', '14', '27', '47'], 500)
+    groups[0] = '01'  # 1自治体だけのグループは50
+
+    scores = calc_deviation_scores(values, groups)
+    for i, (value, group) in enumerate(zip(values.tolist(), groups)):
+        members = values[groups == group].tolist()
+        assert scores[i] == calc_deviation_score(members, value)
+    assert scores[0] == 50.0
+
+
+def test_emission_per_capita_batch_matches_scalar():
+    total = [100.0, 0.0, 55.5, 12.3]
+    population = [1000, 0, 2000, 0]
+    expected = [calc_emission_per_capita(t, p) for t, p in zip(total, population)]
+    assert calc_emission_per_capita_batch(total, population).tolist() == expected
+
+
+def test_ranks_match_sorted_order():
+    values = [10.0, 30.0, 30.0, 5.0, 20.0]
+    groups = ['13', '13', '14', '13', '14']
+    # 同じ値はデータ順に別の順位
+    assert calc_ranks(values).tolist() == [4, 1, 2, 5, 3]
+    assert calc_ranks(values, groups).tolist() == [2, 1, 1, 3, 2]
+
+
+def test_population_band_marks_missing_population():
+    bands = population_band([np.nan, 5000, 2_000_000])
+    assert bands[0] == -1
+    assert bands[1] < bands[2]
@@ -0,0 +1,143 @@
+"""
+local_mirror.py のテスト（ローカルのPostgREST互換サーバーに対して実行）
+
+変わったカラムだけを複数行まとめて送ること（ミラーの古い値でSupabaseを上書きしないこと）、
+再計算に使うテーブルを同期してから再計算すること、2回目以降の同期は
+更新された行だけを取得することを確認する。
+"""
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+import local_mirror
+
+CITY_COUNT = 94
+
+
+@pytest.fixture
+def seeded(postgrest):
+    """2都道府県・94自治体のマスター・KPI"""
+    rng = np.random.default_rng(11)
+    municipalities = []
+    kpis = []
+    for i in range(CITY_COUNT):
+        city_code = f"{i % 2 + 13:02d}{i // 2 + 100:03d}"
+        base = float(np.round(rng.uniform(100, 2000), 2))
+        latest = float(np.round(base * rng.uniform(0.6, 1.1), 2))
+        municipalities.append({'city_code': city_code, 'name': f"市{i}",
+                               'population': int(rng.integers(1000, 900000))})
+        kpis.append({
+            'city_code': city_code,
+            'base_year': 2013,
+            'latest_year': 2022,
+            'base_emission_kt': base,
+            'latest_emission_kt': latest,
+            'reduction_rate': float(np.round((latest - base) / base * 100, 2)),
+            'pace_achievement_rate': float(np.round(rng.uniform(-50, 150), 1)),
+            'status': ['on-track', 'at-risk', 'off-track'][i % 3],
+            'deviation_score': 50.0,
+        })
+    postgrest.insert('municipalities', municipalities)
+    postgrest.insert('municipality_kpis', kpis)
+    return postgrest
+
+
+@pytest.fixture
+def mirror_path(tmp_path):
+    return tmp_path / 'mirror.sqlite'
+
+
+def test_default_sync_skips_emissions(seeded, run_script, mirror_path):
+    run_script('local_mirror.py', '--mirror', str(mirror_path))
+
+    assert seeded.count('GET', 'emissions') == 0
+    assert seeded.count('GET', 'municipality_kpis') >= 1
+    assert len(seeded.rows('prefecture_kpis')) == 2
+
+
+def test_push_sends_only_changed_columns(seeded, run_script, mirror_path):
+    run_script('local_mirror.py', '--mirror', str(mirror_path), '--sync-only')
+    # 同期後にSupabase側だけで変わった値（ミラーは古いまま）
+    seeded.insert('municipality_kpis', [dict(seeded.rows('municipality_kpis')[0], status='on-track',
+                                             shortfall_2030_kt=12.5)])
+
+    run_script('local_mirror.py', '--mirror', str(mirror_path), '--offline')
+
+    rows = seeded.rows('municipality_kpis')
+    assert rows[0]['status'] == 'on-track'
+    assert rows[0]['shortfall_2030_kt'] == 12.5
+    assert all(row['national_rank'] is not None for row in rows)
+    # 自治体KPIは部分更新のみ（行全体のupsertはしない）。値が行ごとに違っても1リクエストにまとめる
+    assert seeded.count('POST', 'municipality_kpis') == 0
+    assert seeded.count('PATCH', 'municipality_kpis') == 0
+    assert seeded.count('RPC', 'municipality_kpis') == 1
+
+
+def test_push_falls_back_to_patch_without_update_rows(seeded, run_script, mirror_path):
+    seeded.functions.clear()
+    run_script('local_mirror.py', '--mirror', str(mirror_path))
+
+    assert all(row['national_rank'] is not None for row in seeded.rows('municipality_kpis'))
+    assert seeded.count('POST', 'municipality_kpis') == 0
+    assert seeded.count('PATCH', 'municipality_kpis') >= 1
+
+
+def test_second_run_sends_nothing(seeded, run_script, mirror_path):
+    run_script('local_mirror.py', '--mirror', str(mirror_path))
+    updates = seeded.count('RPC', 'municipality_kpis')
+    posts = seeded.count('POST', 'prefecture_kpis')
+
+    run_script('local_mirror.py', '--mirror', str(mirror_path))
+    assert seeded.count('RPC', 'municipality_kpis') == updates
+    assert seeded.count('POST', 'prefecture_kpis') == posts
+
+
+def test_sync_fetches_only_updated_rows(seeded, run_script, mirror_path):
+    # 投入済みの行は1日おきに更新されたことにする
+    for i, row in enumerate(seeded.tables['municipalities'].values()):
+        row['updated_at'] = (datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(days=i)).isoformat(
+            timespec='microseconds')
+    run_script('local_mirror.py', '--mirror', str(mirror_path), '--sync-only', '--tables', 'municipalities')
+    first = seeded.rows('municipalities')
+    seeded.insert('municipalities', [dict(first[0], population=1), dict(first[1], name='新市')])
+    seeded.delete('municipalities', [(first[2]['city_code'],)])
+    seeded.requests.clear()
+
+    run_script('local_mirror.py', '--mirror', str(mirror_path), '--sync-only', '--tables', 'municipalities')
+
+    # 更新した2行と、前回の最終更新から遡って取り直す範囲の1行だけを取得し、
+    # 行数の違いから削除を検出する（主キーだけを取り直す）
+    fetched = [rows for method, table, rows in seeded.requests if method == 'GET' and table == 'municipalities']
+    assert fetched[0] == 3
+    conn = local_mirror.open_mirror(mirror_path)
+    mirrored = {row['city_code']: row for row in local_mirror.read_rows(conn, 'municipalities')}
+    conn.close()
+    assert len(mirrored) == CITY_COUNT - 1
+    assert first[2]['city_code'] not in mirrored
+    assert mirrored[first[0]['city_code']]['population'] == 1
+    assert mirrored[first[1]['city_code']]['name'] == '新市'
+
+
+def test_full_sync_fetches_all_rows(seeded, run_script, mirror_path):
+    run_script('local_mirror.py', '--mirror', str(mirror_path), '--sync-only', '--tables', 'municipalities')
+    seeded.requests.clear()
+    run_script('local_mirror.py', '--mirror', str(mirror_path), '--sync-only', '--tables', 'municipalities',
+               '--full-sync')
+    fetched = sum(rows for method, table, rows in seeded.requests if method == 'GET' and table == 'municipalities')
+    assert fetched == CITY_COUNT
+
+
+def test_tables_without_recompute_inputs_is_rejected(seeded, run_script, mirror_path):
+    with pytest.raises(SystemExit):
+        run_script('local_mirror.py', '--mirror', str(mirror_path), '--tables', 'municipality_kpis')
+    assert seeded.count('GET', 'municipality_kpis') == 0
+
+
+def test_sync_only_accepts_any_tables(seeded, run_script, mirror_path):
+    run_script('local_mirror.py', '--mirror', str(mirror_path), '--sync-only', '--tables', 'municipalities')
+
+    conn = local_mirror.open_mirror(mirror_path)
+    assert len(local_mirror.read_rows(conn, 'municipalities')) == CITY_COUNT
+    assert local_mirror.read_rows(conn, 'municipality_kpis') == []
+    conn.close()
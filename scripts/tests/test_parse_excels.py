@@ -0,0 +1,80 @@
+"""
+parse_excels.py の見出し判定のテスト
+"""
+import pytest
+
+import parse_excels
+from parse_excels import detect_layout, match_sector
+
+
+@pytest.fixture(autouse=True)
+def clear_layout_cache(monkeypatch):
+    monkeypatch.setattr(parse_excels, '_LAYOUT_CACHE', {})
+
+
+def header_rows(*header):
+    return [('自治体排出量カルテ',), (), tuple(header)]
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('aa_製造業', '製造業'),
+    ('建設業・鉱業部門', '建設業'),
+    ('貨物自動車', '貨物'),
+    ('旅客自動車', '旅客'),
+    ('備考', None),
+    (None, None),
+])
+def test_match_sector(header, expected):
+    assert match_sector(header) == expected
+
+
+def test_match_sector_caches_only_sectors(monkeypatch):
+    monkeypatch.setattr(parse_excels, 'SECTOR_ALIASES', dict(parse_excels.SECTOR_ALIASES))
+    before = len(parse_excels.SECTOR_ALIASES)
+    for i in range(100):
+        assert match_sector(f"備考{i}") is None
+    assert len(parse_excels.SECTOR_ALIASES) == before
+
+    assert match_sector('aa_一般廃棄物部門（焼却）') == '廃棄物'
+    assert parse_excels.SECTOR_ALIASES['一般廃棄物（焼却）'] == '廃棄物'
+
+
+def test_year_column_prefers_western_calendar():
+    layout = detect_layout(header_rows('年度（和暦）', '西暦', '団体コード', '自治体名', '製造業', '家庭'))
+    assert layout.year_col == 2
+    assert layout.city_code_col == 3
+    assert layout.sectors == ((5, '製造業'), (6, '家庭'))
+
+
+def test_year_column_skips_japanese_era_only_header():
+    layout = detect_layout(header_rows('和暦年度', '年度', '団体コード', '自治体名', '製造業', '家庭'))
+    assert layout.year_col == 2
+
+
+def test_year_column_defaults_relative_to_sectors():
+    layout = detect_layout(header_rows('和暦', '', '', '', '', '', '', '', '', '製造業', '家庭'))
+    assert layout.year_col == parse_excels.COL_YEAR
+    assert layout.header_row == 3
+
+
+def test_parse_error_is_reported_once_with_elapsed_time(tmp_path, monkeypatch, capsys):
+    import sys
+
+    raw_dir = tmp_path / 'raw'
+    raw_dir.mkdir()
+    (raw_dir / '13101.xlsx').write_bytes(b'not a workbook')
+    municipalities_csv = tmp_path / 'municipalities.csv'
+    municipalities_csv.write_text('city_code,name,region\n13101,千代田区,区部\n', encoding='utf-8')
+    monkeypatch.setattr(parse_excels, 'RAW_DIR', raw_dir)
+    monkeypatch.setattr(parse_excels, 'PROCESSED_DIR', tmp_path)
+    monkeypatch.setattr(parse_excels, 'MUNICIPALITIES_CSV', municipalities_csv)
+    monkeypatch.setattr(parse_excels, 'save_timings', lambda timings: None)
+    monkeypatch.setattr(parse_excels, 'EMISSIONS_JSON', tmp_path / 'emissions.json')
+    monkeypatch.setattr(sys, 'argv', ['parse_excels.py', '--no-cache', '--no-metrics'])
+
+    parse_excels.main()
+
+    errors = [line for line in capsys.readouterr().out.splitlines() if '[ERROR]' in line]
+    assert len(errors) == 1
+    assert errors[0].startswith('[1/1] 千代田区 (13101)... [ERROR] 13101 - パース失敗:')
+    assert errors[0].endswith('s)')
@@ -0,0 +1,39 @@
+"""
+queries.py のテスト（ローカルのPostgREST互換サーバーに対して実行）
+
+集計ビューがないDBだけローカル集計に切り替え、それ以外のエラーは送出することを確認する。
+"""
+import pytest
+
+import db
+import queries
+
+
+@pytest.fixture
+def kpis(postgrest):
+    postgrest.insert('municipality_kpis', [
+        {'city_code': '13101', 'base_emission_kt': 100.0, 'latest_emission_kt': 80.0, 'status': 'at-risk'},
+        {'city_code': '13102', 'base_emission_kt': 50.0, 'latest_emission_kt': 30.0, 'status': 'on-track'},
+        {'city_code': '14100', 'base_emission_kt': 10.0, 'latest_emission_kt': 9.0, 'status': 'off-track'},
+    ])
+    return postgrest
+
+
+def test_missing_view_falls_back_to_local_aggregation(kpis, capsys):
+    aggregates = queries.fetch_prefecture_aggregates(db.get_client(), ['13'])
+
+    assert aggregates['prefecture_code'].tolist() == ['13']
+    assert aggregates['municipality_count'].tolist() == [2]
+    assert aggregates['base_emission_kt'].tolist() == [150.0]
+    assert f"{queries.AGGREGATES_VIEW} がないためローカルで集計します" in capsys.readouterr().out
+
+
+def test_other_errors_are_raised(kpis, monkeypatch):
+    from postgrest.exceptions import APIError
+
+    def broken(*args, **kwargs):
+        raise APIError({'code': '57014', 'message': 'canceling statement due to statement timeout'})
+
+    monkeypatch.setattr(queries, 'select_all', broken)
+    with pytest.raises(APIError):
+        queries.fetch_prefecture_aggregates(db.get_client())
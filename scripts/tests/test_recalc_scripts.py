@@ -0,0 +1,91 @@
+"""
+recalc_deviation_scores.py / recalc_emission_per_capita.py のテスト
+
+ローカルのPostgREST互換サーバー（1レスポンス最大1000行）に全国規模の1,900自治体を入れ、
+全件を読み込んで再計算し、変わったカラムだけをまとめて書き戻すことを確認する。
+"""
+import numpy as np
+import pytest
+
+from kpi_calculator import calc_deviation_scores, calc_emission_per_capita_batch
+
+CITY_COUNT = 1900
+
+
+@pytest.fixture
+def national(postgrest):
+    """47都道府県に分かれた1,900自治体のマスター・KPI"""
+    rng = np.random.default_rng(7)
+    municipalities = []
+    kpis = []
+    for i in range(CITY_COUNT):
+        city_code = f"{i % 47 + 1:02d}{i // 47 + 100:03d}"
+        population = None if i % 50 == 0 else int(rng.integers(1000, 900000))
+        municipalities.append({'city_code': city_code, 'name': f"市{i}", 'population': population})
+        kpis.append({
+            'city_code': city_code,
+            'reduction_rate': float(np.round(rng.uniform(-40, 10), 2)),
+            'latest_emission_kt': float(np.round(rng.uniform(10, 5000), 2)),
+            'pace_achievement_rate': float(np.round(rng.uniform(-50, 150), 1)),
+            'status': 'at-risk',
+            'deviation_score': 50.0,
+            'emission_per_capita': None,
+        })
+    postgrest.insert('municipalities', municipalities)
+    postgrest.insert('municipality_kpis', kpis)
+    return postgrest
+
+
+def test_deviation_scores_cover_every_city(national, run_script):
+    run_script('recalc_deviation_scores.py')
+
+    rows = national.rows('municipality_kpis')
+    assert len(rows) == CITY_COUNT
+    expected = calc_deviation_scores([abs(row['reduction_rate']) for row in rows]).tolist()
+    assert [row['deviation_score'] for row in rows] == expected
+    # 1000行を超えるためページングして取得している
+    assert national.count('GET', 'municipality_kpis') >= 2
+    # 偏差値だけを500行ずつ更新する（行全体のupsertはしない）
+    assert national.count('POST', 'municipality_kpis') == 0
+    assert national.count('RPC', 'municipality_kpis') == 4
+    assert {row['status'] for row in rows} == {'at-risk'}
+
+
+def test_deviation_scores_second_run_sends_nothing(national, run_script):
+    run_script('recalc_deviation_scores.py')
+    updates = national.count('RPC', 'municipality_kpis')
+    run_script('recalc_deviation_scores.py')
+    assert national.count('RPC', 'municipality_kpis') == updates
+
+
+def test_deviation_scores_dry_run_writes_nothing(national, run_script):
+    run_script('recalc_deviation_scores.py', '--dry-run')
+    assert national.count('RPC', 'municipality_kpis') == 0
+    assert {row['deviation_score'] for row in national.rows('municipality_kpis')} == {50.0}
+
+
+def test_grouped_deviation_scores_use_whole_prefecture(national, run_script):
+    run_script('recalc_deviation_scores.py', '--group-by', 'prefecture')
+
+    rows = national.rows('municipality_kpis')
+    expected = calc_deviation_scores([abs(row['reduction_rate']) for row in rows],
+                                     [row['city_code'][:2] for row in rows]).tolist()
+    assert [row['deviation_score'] for row in rows] == expected
+
+
+def test_emission_per_capita_covers_every_city(national, run_script):
+    run_script('recalc_emission_per_capita.py')
+
+    population = {row['city_code']: row['population'] for row in national.rows('municipalities')}
+    rows = national.rows('municipality_kpis')
+    with_population = [row for row in rows if population[row['city_code']]]
+    expected = calc_emission_per_capita_batch(
+        [row['latest_emission_kt'] for row in with_population],
+        [population[row['city_code']] for row in with_population]
+    ).tolist()
+    assert [row['emission_per_capita'] for row in with_population] == expected
+    # 人口データのない自治体は変更しない
+    assert all(row['emission_per_capita'] is None for row in rows if not population[row['city_code']])
+    assert len(with_population) > 1000
+    assert national.count('POST', 'municipality_kpis') == 0
+    assert national.count('RPC', 'municipality_kpis') == 4
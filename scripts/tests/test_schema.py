@@ -0,0 +1,86 @@
+"""
+create_schema.sql の関数・トリガー・インデックスのテスト（実際のPostgreSQLに対して実行）
+
+PostgreSQLは pgserver（pip install pgserver）で一時ディレクトリに起動する。
+psycopg2 か pgserver がなければスキップする。
+"""
+import json
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+pytest.importorskip('pgserver')
+
+
+@pytest.fixture(scope='module')
+def conn(postgres_database):
+    connection = psycopg2.connect(postgres_database())
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO municipalities (city_code, name, prefecture_code, prefecture_name, prefecture_slug) "
+            "VALUES (%s, %s, '13', '東京都', 'tokyo')",
+            [('13101', '千代田区'), ('13102', '中央区')])
+        cursor.executemany(
+            "INSERT INTO municipality_kpis (city_code, latest_year, base_emission_kt, latest_emission_kt, "
+            "reduction_rate, actual_pace, required_pace, pace_achievement_rate, status, deviation_score) "
+            "VALUES (%s, 2022, 100, 80, -20, 2.2, 2.6, 84.6, 'at-risk', 50)",
+            [('13101',), ('13102',)])
+    connection.commit()
+    yield connection
+    connection.close()
+
+
+def fetch_kpis(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT city_code, status, deviation_score, national_rank, updated_at "
+                       "FROM municipality_kpis ORDER BY city_code")
+        return cursor.fetchall()
+
+
+def update_rows(conn, table, key, rows):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT * FROM update_rows(%s, %s, %s)", (table, key, json.dumps(rows)))
+        updated = cursor.fetchone()[0]
+    conn.commit()
+    return updated
+
+
+def test_update_rows_updates_only_given_columns(conn):
+    before = fetch_kpis(conn)
+    updated = update_rows(conn, 'municipality_kpis', 'city_code', [
+        {'city_code': '13101', 'deviation_score': 55.5, 'national_rank': 1},
+        {'city_code': '13102', 'national_rank': 2},
+        {'city_code': '99999', 'national_rank': 3},
+    ])
+
+    assert updated == 2
+    rows = fetch_kpis(conn)
+    assert [(code, status, float(score), rank) for code, status, score, rank, _ in rows] == [
+        ('13101', 'at-risk', 55.5, 1),
+        ('13102', 'at-risk', 50.0, 2),
+    ]
+    # 値が変わった行は updated_at も更新される
+    assert all(row[4] > old[4] for row, old in zip(rows, before))
+
+
+def test_unchanged_update_keeps_updated_at(conn):
+    update_rows(conn, 'municipality_kpis', 'city_code', [{'city_code': '13101', 'national_rank': 7}])
+    before = fetch_kpis(conn)
+    assert update_rows(conn, 'municipality_kpis', 'city_code', [{'city_code': '13101', 'national_rank': 7}]) == 1
+    assert fetch_kpis(conn) == before
+
+
+@pytest.mark.parametrize('query, index', [
+    ("SELECT city_code FROM municipality_kpis WHERE city_code LIKE '13%'",
+     'idx_municipality_kpis_city_code_pattern'),
+    ("SELECT * FROM prefecture_kpi_aggregates WHERE prefecture_code IN ('13', '14')",
+     'idx_municipality_kpis_prefecture'),
+])
+def test_prefecture_filters_use_index(conn, query, index):
+    with conn.cursor() as cursor:
+        cursor.execute("SET enable_seqscan = off")
+        cursor.execute(f"EXPLAIN {query}")
+        plan = '\n'.join(row[0] for row in cursor.fetchall())
+        cursor.execute("RESET enable_seqscan")
+    conn.rollback()
+    assert index in plan
@@ -0,0 +1,105 @@
+"""
+stat_cache.py のテスト
+
+Parquetキャッシュから読んだシートのセルの型が pd.read_excel(header=None) と同じで、
+文字列の団体コード（'01100'）の先頭の0が落ちないことを確認する。
+"""
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('pyarrow')
+openpyxl = pytest.importorskip('openpyxl')
+
+import stat_cache  # noqa: E402
+
+CODE_COL = 3
+HEADER_ROWS = stat_cache.DATA_START_ROW
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """キャッシュの保存先を一時ディレクトリにする"""
+    monkeypatch.setattr(stat_cache, 'STAT_CACHE_DIR', tmp_path / 'stat_cache')
+    monkeypatch.setattr(stat_cache, 'STAT_CACHE_MANIFEST', tmp_path / 'stat_cache' / 'manifest.json')
+    return tmp_path / 'stat_cache'
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    """見出し10行 + 自治体行（団体コードは文字列と数値が混在）のシート"""
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.title = 'A'
+    for i in range(HEADER_ROWS):
+        sheet.append([f"見出し{i}", f"人口{i}", f"面積{i}", "団体コード"])
+    sheet.append(['札幌市', 1973395, 1121.26, '01100'])
+    sheet.append(['千代田区', 66680, '-', '13101'])
+    sheet.append(['函館市', 251084, 677.77, 1202])  # 数値で入力されたコード
+    sheet.append(['八王子市', None, 186.38, '13201'])
+    # 見出しのない、数字だけの文字列コードの列
+    codes = book.create_sheet('B')
+    codes.append(['01100', 1121.26])
+    codes.append(['13101', 11.66])
+    path = tmp_path / 'pop.xlsx'
+    book.save(path)
+    return path
+
+
+def test_cached_cells_match_read_excel(workbook, cache_dir):
+    expected = pd.read_excel(workbook, sheet_name='A', header=None)
+
+    first = stat_cache.read_excel_cached(workbook, 'A')
+    cached = stat_cache.read_excel_cached(workbook, 'A')
+
+    assert (cache_dir / 'pop.A.raw.parquet').exists()
+    for frame in (first, cached):
+        assert list(frame.columns) == list(expected.columns)
+        for col in expected.columns:
+            for got, want in zip(frame[col].tolist(), expected[col].tolist()):
+                if pd.isna(want):
+                    assert pd.isna(got)
+                else:
+                    # 文字列は文字列、数値は数値のまま
+                    assert isinstance(got, str) == isinstance(want, str), (col, got, want)
+                    assert got == want, (col, got, want)
+
+
+def test_text_codes_keep_leading_zeros(workbook, cache_dir):
+    raw = stat_cache.read_excel_cached(workbook, 'A')
+    codes = raw[CODE_COL].tolist()[HEADER_ROWS:]
+    assert codes[0] == '01100'
+    assert codes[1] == '13101'
+
+
+def test_numeric_looking_text_column_stays_text(workbook, cache_dir):
+    raw = stat_cache.read_excel_cached(workbook, 'B', text_columns=[0])
+    assert raw[0].tolist() == ['01100', '13101']
+    assert raw[1].dtype == 'float64'
+
+
+def test_mixed_columns_keep_numbers(workbook, cache_dir):
+    raw = stat_cache.read_excel_cached(workbook, 'A')
+    area = raw[2].tolist()[HEADER_ROWS:]
+    assert area[0] == pytest.approx(1121.26) and isinstance(area[0], float)
+    assert area[1] == '-'
+    population = raw[1].tolist()[HEADER_ROWS:]
+    assert population[0] == 1973395 and isinstance(population[0], int)
+
+
+def test_code_columns_are_strings(workbook, cache_dir):
+    raw = stat_cache.read_excel_cached(workbook, 'A', text_columns=[CODE_COL])
+    codes = raw[CODE_COL].tolist()[HEADER_ROWS:]
+    assert codes == ['01100', '13101', '1202', '13201']
+
+    rows = stat_cache.extract_coded_rows(raw, CODE_COL)
+    assert rows['city_code'].tolist() == ['01100', '13101', '01202', '13201']
+
+
+def test_cache_is_rebuilt_when_source_changes(workbook, cache_dir):
+    stat_cache.read_excel_cached(workbook, 'A')
+    book = openpyxl.load_workbook(workbook)
+    book['A'].append(['新市', 1000, 10.0, '99999'])
+    book.save(workbook)
+
+    raw = stat_cache.read_excel_cached(workbook, 'A')
+    assert raw[CODE_COL].tolist()[-1] == '99999'
@@ -0,0 +1,118 @@
+"""
+db.upload_batches() / replay_dead_letters() のテスト（ローカルのPostgREST互換サーバーに対して実行）
+
+一時的なエラーだけを再送すること、デッドレターの再送が中断されても
+元のファイルが失われないことを確認する。
+"""
+import json
+import sys
+
+import pytest
+
+import db
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(db, 'RETRY_BACKOFF', 0.0)
+
+
+def emission_rows(city_code: str, count: int):
+    return [{'city_code': city_code, 'fiscal_year': 2000 + i, 'sector': '家庭', 'value_kt_co2': float(i)}
+            for i in range(count)]
+
+
+def upload(rows, dead_letter_path=None, batch_size=10):
+    return db.upload_batches(db.get_client(), 'emissions', rows, batch_size=batch_size, workers=1,
+                             on_conflict='city_code,fiscal_year,sector',
+                             sort_keys=('city_code', 'fiscal_year', 'sector'),
+                             dead_letter_path=dead_letter_path)
+
+
+def write_dead_letter(path, batches):
+    with open(path, 'w', encoding='utf-8') as f:
+        for rows in batches:
+            f.write(json.dumps({'table': 'emissions', 'on_conflict': 'city_code,fiscal_year,sector',
+                                'rows': rows}, ensure_ascii=False) + '\n')
+
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_transient_errors_are_retried(postgrest, tmp_path, status):
+    postgrest.failures['emissions'] = [status, status]
+    stats = upload(emission_rows('13101', 10), tmp_path / 'dead.ndjson')
+
+    assert stats['rows'] == 10
+    assert stats['retries'] == 2
+    assert stats['failed_batches'] == 0
+    assert len(postgrest.rows('emissions')) == 10
+    assert not (tmp_path / 'dead.ndjson').exists()
+
+
+@pytest.mark.parametrize('status', [400, 409, 422])
+def test_client_errors_go_straight_to_dead_letter(postgrest, tmp_path, status):
+    postgrest.failures['emissions'] = [status]
+    stats = upload(emission_rows('13101', 10), tmp_path / 'dead.ndjson')
+
+    assert stats['retries'] == 0
+    assert stats['failed_batches'] == 1
+    assert postgrest.count('FAIL', 'emissions') == 1
+    entries = [json.loads(line) for line in open(tmp_path / 'dead.ndjson', encoding='utf-8')]
+    assert len(entries) == 1 and len(entries[0]['rows']) == 10
+
+
+def test_replay_keeps_only_batches_that_still_fail(postgrest, tmp_path):
+    dead_letter = tmp_path / 'dead.ndjson'
+    write_dead_letter(dead_letter, [emission_rows('13101', 10), emission_rows('13102', 10)])
+    postgrest.failures['emissions'] = [400]  # 1バッチ目だけ失敗
+
+    stats = db.replay_dead_letters(db.get_client(), dead_letter, workers=1)
+
+    assert stats['rows'] == 10
+    assert stats['failed_batches'] == 1
+    entries = [json.loads(line) for line in open(dead_letter, encoding='utf-8')]
+    assert [entry['rows'][0]['city_code'] for entry in entries] == ['13101']
+    assert not dead_letter.with_name(dead_letter.name + '.tmp').exists()
+
+
+def test_replay_removes_file_when_everything_is_sent(postgrest, tmp_path):
+    dead_letter = tmp_path / 'dead.ndjson'
+    write_dead_letter(dead_letter, [emission_rows('13101', 10)])
+
+    stats = db.replay_dead_letters(db.get_client(), dead_letter, workers=1)
+
+    assert stats['rows'] == 10
+    assert not dead_letter.exists()
+    assert len(postgrest.rows('emissions')) == 10
+
+
+def test_interrupted_replay_keeps_dead_letter(postgrest, tmp_path, monkeypatch):
+    dead_letter = tmp_path / 'dead.ndjson'
+    write_dead_letter(dead_letter, [emission_rows('13101', 10), emission_rows('13102', 10)])
+    original = dead_letter.read_bytes()
+
+    def interrupted(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(db, 'upload_batches', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        db.replay_dead_letters(db.get_client(), dead_letter, workers=1)
+    assert dead_letter.read_bytes() == original
+
+
+def test_seed_replay_does_not_load_emissions(postgrest, tmp_path, monkeypatch):
+    import seed_supabase
+
+    dead_letter = tmp_path / 'dead.ndjson'
+    write_dead_letter(dead_letter, [emission_rows('13101', 5)])
+
+    def unexpected_load(*args, **kwargs):
+        raise AssertionError("再送で排出量データを読み込んだ")
+
+    monkeypatch.setattr(seed_supabase, 'EMISSIONS_DEAD_LETTER', dead_letter)
+    monkeypatch.setattr(seed_supabase, 'load_emissions_cube', unexpected_load)
+    monkeypatch.setattr(seed_supabase, 'load_municipality_info', unexpected_load)
+    monkeypatch.setattr(sys, 'argv', ['seed_supabase.py', '--replay-dead-letter', '--no-metrics'])
+    seed_supabase.main()
+
+    assert len(postgrest.rows('emissions')) == 5
+    assert not dead_letter.exists()
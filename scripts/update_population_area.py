@@ -4,30 +4,15 @@
 東京都62自治体の人口・面積データを抽出してSupabaseに投入
 """
 import pandas as pd
-import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
-
-# 環境変数読み込み
-load_dotenv()
-supabase_url = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
-supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-
-if not supabase_url or not supabase_key:
-    raise Exception('.env.localにSupabaseの環境変数が設定されていません')
-
-supabase: Client = create_client(supabase_url, supabase_key)
+from stat_cache import POPULATION_XLS, read_excel_cached, with_header
 
 # Excelファイルを読み込み
-excel_file = 'data/population_households_2022.xls'
+excel_file = POPULATION_XLS
 print(f"Reading {excel_file}...")
 
-# シートを確認
-xls = pd.ExcelFile(excel_file)
-print(f"利用可能なシート: {xls.sheet_names}\n")
-
-# 最初のシートを読み込んで構造を確認
-df = pd.read_excel(excel_file, sheet_name=0, header=None)
+# 最初のシートを読み込んで構造を確認（2回目以降はParquetキャッシュから）
+raw = read_excel_cached(excel_file, 0)
+df = raw
 print(f"データ形状: {df.shape}")
 print(f"\n最初の20行:")
 print(df.head(20))
@@ -44,7 +29,7 @@ for idx in range(min(50, len(df))):
 
 if header_row is not None:
     print(f"\nヘッダー行として {header_row} を使用します")
-    df = pd.read_excel(excel_file, sheet_name=0, header=header_row)
+    df = with_header(raw, header_row)
     print(f"\nカラム名:")
     for i, col in enumerate(df.columns):
         print(f"  {i}: {col}")
@@ -4,26 +4,14 @@
 東京都62自治体の人口・面積データを抽出してSupabaseに投入
 """
 import pandas as pd
-import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
+from stat_cache import POPULATION_XLS, read_excel_cached
 
-# 環境変数読み込み
-load_dotenv()
-supabase_url = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
-supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-
-if not supabase_url or not supabase_key:
-    raise Exception('.env.localにSupabaseの環境変数が設定されていません')
-
-supabase: Client = create_client(supabase_url, supabase_key)
-
-# Excelファイルを読み込み
-excel_file = 'data/population_households_2022.xls'
+# Excelファイルを読み込み（2回目以降はParquetキャッシュから）
+excel_file = POPULATION_XLS
 print(f"Reading {excel_file}...")
 
 # データを生で読み込み（ヘッダーなし）
-df = pd.read_excel(excel_file, sheet_name='A', header=None)
+df = read_excel_cached(excel_file, 'A')
 print(f"データ形状: {df.shape}")
 
 # 団体コードは最後の列（32列目）にあるようなので、